@@ -2,38 +2,38 @@
 API 依赖项
 """
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
 from app.core.database import get_db
-from app.core.security import decode_access_token
+from app.core.redis_client import RedisUnavailableError
+from app.core.security import decode_request_token
 from app.models.user import User
+from app.schemas.user import Principal
 from app.services.user_service import UserService
 from app.services.token_service import TokenService
-from app.utils.exceptions import UnauthorizedException
+from app.utils.exceptions import ServiceUnavailableException, UnauthorizedException
 
 
 # HTTP Bearer Token 认证
 security = HTTPBearer()
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
-) -> User:
-    """
-    获取当前认证用户
-    """
-    token = credentials.credentials
+async def _authenticate(request: Request, token: str) -> UUID:
+    """校验 token 并返回用户ID"""
+    # 解码 Token（复用限流中间件已解码的结果）
+    payload = decode_request_token(request.scope, token)
     
-    # 检查 token 是否在黑名单中
-    if await TokenService.is_token_blacklisted(token):
+    # 检查 token 是否在黑名单中；无法确认时按失败关闭处理，返回 503 而不是放行
+    try:
+        blacklisted = await TokenService.is_token_blacklisted(token, payload)
+    except RedisUnavailableError:
+        raise ServiceUnavailableException("认证服务暂不可用，请稍后再试")
+    if blacklisted:
         raise UnauthorizedException("Token 已失效，请重新登录")
     
-    # 解码 Token
-    payload = decode_access_token(token)
     if not payload:
         raise UnauthorizedException("无效的认证令牌")
     
@@ -45,8 +45,21 @@ async def get_current_user(
     if not user_id:
         raise UnauthorizedException("无效的认证令牌")
     
+    return UUID(user_id)
+
+
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+) -> User:
+    """
+    获取当前认证用户
+    """
+    user_id = await _authenticate(request, credentials.credentials)
+    
     # 获取用户
-    user = await UserService.get_user_by_id(db, UUID(user_id))
+    user = await UserService.get_user_by_id(db, user_id)
     if not user:
         raise UnauthorizedException("用户不存在")
     
@@ -56,6 +69,29 @@ async def get_current_user(
     return user
 
 
+async def get_current_principal(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+) -> Principal:
+    """
+    获取当前认证主体
+    
+    只需要用户ID/权限标记的接口使用，主体信息来自缓存；
+    会话只在缓存未命中时才取连接。
+    """
+    user_id = await _authenticate(request, credentials.credentials)
+    
+    principal = await UserService.get_principal(db, user_id)
+    if not principal:
+        raise UnauthorizedException("用户不存在")
+    
+    if not principal.is_active:
+        raise UnauthorizedException("用户已被禁用")
+    
+    return principal
+
+
 async def get_current_active_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -68,8 +104,8 @@ async def get_current_active_user(
 
 
 async def get_current_superuser(
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: Principal = Depends(get_current_principal)
+) -> Principal:
     """
     获取当前超级用户
     """
@@ -79,4 +115,3 @@ async def get_current_superuser(
             detail="权限不足"
         )
     return current_user
-
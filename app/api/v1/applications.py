@@ -8,8 +8,8 @@ from uuid import UUID
 from pydantic import BaseModel
 
 from app.core.database import get_db
-from app.api.deps import get_current_user
-from app.models.user import User
+from app.api.deps import get_current_principal
+from app.schemas.user import Principal
 from app.schemas.application import (
     ApplicationCreate,
     ApplicationUpdate,
@@ -35,7 +35,7 @@ router = APIRouter(prefix="/applications", tags=["应用管理"])
 @router.post("", response_model=ApplicationResponse, status_code=201)
 async def create_application(
     app_data: ApplicationCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -51,7 +51,7 @@ async def list_applications(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     status: Optional[str] = Query(None, pattern="^(draft|published)$"),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -77,7 +77,7 @@ async def list_applications(
 @router.get("/{app_id}", response_model=ApplicationResponse)
 async def get_application(
     app_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -93,7 +93,7 @@ async def get_application(
 @router.get("/{app_id}/config")
 async def get_application_config(
     app_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -110,35 +110,33 @@ async def get_application_config(
 async def update_application(
     app_id: UUID,
     app_data: ApplicationUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
     更新应用
     """
     app = await ApplicationService.update_application(db, app_id, current_user.id, app_data)
-    await db.commit()
     return app
 
 
 @router.delete("/{app_id}")
 async def delete_application(
     app_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
     删除应用
     """
     await ApplicationService.delete_application(db, app_id, current_user.id)
-    await db.commit()
     return {"message": "应用已删除"}
 
 
 @router.post("/{app_id}/publish", response_model=ApplicationResponse)
 async def publish_application(
     app_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
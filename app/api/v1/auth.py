@@ -9,10 +9,10 @@ from uuid import UUID
 from app.core.database import get_db
 from app.core.config import settings
 from app.core.security import create_access_token, create_refresh_token, decode_access_token
-from app.schemas.user import UserCreate, UserResponse, Token, LoginRequest
+from app.schemas.user import UserCreate, UserResponse, Token, LoginRequest, Principal
 from app.services.user_service import UserService
 from app.services.token_service import TokenService
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_current_principal
 from app.models.user import User
 from app.utils.exceptions import UnauthorizedException
 
@@ -135,7 +135,7 @@ async def refresh_token(
 
 @router.post("/logout")
 async def logout(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     authorization: str = Header(...)
 ):
     """
@@ -15,8 +15,8 @@ from app.schemas.conversation import (
 )
 from app.schemas.common import PaginatedResponse
 from app.services.conversation_service import ConversationService
-from app.api.deps import get_current_user
-from app.models.user import User
+from app.api.deps import get_current_principal
+from app.schemas.user import Principal
 
 
 class ConversationListResponse(BaseModel):
@@ -34,7 +34,7 @@ router = APIRouter(prefix="/conversations", tags=["会话管理"])
 @router.post("", response_model=ConversationResponse, status_code=201)
 async def create_conversation(
     conv_data: ConversationCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -63,7 +63,7 @@ async def list_conversations(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     status: str = Query("active", pattern="^(active|archived|deleted)$"),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -89,7 +89,7 @@ async def list_conversations(
 @router.get("/{conv_id}", response_model=ConversationResponse)
 async def get_conversation(
     conv_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -117,7 +117,7 @@ async def get_conversation(
 async def update_conversation(
     conv_id: UUID,
     conv_data: ConversationUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -144,7 +144,7 @@ async def update_conversation(
 @router.delete("/{conv_id}")
 async def delete_conversation(
     conv_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -160,7 +160,7 @@ async def get_conversation_messages(
     conv_id: UUID,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
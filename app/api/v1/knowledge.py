@@ -1,36 +1,76 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
 from app.core.database import get_db
+from app.schemas.knowledge import KnowledgeUpsertRequest
 from app.services.embedding_service import EmbeddingService
 from app.services.vector_service import vector_service
 from app.services.knowledge_store import KnowledgeStoreService
+from app.services.ingestion_service import IngestionService, UploadTooLargeError
+from app.utils import document_parser
 import hmac
 import hashlib
 import json
+from uuid import uuid4
 from app.celery_app import embed_document
 
 router = APIRouter(prefix="/knowledge", tags=["知识库"])
 
 
 @router.post("/docs")
-async def upload_doc(payload: dict, db: AsyncSession = Depends(get_db)):
+async def upload_doc(request: Request):
+    """
+    上传文档并后台入库
+
+    multipart/form-data: file（PDF/DOCX/PPTX/MD/TXT）、collection、doc_id；
+    JSON: {"text", "collection", "doc_id"}。返回 task_id，进度见 /knowledge/tasks/{task_id}。
+    """
     if not settings.ENABLE_KB:
         raise HTTPException(status_code=501, detail="知识库未启用")
-    text = str(payload.get("text", ""))
-    doc_id = payload.get("doc_id") or str(abs(hash(text)))
-    return {"doc_id": doc_id}
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > settings.KB_MAX_UPLOAD_SIZE + IngestionService.FORM_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"文件超过大小限制 {settings.KB_MAX_UPLOAD_SIZE} 字节")
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # 边接收边写入临时文件，超过大小限制时立即中止，不先缓冲整个请求体
+        try:
+            path, filename, form = await IngestionService.save_multipart(content_type, request.stream())
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        kind = document_parser.detect_type(filename)
+        collection = form.get("collection") or "default"
+        doc_id = form.get("doc_id") or uuid4().hex
+    else:
+        # 没有 Content-Length（分块传输）时也要限制大小，边读边计数
+        try:
+            payload = json.loads(await IngestionService.read_body(request.stream()))
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="请求体不是合法的 JSON")
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=400, detail="请求体必须是 JSON 对象")
+        text = str(payload.get("text", ""))
+        filename = "text.txt"
+        kind = "txt"
+        collection = payload.get("collection", "default")
+        doc_id = payload.get("doc_id") or hashlib.sha256(text.encode()).hexdigest()[:32]
+        path = IngestionService.save_text(text)
+    task_id = await IngestionService.start(path, filename, kind, collection, doc_id)
+    return {"doc_id": doc_id, "task_id": task_id}
 
 
 @router.post("/upsert")
-async def upsert_vectors(payload: dict, db: AsyncSession = Depends(get_db)):
+async def upsert_vectors(payload: KnowledgeUpsertRequest, db: AsyncSession = Depends(get_db)):
     if not settings.ENABLE_KB:
         raise HTTPException(status_code=501, detail="知识库未启用")
-    collection = payload.get("collection", "default")
-    texts = payload.get("texts", [])
-    metas_in = payload.get("metadatas", [{} for _ in texts])
+    collection = payload.collection
+    texts = payload.texts
+    metas_in = payload.metadatas if payload.metadatas is not None else [{} for _ in texts]
     metas = [{**m, "text": t} for t, m in zip(texts, metas_in)]
-    if payload.get("async"):
+    if payload.async_:
         res = embed_document.delay(texts)
         if settings.CELERY_ALWAYS_EAGER:
             vectors = res.get()
@@ -38,7 +78,10 @@ async def upsert_vectors(payload: dict, db: AsyncSession = Depends(get_db)):
             return {"task_id": res.id}
     else:
         vectors = await EmbeddingService.embed(texts)
-    await vector_service.create_collection(collection, len(vectors[0]) if vectors else 0)
+    try:
+        await vector_service.create_collection(collection, len(vectors[0]) if vectors else 0, index_type=payload.index_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     ids = []
     if hasattr(vector_service, "upsert_with_ids"):
         ids = await vector_service.upsert_with_ids(collection, vectors, metas)
@@ -61,42 +104,39 @@ async def query_vectors(payload: dict, db: AsyncSession = Depends(get_db)):
     limit = int(payload.get("limit", top_k))
     filters = payload.get("filters", {})
     qv = (await EmbeddingService.embed([query_text]))[0]
-    items = await vector_service.query(collection, qv, top_k=top_k)
+    nprobe = payload.get("nprobe")
+    # 过滤与分页下推到向量后端：先按元数据筛选候选再排序取 offset 之后的 limit 条，
+    # 避免先取 top_k 再在 Python 里过滤导致结果不足
+    try:
+        items = await vector_service.query(
+            collection,
+            qv,
+            top_k=limit,
+            nprobe=int(nprobe) if nprobe else None,
+            filters=filters or None,
+            offset=offset
+        )
+    except ValueError as e:
+        # 例如按旧版 Milvus 集合不支持的键过滤
+        raise HTTPException(status_code=400, detail=str(e))
     pks = [i.get("pk") for i in items if i.get("pk") is not None]
     if pks:
         mapped = await KnowledgeStoreService.query_by_pks(db, collection, pks)
+        by_pk = {str(m["backend_pk"]): m for m in mapped}
         merged: list = []
         for it in items:
             pk = it.get("pk")
             if pk is None:
                 merged.append(it)
             else:
-                found = next((m for m in mapped if m["backend_pk"] == pk), None)
+                found = by_pk.get(str(pk))
                 if found:
                     merged.append({**found, "score": it.get("score")})
                 else:
                     base_meta = {k: v for k, v in it.items() if k not in ("pk", "score")}
                     merged.append({"backend_pk": pk, "text": "", "metadata": base_meta, "score": it.get("score")})
-        if filters:
-            def match(m):
-                meta = m.get("metadata") or {}
-                for k, v in filters.items():
-                    if meta.get(k) != v:
-                        return False
-                return True
-            merged = [m for m in merged if match(m)]
-        sliced = merged[offset:offset+limit]
-        return {"items": sliced}
-    if filters:
-        def match2(m):
-            meta = m.get("metadata") or {}
-            for k, v in filters.items():
-                if meta.get(k) != v:
-                    return False
-            return True
-        items = [m for m in items if match2(m)]
-    sliced2 = items[offset:offset+limit]
-    return {"items": sliced2}
+        return {"items": merged}
+    return {"items": items}
 
 
 @router.get("/collections")
@@ -116,6 +156,13 @@ async def delete_collection(name: str, db: AsyncSession = Depends(get_db)):
     return {"deleted": ok}
 @router.get("/tasks/{task_id}")
 async def get_task_status(task_id: str, db: AsyncSession = Depends(get_db)):
+    progress = await IngestionService.get_progress(task_id)
+    if progress:
+        return {
+            "id": task_id,
+            **progress,
+            "ready": progress.get("state") in ("SUCCESS", "FAILURE", "REVOKED"),
+        }
     from celery.result import AsyncResult
     res = AsyncResult(task_id)
     return {"id": task_id, "state": str(res.state), "ready": bool(res.ready())}
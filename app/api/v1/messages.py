@@ -10,8 +10,8 @@ import json
 from app.core.database import get_db
 from app.schemas.message import MessageCreate, MessageUpdate, MessageResponse
 from app.services.message_service import MessageService
-from app.api.deps import get_current_user
-from app.models.user import User
+from app.api.deps import get_current_principal
+from app.schemas.user import Principal
 
 
 router = APIRouter(prefix="/conversations/{conv_id}/messages", tags=["消息管理"])
@@ -21,7 +21,7 @@ router = APIRouter(prefix="/conversations/{conv_id}/messages", tags=["消息管
 async def send_message(
     conv_id: UUID,
     message_data: MessageCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -47,7 +47,7 @@ async def send_message(
 async def send_message_stream(
     conv_id: UUID,
     message_data: MessageCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -98,7 +98,7 @@ message_router = APIRouter(prefix="/messages", tags=["消息管理"])
 @message_router.get("/{message_id}", response_model=MessageResponse)
 async def get_message(
     message_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -115,7 +115,7 @@ async def get_message(
 async def update_message_feedback(
     message_id: UUID,
     feedback_data: MessageUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -131,7 +131,7 @@ async def update_message_feedback(
 @message_router.delete("/{message_id}")
 async def delete_message(
     message_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
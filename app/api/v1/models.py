@@ -13,8 +13,8 @@ from app.schemas.model_config import (
     ModelConfigResponse
 )
 from app.services.model_config_service import ModelConfigService
-from app.api.deps import get_current_user
-from app.models.user import User
+from app.api.deps import get_current_principal
+from app.schemas.user import Principal
 
 
 router = APIRouter(prefix="/models", tags=["模型配置"])
@@ -23,7 +23,7 @@ router = APIRouter(prefix="/models", tags=["模型配置"])
 @router.post("", response_model=ModelConfigResponse, status_code=201)
 async def create_model_config(
     config_data: ModelConfigCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -34,7 +34,6 @@ async def create_model_config(
     config = await ModelConfigService.create_model_config(
         db, current_user.id, config_data
     )
-    await db.commit()
     
     # 不返回完整的 API Key
     response = ModelConfigResponse.from_orm(config)
@@ -44,7 +43,7 @@ async def create_model_config(
 @router.get("")
 async def list_model_configs(
     provider: Optional[str] = Query(None, pattern="^(openai|qwen|deepseek|siliconflow)$"),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -69,7 +68,7 @@ async def list_model_configs(
 @router.get("/{config_id}", response_model=ModelConfigResponse)
 async def get_model_config(
     config_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -90,7 +89,7 @@ async def get_model_config(
 async def update_model_config(
     config_id: UUID,
     config_data: ModelConfigUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -99,7 +98,6 @@ async def update_model_config(
     config = await ModelConfigService.update_model_config(
         db, config_id, current_user.id, config_data
     )
-    await db.commit()
     
     response = ModelConfigResponse.from_orm(config)
     return response
@@ -108,21 +106,20 @@ async def update_model_config(
 @router.delete("/{config_id}")
 async def delete_model_config(
     config_id: UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
     删除模型配置
     """
     await ModelConfigService.delete_model_config(db, config_id, current_user.id)
-    await db.commit()
     return {"message": "模型配置已删除"}
 
 
 @router.get("/default/config")
 async def get_default_model_config(
     provider: Optional[str] = Query(None, pattern="^(openai|qwen|deepseek|siliconflow)$"),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -6,10 +6,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
 from app.core.database import get_db
-from app.schemas.user import UserResponse, UserUpdate
+from app.schemas.user import UserResponse, UserUpdate, Principal
 from app.schemas.common import PaginatedResponse
 from app.services.user_service import UserService
-from app.api.deps import get_current_user, get_current_superuser
+from app.api.deps import get_current_user, get_current_principal, get_current_superuser
 from app.models.user import User
 
 
@@ -29,14 +29,13 @@ async def get_current_user_profile(
 @router.put("/me", response_model=UserResponse)
 async def update_current_user(
     user_data: UserUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db)
 ):
     """
     更新当前用户信息
     """
     user = await UserService.update_user(db, current_user.id, user_data)
-    await db.commit()
     return user
 
 
@@ -44,7 +43,7 @@ async def update_current_user(
 async def list_users(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
-    current_user: User = Depends(get_current_superuser),
+    current_user: Principal = Depends(get_current_superuser),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -65,7 +64,7 @@ async def list_users(
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(
     user_id: UUID,
-    current_user: User = Depends(get_current_superuser),
+    current_user: Principal = Depends(get_current_superuser),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -82,41 +81,38 @@ async def get_user(
 async def update_user(
     user_id: UUID,
     user_data: UserUpdate,
-    current_user: User = Depends(get_current_superuser),
+    current_user: Principal = Depends(get_current_superuser),
     db: AsyncSession = Depends(get_db)
 ):
     """
     更新用户信息（仅管理员）
     """
     user = await UserService.update_user(db, user_id, user_data)
-    await db.commit()
     return user
 
 
 @router.delete("/{user_id}")
 async def delete_user(
     user_id: UUID,
-    current_user: User = Depends(get_current_superuser),
+    current_user: Principal = Depends(get_current_superuser),
     db: AsyncSession = Depends(get_db)
 ):
     """
     删除用户（仅管理员，软删除）
     """
     await UserService.deactivate_user(db, user_id)
-    await db.commit()
     return {"message": "用户已禁用"}
 
 
 @router.post("/{user_id}/activate")
 async def activate_user(
     user_id: UUID,
-    current_user: User = Depends(get_current_superuser),
+    current_user: Principal = Depends(get_current_superuser),
     db: AsyncSession = Depends(get_db)
 ):
     """
     激活用户（仅管理员）
     """
     await UserService.activate_user(db, user_id)
-    await db.commit()
     return {"message": "用户已激活"}
 
@@ -1,7 +1,7 @@
 """
 应用配置管理
 """
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 from pydantic import field_validator
 import json
@@ -22,12 +22,33 @@ class Settings(BaseSettings):
     
     # Redis 配置
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 2.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    REDIS_AUTO_PIPELINE: bool = True  # 同一事件循环 tick 内的命令合并为一次 pipeline
+    REDIS_AUTO_PIPELINE_MAX_BATCH: int = 128
+    REDIS_CIRCUIT_FAILURE_THRESHOLD: int = 5  # 连续失败次数达到阈值后熔断
+    REDIS_CIRCUIT_PROBE_INTERVAL: float = 2.0  # 熔断期间后台探测间隔(秒)
+    
+    # 缓存配置(进程内 L1 + Redis L2)
+    CACHE_L1_ENABLED: bool = True
+    CACHE_L1_MAX_BYTES: int = 16 * 1024 * 1024  # 16MB
+    CACHE_INVALIDATION_CHANNEL: str = "cache:invalidate"
     
     # Milvus 配置(可选)
     MILVUS_HOST: str = "localhost"
     MILVUS_PORT: int = 19530
     MILVUS_USER: Optional[str] = None
     MILVUS_PASSWORD: Optional[str] = None
+    MILVUS_INDEX_TYPE: str = "hnsw"  # hnsw | ivf_flat | flat
+    MILVUS_HNSW_M: int = 16
+    MILVUS_HNSW_EF_CONSTRUCTION: int = 200
+    MILVUS_HNSW_EF: int = 64  # 检索时的 ef，不小于返回条数
+    MILVUS_IVF_NLIST: int = 1024
+    MILVUS_SCALAR_FIELDS: Dict[str, str] = {}  # 提升为标量字段的元数据键 -> 类型(VARCHAR/INT64/DOUBLE/BOOL)
+    MILVUS_INSERT_BATCH_SIZE: int = 1000
+    MILVUS_WORKERS: int = 4  # pymilvus 同步调用的线程池大小
     
     # JWT 配置
     JWT_SECRET_KEY: str
@@ -49,15 +70,64 @@ class Settings(BaseSettings):
     # Embedding 配置
     EMBEDDING_MODEL: str = "BAAI/bge-small-zh-v1.5"
     EMBEDDING_PROVIDER: Optional[str] = None
+    EMBEDDING_BATCH_SIZE: int = 64  # 单次推理的最大文本数
+    EMBEDDING_BATCH_MAX_WAIT: float = 0.005  # 合并并发请求的最长等待(秒)
+    EMBEDDING_WARMUP: bool = True  # 启用知识库时在启动阶段加载并预热模型
+    EMBEDDING_SERVER_SOCKET: Optional[str] = None  # 模型服务的 Unix socket 路径，为空时进程内推理
+    EMBEDDING_SERVER_MAX_CONNECTIONS: int = 8  # 每个 worker 到模型服务的最大连接数
+    EMBEDDING_SERVER_RETRY_INTERVAL: float = 5.0  # 模型服务连接失败后多久再重试(秒)
+    EMBEDDING_CACHE_ENABLED: bool = True  # 按 (模型, 规范化文本哈希) 缓存向量
+    EMBEDDING_CACHE_L1_SIZE: int = 10000  # 进程内 LRU 条目数
+    EMBEDDING_CACHE_REDIS: bool = True  # 是否使用 Redis 二级缓存
+    EMBEDDING_CACHE_DTYPE: str = "float32"  # Redis 中的存储精度: float32 | float16
+    EMBEDDING_CACHE_TTL: int = 30 * 24 * 3600  # Redis 缓存过期时间(秒)
     
     # 其他配置
     CORS_ORIGINS: List[str] = ["http://localhost:3000"]
     MAX_UPLOAD_SIZE: int = 10485760  # 10MB
     RATE_LIMIT_PER_MINUTE: int = 60
+    RATE_LIMIT_BURST: Optional[int] = None  # 突发容量，默认等于每分钟限额
+    RATE_LIMIT_MODE: str = "redis"  # redis: 每次请求检查 Redis | hybrid: 本地令牌桶 + Redis 批量租约
+    RATE_LIMIT_LEASE_SIZE: int = 10  # hybrid 模式每次从 Redis 租用的配额数
+    RATE_LIMIT_LEASE_TTL: float = 2.0  # 租约有效期(秒)，到期未用的配额归还 Redis
+    
+    # Token 限流（每分钟 token 数，按用户/应用计）
+    TOKEN_RATE_LIMIT_ENABLED: bool = True
+    TOKEN_RATE_LIMIT_PER_USER: int = 100000
+    TOKEN_RATE_LIMIT_PER_APPLICATION: int = 500000
+    TOKEN_RATE_LIMIT_COMPLETION_ESTIMATE: int = 512  # 未设置 max_tokens 时预估的输出 token 数
+    TOKEN_RATE_LIMIT_MAX_WAIT: float = 0.0  # 预算不足时最多排队等待秒数，0 表示直接拒绝
+    
+    # Token 黑名单本地布隆过滤器
+    TOKEN_BLACKLIST_BLOOM_ENABLED: bool = True
+    TOKEN_BLACKLIST_BLOOM_CAPACITY: int = 100000
+    TOKEN_BLACKLIST_BLOOM_ERROR_RATE: float = 0.001
+    TOKEN_BLACKLIST_CHANNEL: str = "token_blacklist:events"
+    
+    # 密码哈希线程池（bcrypt 释放 GIL，线程池即可并行）
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64  # 排队超过该数量时直接返回 503
+    
+    # 事件循环延迟监控
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL: float = 0.1  # 采样间隔(秒)
+    LOOP_MONITOR_BLOCK_THRESHOLD: float = 0.1  # 延迟超过该值视为阻塞(秒)
+    LOOP_MONITOR_CAPTURE_STACKS: Optional[bool] = None  # 阻塞时记录调用栈，默认跟随 DEBUG
+    
     ENABLE_KB: bool = False
     VECTOR_BACKEND: str = "memory"  # memory | milvus
+    VECTOR_IVF_NPROBE: int = 8  # memory 后端 IVF 索引默认探测的聚类数
+    VECTOR_STORE_DIR: Optional[str] = None  # memory 后端持久化目录（mmap 文件），为空时仅保存在内存
     CELERY_ALWAYS_EAGER: bool = True
     KB_CALLBACK_SECRET: str = "kb-callback-secret"
+    KB_MAX_UPLOAD_SIZE: int = 200 * 1024 * 1024  # 知识库文档上传上限(200MB)
+    KB_UPLOAD_DIR: Optional[str] = None  # 上传临时文件目录，默认系统临时目录
+    KB_PARSE_WORKERS: int = 2  # 文档解析进程数
+    KB_CHUNK_TOKENS: int = 512  # 每块的 token 数
+    KB_CHUNK_OVERLAP: int = 64  # 相邻块重叠的 token 数
+    KB_EMBED_BATCH_SIZE: int = 64  # 每批 embedding / 写入的块数
+    KB_INGEST_CONCURRENCY: int = 2  # 同时执行的入库任务数
+    KB_TASK_TTL: int = 86400  # 入库进度保留时间(秒)
     
     @field_validator("CORS_ORIGINS", mode="before")
     def parse_cors_origins(cls, v):
@@ -1,105 +1,437 @@
 """
 Redis 客户端管理
 """
-from typing import Optional
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 import redis.asyncio as aioredis
 from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import (
+    ConnectionError as RedisConnectionError,
+    NoScriptError,
+    TimeoutError as RedisTimeoutError,
+)
 
 from .config import settings
+from app.utils.logger import logger
+
+
+class RedisUnavailableError(RedisConnectionError):
+    """Redis 熔断中，命令未发送"""
+
+
+class RedisCircuitBreaker:
+    """
+    Redis 熔断器
+    
+    连续连接/超时失败达到阈值后熔断，熔断期间所有命令立即失败
+    （RedisUnavailableError），调用方走进程内降级逻辑；后台定期 PING，
+    恢复后自动闭合并触发恢复回调。
+    """
+    
+    # 计入熔断的异常类型（业务错误如 WRONGTYPE 不计入）
+    FAILURE_EXCEPTIONS = (RedisConnectionError, RedisTimeoutError, OSError, asyncio.TimeoutError)
+    
+    def __init__(self, failure_threshold: int, probe_interval: float):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[Callable[[], Awaitable[Any]]] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._recovery_callbacks: List[Callable[[], Awaitable[None]]] = []
+    
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+    
+    def set_probe(self, probe: Callable[[], Awaitable[Any]]):
+        """设置恢复探测函数"""
+        self._probe = probe
+    
+    def on_recovery(self, callback: Callable[[], Awaitable[None]]):
+        """注册恢复回调（熔断闭合后执行）"""
+        self._recovery_callbacks.append(callback)
+    
+    def record_success(self):
+        if not self.is_open:
+            self.failures = 0
+    
+    def record_failure(self, error: BaseException):
+        if not isinstance(error, self.FAILURE_EXCEPTIONS) or isinstance(error, RedisUnavailableError):
+            return
+        self.failures += 1
+        if not self.is_open and self.failures >= self.failure_threshold:
+            self._open(error)
+    
+    def _open(self, error: BaseException):
+        self.opened_at = time.monotonic()
+        logger.warning(f"Redis 连续失败 {self.failures} 次，进入熔断降级模式: {error}")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = loop.create_task(self._probe_until_recovered())
+    
+    async def _probe_until_recovered(self):
+        while self.is_open:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await asyncio.wait_for(self._probe(), timeout=self.probe_interval)
+            except Exception as e:
+                logger.debug(f"Redis 恢复探测失败: {e}")
+                continue
+            downtime = time.monotonic() - self.opened_at
+            self.opened_at = None
+            self.failures = 0
+            logger.info(f"Redis 已恢复，熔断关闭（持续 {downtime:.1f} 秒）")
+            for callback in self._recovery_callbacks:
+                try:
+                    await callback()
+                except Exception as e:
+                    logger.error(f"Redis 恢复回调执行失败: {e}")
+    
+    async def close(self):
+        """停止后台探测"""
+        if self._probe_task and not self._probe_task.done():
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+
+
+class LuaScript:
+    """Lua 脚本（通过 EVALSHA 执行，脚本未加载时自动 SCRIPT LOAD）"""
+    
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class AutoPipeline:
+    """
+    自动流水线
+    
+    同一事件循环 tick 内发出的命令先排队，在下一次回调时合并为一个
+    pipeline（非事务）一次性写出，减少 Redis 往返次数。
+    """
+    
+    def __init__(self, redis: Redis, max_batch: int = 128):
+        self.redis = redis
+        self.max_batch = max_batch
+        self._queue: List[Tuple[str, tuple, dict, asyncio.Future]] = []
+        self._scheduled = False
+        # 持有发送中的任务，避免被垃圾回收，完成后移除
+        self._tasks: Set[asyncio.Task] = set()
+    
+    def execute(self, command: str, *args, **kwargs) -> asyncio.Future:
+        """将命令加入队列，返回结果 Future"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((command, args, kwargs, future))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._flush)
+        return future
+    
+    def _flush(self):
+        self._scheduled = False
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: self._sent(t, batch))
+    
+    def _sent(self, task: asyncio.Task, batch: List[Tuple[str, tuple, dict, asyncio.Future]]):
+        self._tasks.discard(task)
+        # _send 意外中断时，未完成的 Future 不能一直挂起
+        if task.cancelled():
+            for *_, future in batch:
+                future.cancel()
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(f"Redis 自动流水线发送失败: {error}")
+            for *_, future in batch:
+                self._resolve(future, error=error)
+    
+    async def drain(self):
+        """等待已发出的批次完成（关闭连接前调用）"""
+        if self._queue:
+            self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+    
+    async def _send(self, batch: List[Tuple[str, tuple, dict, asyncio.Future]]):
+        if len(batch) == 1:
+            command, args, kwargs, future = batch[0]
+            try:
+                result = await getattr(self.redis, command)(*args, **kwargs)
+            except Exception as e:
+                self._resolve(future, error=e)
+            else:
+                self._resolve(future, result=result)
+            return
+        
+        pipe = self.redis.pipeline(transaction=False)
+        for command, args, kwargs, _ in batch:
+            getattr(pipe, command)(*args, **kwargs)
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            for *_, future in batch:
+                self._resolve(future, error=e)
+            return
+        finally:
+            await pipe.reset()
+        
+        for (*_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self._resolve(future, error=result)
+            else:
+                self._resolve(future, result=result)
+    
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any = None, error: Optional[Exception] = None):
+        # 调用方可能已取消等待
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
 
 
 class RedisClient:
     """Redis 客户端封装"""
     
-    def __init__(self):
+    def __init__(self, breaker: Optional[RedisCircuitBreaker] = None):
         self.redis: Optional[Redis] = None
+        # 不解码响应的连接池，用于存取二进制值（如打包的向量）
+        self.redis_binary: Optional[Redis] = None
+        self._auto_pipeline: Optional[AutoPipeline] = None
+        self.breaker = breaker or RedisCircuitBreaker(
+            settings.REDIS_CIRCUIT_FAILURE_THRESHOLD,
+            settings.REDIS_CIRCUIT_PROBE_INTERVAL
+        )
+        self.breaker.set_probe(self._ping)
+    
+    @property
+    def available(self) -> bool:
+        """Redis 是否可用（未熔断）"""
+        return not self.breaker.is_open
     
     async def connect(self):
         """连接 Redis"""
         self.redis = await aioredis.from_url(
             settings.REDIS_URL,
             encoding="utf-8",
-            decode_responses=True
+            decode_responses=True,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
         )
+        if settings.REDIS_AUTO_PIPELINE:
+            self._auto_pipeline = AutoPipeline(self.redis, settings.REDIS_AUTO_PIPELINE_MAX_BATCH)
     
     async def close(self):
         """关闭 Redis 连接"""
+        await self.breaker.close()
+        if self._auto_pipeline:
+            await self._auto_pipeline.drain()
         if self.redis:
             await self.redis.close()
+        if self.redis_binary:
+            await self.redis_binary.close()
     
-    async def get(self, key: str) -> Optional[str]:
-        """获取值"""
+    async def _binary(self) -> Redis:
+        if not self.redis_binary:
+            self.redis_binary = await aioredis.from_url(
+                settings.REDIS_URL,
+                decode_responses=False,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+            )
+        return self.redis_binary
+    
+    async def _ping(self):
+        """熔断恢复探测（绕过熔断检查）"""
         if not self.redis:
             await self.connect()
-        return await self.redis.get(key)
+        await self.redis.ping()
     
-    async def set(self, key: str, value: str, expire: Optional[int] = None):
-        """设置值"""
+    def _check_available(self):
+        if self.breaker.is_open:
+            raise RedisUnavailableError("Redis 熔断中")
+    
+    async def execute(self, command: str, *args, **kwargs) -> Any:
+        """执行命令（开启自动流水线时合并发送）"""
+        self._check_available()
+        try:
+            if not self.redis:
+                await self.connect()
+            if self._auto_pipeline:
+                result = await self._auto_pipeline.execute(command, *args, **kwargs)
+            else:
+                result = await getattr(self.redis, command)(*args, **kwargs)
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        self.breaker.record_success()
+        return result
+    
+    @asynccontextmanager
+    async def pipeline(self, transaction: bool = False) -> AsyncIterator[Pipeline]:
+        """
+        显式流水线
+        
+        Usage:
+            async with redis_client.pipeline() as pipe:
+                pipe.hset(key, mapping=data)
+                pipe.expire(key, 3600)
+        
+        退出时自动执行尚未执行的命令；需要结果时可在块内调用 await pipe.execute()。
+        """
+        self._check_available()
         if not self.redis:
             await self.connect()
-        await self.redis.set(key, value, ex=expire)
+        async with self.redis.pipeline(transaction=transaction) as pipe:
+            yield pipe
+            if pipe.command_stack:
+                try:
+                    await pipe.execute()
+                except Exception as e:
+                    self.breaker.record_failure(e)
+                    raise
+                self.breaker.record_success()
+    
+    async def get(self, key: str) -> Optional[str]:
+        """获取值"""
+        return await self.execute("get", key)
+    
+    async def set(self, key: str, value: str, expire: Optional[int] = None, nx: bool = False) -> bool:
+        """设置值（nx=True 时仅在键不存在时设置）"""
+        return bool(await self.execute("set", key, value, ex=expire, nx=nx))
     
     async def delete(self, key: str):
         """删除键"""
-        if not self.redis:
-            await self.connect()
-        await self.redis.delete(key)
+        await self.execute("delete", key)
     
     async def exists(self, key: str) -> bool:
         """检查键是否存在"""
-        if not self.redis:
-            await self.connect()
-        return await self.redis.exists(key) > 0
+        return await self.execute("exists", key) > 0
     
     async def lpush(self, key: str, *values):
         """列表左插入"""
-        if not self.redis:
-            await self.connect()
-        await self.redis.lpush(key, *values)
+        await self.execute("lpush", key, *values)
     
     async def lrange(self, key: str, start: int, end: int):
         """获取列表范围"""
-        if not self.redis:
-            await self.connect()
-        return await self.redis.lrange(key, start, end)
+        return await self.execute("lrange", key, start, end)
     
     async def ltrim(self, key: str, start: int, end: int):
         """修剪列表"""
-        if not self.redis:
-            await self.connect()
-        await self.redis.ltrim(key, start, end)
+        await self.execute("ltrim", key, start, end)
     
-    async def hset(self, name: str, key: str, value: str):
-        """哈希设置"""
-        if not self.redis:
-            await self.connect()
-        await self.redis.hset(name, key, value)
+    async def hset(
+        self,
+        name: str,
+        key: Optional[str] = None,
+        value: Optional[str] = None,
+        mapping: Optional[Dict[str, str]] = None
+    ):
+        """哈希设置（mapping 用于一次设置多个字段）"""
+        await self.execute("hset", name, key, value, mapping=mapping)
     
     async def hget(self, name: str, key: str) -> Optional[str]:
         """哈希获取"""
-        if not self.redis:
-            await self.connect()
-        return await self.redis.hget(name, key)
+        return await self.execute("hget", name, key)
     
     async def hgetall(self, name: str) -> dict:
         """获取哈希所有字段"""
-        if not self.redis:
-            await self.connect()
-        return await self.redis.hgetall(name)
+        return await self.execute("hgetall", name)
     
     async def expire(self, key: str, seconds: int):
         """设置过期时间"""
-        if not self.redis:
-            await self.connect()
-        await self.redis.expire(key, seconds)
+        await self.execute("expire", key, seconds)
     
     async def incr(self, key: str) -> int:
         """自增"""
+        return await self.execute("incr", key)
+    
+    async def zadd(self, name: str, mapping: Dict[str, float]) -> int:
+        """有序集合添加"""
+        return await self.execute("zadd", name, mapping)
+    
+    async def zrangebyscore(self, name: str, min: Any, max: Any) -> List[str]:
+        """按分数范围获取有序集合成员"""
+        return await self.execute("zrangebyscore", name, min, max)
+    
+    async def zremrangebyscore(self, name: str, min: Any, max: Any) -> int:
+        """按分数范围删除有序集合成员"""
+        return await self.execute("zremrangebyscore", name, min, max)
+    
+    async def mget_bytes(self, keys: List[str]) -> List[Optional[bytes]]:
+        """批量获取二进制值（不做解码）"""
+        self._check_available()
+        try:
+            result = await (await self._binary()).mget(keys)
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        self.breaker.record_success()
+        return result
+    
+    async def set_many_bytes(self, mapping: Dict[str, bytes], expire: Optional[int] = None):
+        """批量设置二进制值（一次流水线往返）"""
+        self._check_available()
+        try:
+            async with (await self._binary()).pipeline(transaction=False) as pipe:
+                for key, value in mapping.items():
+                    pipe.set(key, value, ex=expire)
+                await pipe.execute()
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        self.breaker.record_success()
+    
+    async def publish(self, channel: str, message: str) -> int:
+        """发布消息"""
+        return await self.execute("publish", channel, message)
+    
+    async def eval(self, script: str, numkeys: int, *keys_and_args) -> Any:
+        """执行 Lua 脚本"""
+        return await self.execute("eval", script, numkeys, *keys_and_args)
+    
+    async def run_script(self, script: LuaScript, keys: List[str], args: List[Any]) -> Any:
+        """通过 EVALSHA 执行脚本，一次往返"""
+        try:
+            return await self.execute("evalsha", script.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            await self.execute("script_load", script.source)
+            return await self.execute("evalsha", script.sha, len(keys), *keys, *args)
+    
+    async def pubsub(self):
+        """获取发布订阅对象"""
+        self._check_available()
         if not self.redis:
             await self.connect()
-        return await self.redis.incr(key)
-
+        return self.redis.pubsub()
 
-# 全局 Redis 客户端实例
-redis_client = RedisClient()
 
+# 全局熔断器与 Redis 客户端实例
+redis_breaker = RedisCircuitBreaker(
+    settings.REDIS_CIRCUIT_FAILURE_THRESHOLD,
+    settings.REDIS_CIRCUIT_PROBE_INTERVAL
+)
+redis_client = RedisClient(redis_breaker)
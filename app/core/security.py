@@ -1,15 +1,23 @@
 """
 安全相关功能：密码加密、JWT Token 生成与验证
 """
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, MutableMapping, Tuple, TypeVar
 from jose import JWTError, jwt
+import asyncio
 import bcrypt
 from cryptography.fernet import Fernet
 import base64
+import hashlib
+import time
 import uuid
 
 from .config import settings
+from app.utils.exceptions import ServiceUnavailableException
+
+T = TypeVar("T")
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -36,6 +44,56 @@ def get_password_hash(password: str) -> str:
     return hashed.decode('utf-8')
 
 
+class PasswordHashPool:
+    """
+    bcrypt 线程池
+    
+    bcrypt 每次计算耗时数十到数百毫秒，在事件循环中同步执行会阻塞同一 worker
+    上的所有请求（包括流式响应）。bcrypt 计算期间释放 GIL，放到线程池即可并行；
+    排队数量有上限，登录风暴时超出部分直接返回 503，而不是无限堆积。
+    """
+    
+    _executor: Optional[ThreadPoolExecutor] = None
+    _pending = 0
+    
+    @staticmethod
+    async def run(func: Callable[..., T], *args) -> T:
+        """在线程池中执行，队列已满时抛出 ServiceUnavailableException"""
+        limit = settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE
+        if PasswordHashPool._pending >= limit:
+            raise ServiceUnavailableException("登录请求过多，请稍后再试")
+        if PasswordHashPool._executor is None:
+            PasswordHashPool._executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                thread_name_prefix="bcrypt"
+            )
+        
+        PasswordHashPool._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(PasswordHashPool._executor, func, *args)
+        finally:
+            PasswordHashPool._pending -= 1
+    
+    @staticmethod
+    def shutdown():
+        """关闭线程池（应用关闭时调用）"""
+        executor = PasswordHashPool._executor
+        PasswordHashPool._executor = None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """验证密码（在线程池中执行，不阻塞事件循环）"""
+    return await PasswordHashPool.run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """生成密码哈希（在线程池中执行，不阻塞事件循环）"""
+    return await PasswordHashPool.run(get_password_hash, password)
+
+
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """
     生成 JWT Access Token
@@ -98,6 +156,12 @@ def create_refresh_token(data: Dict[str, Any]) -> str:
     return encoded_jwt
 
 
+# 已验证 token 的声明缓存：token 哈希 -> (过期时间戳, 声明)
+# 热点 token 在过期前无需重复验签；缓存的声明为共享对象，调用方不应修改
+_decoded_tokens: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_DECODED_TOKENS_MAX = 10000
+
+
 def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
     """
     解码 JWT Token
@@ -108,15 +172,52 @@ def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
     Returns:
         解码后的数据，失败返回 None
     """
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = _decoded_tokens.get(cache_key)
+    if cached is not None:
+        if cached[0] > time.time():
+            _decoded_tokens.move_to_end(cache_key)
+            return cached[1]
+        del _decoded_tokens[cache_key]
+    
     try:
         payload = jwt.decode(
             token,
             settings.JWT_SECRET_KEY,
             algorithms=[settings.JWT_ALGORITHM]
         )
-        return payload
     except JWTError:
         return None
+    
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        _decoded_tokens[cache_key] = (float(exp), payload)
+        if len(_decoded_tokens) > _DECODED_TOKENS_MAX:
+            _decoded_tokens.popitem(last=False)
+    return payload
+
+
+def decode_request_token(scope: MutableMapping[str, Any], token: str) -> Optional[Dict[str, Any]]:
+    """
+    解码请求携带的 JWT Token（每个请求只解码一次）
+    
+    结果以 (token, 声明) 保存在 scope["state"]["token_claims"]（即 request.state.token_claims），
+    限流中间件、黑名单检查和 get_current_user 共享同一份结果。
+    
+    Args:
+        scope: ASGI scope（依赖中可传 request.scope）
+        token: JWT token 字符串
+    
+    Returns:
+        解码后的数据，失败返回 None
+    """
+    state = scope.setdefault("state", {})
+    cached = state.get("token_claims")
+    if cached is not None and cached[0] == token:
+        return cached[1]
+    payload = decode_access_token(token)
+    state["token_claims"] = (token, payload)
+    return payload
 
 
 class APIKeyEncryption:
@@ -2,6 +2,7 @@
 FastAPI 应用主入口
 """
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from sqlalchemy.exc import SQLAlchemyError
@@ -11,7 +12,15 @@ from starlette.staticfiles import StaticFiles
 from app.core.config import settings
 from app.core.database import init_db, close_db
 from app.core.redis_client import redis_client
+from app.core.security import PasswordHashPool
+from app.services.cache_service import CacheService
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_service import embedding_engine
+from app.services.ingestion_service import IngestionService
+from app.services.token_service import TokenService
+from app.services.vector_service import vector_service
 from app.utils.logger import logger
+from app.utils.loop_monitor import loop_monitor
 from app.utils.exceptions import BaseAPIException
 from app.middleware.error_handler import (
     api_exception_handler,
@@ -39,6 +48,10 @@ async def lifespan(app: FastAPI):
     # 启动时执行
     logger.info("应用启动中...")
     
+    # 启动事件循环延迟监控
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    
     # 初始化数据库
     # await init_db()  # 注释掉，使用 Alembic 管理迁移
     logger.info("数据库连接已建立")
@@ -47,6 +60,16 @@ async def lifespan(app: FastAPI):
     await redis_client.connect()
     logger.info("Redis 连接已建立")
     
+    # 启动 L1 缓存失效监听
+    await CacheService.start_invalidation_listener()
+    
+    # 启动 Token 黑名单布隆过滤器同步
+    await TokenService.start_blacklist_listener()
+    
+    # 加载并预热 Embedding 模型（使用模型服务时由服务进程负责）
+    if settings.ENABLE_KB and settings.EMBEDDING_WARMUP and not settings.EMBEDDING_SERVER_SOCKET:
+        await embedding_engine.warmup()
+    
     logger.info(f"{settings.APP_NAME} v{settings.APP_VERSION} 启动成功")
     
     yield
@@ -58,9 +81,31 @@ async def lifespan(app: FastAPI):
     await close_db()
     logger.info("数据库连接已关闭")
     
+    # 停止 L1 缓存失效监听
+    await CacheService.stop_invalidation_listener()
+    
+    # 停止 Token 黑名单同步
+    await TokenService.stop_blacklist_listener()
+    
+    # 关闭密码哈希线程池
+    PasswordHashPool.shutdown()
+    
+    # 停止入库任务与解析进程池
+    IngestionService.shutdown()
+    
+    # 停止 Embedding 工作线程
+    embedding_engine.stop()
+    
+    # 关闭向量库线程池
+    if hasattr(vector_service, "close"):
+        vector_service.close()
+    
     # 关闭 Redis 连接
     await redis_client.close()
     logger.info("Redis 连接已关闭")
+    
+    # 停止事件循环延迟监控
+    await loop_monitor.stop()
 
 
 # 创建 FastAPI 应用
@@ -116,6 +161,15 @@ async def health_check():
     }
 
 
+@app.get("/metrics", tags=["健康检查"], response_class=PlainTextResponse)
+async def metrics():
+    """运行指标（Prometheus 文本格式）"""
+    return PlainTextResponse(
+        loop_monitor.render_prometheus() + embedding_cache.render_prometheus(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
 # 注册 v1 API 路由
 app.include_router(auth_router, prefix="/api/v1")
 app.include_router(users_router, prefix="/api/v1")
@@ -1,176 +1,659 @@
 """
 API 限流中间件
 """
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from typing import Optional
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern, Tuple
+import asyncio
+import math
+import re
 import time
 
-from app.core.redis_client import redis_client
+from app.core.redis_client import redis_client, redis_breaker, LuaScript
 from app.core.config import settings
+from app.core.security import decode_request_token
+from app.utils.exceptions import RateLimitException
 from app.utils.logger import logger
 
 
-class RateLimiterMiddleware(BaseHTTPMiddleware):
-    """API 限流中间件"""
+class RateLimitResult(NamedTuple):
+    """限流检查结果"""
+    allowed: bool
+    limit: int           # 每分钟限额
+    remaining: int       # 当前可立即使用的次数
+    reset_after: float   # 额度完全恢复所需秒数
+    retry_after: float   # 被拒绝时需等待的秒数
+
+
+class RouteLimitResolver:
+    """
+    按路由模板解析限流规则
+    
+    首次请求时把应用的所有路由模板编译为一个正则（每个模板一个命名分组），
+    之后每个请求只需一次正则匹配即可得到模板及其限流规则，
+    /conversations/{conv_id}/messages 等带参数的路径共享同一个限流桶。
+    """
+    
+    # 未匹配任何路由的请求共用一个桶，避免随机路径撑大 Redis 键空间
+    UNMATCHED = "__unmatched__"
+    
+    # 不限流的路由模板
+    SKIP_TEMPLATES = {
+        "/docs",
+        "/docs/oauth2-redirect",
+        "/redoc",
+        "/openapi.json",
+        "/health",
+        "/metrics",
+        "/",
+    }
+    SKIP_PREFIXES = ("/ui",)
+    
+    _PARAM_RE = re.compile(r"{([a-zA-Z_][a-zA-Z0-9_]*)(:[a-zA-Z_][a-zA-Z0-9_]*)?}")
+    
+    def __init__(self, default_rule: Tuple[int, int]):
+        self.default_rule = default_rule
+        self._pattern: Optional[Pattern] = None
+        self._templates: List[str] = []
+        self._rules: Dict[str, Tuple[int, int]] = {}
+    
+    def resolve(self, app, path: str) -> Tuple[Optional[str], Tuple[int, int]]:
+        """
+        解析请求路径
+        
+        Returns:
+            (路由模板, (每分钟次数, 突发容量))，无需限流时模板为 None
+        """
+        if self._pattern is None:
+            self._compile(app)
+        if path.startswith(self.SKIP_PREFIXES):
+            return None, self.default_rule
+        match = self._pattern.match(path) if self._templates else None
+        if not match:
+            return self.UNMATCHED, self.default_rule
+        template = self._templates[int(match.lastgroup[1:])]
+        if template in self.SKIP_TEMPLATES:
+            return None, self.default_rule
+        return template, self._rules[template]
+    
+    def _compile(self, app):
+        templates: List[str] = []
+        for route in getattr(app, "routes", []):
+            template = getattr(route, "path", None)
+            if template and getattr(route, "path_regex", None) is not None and template not in templates:
+                templates.append(template)
+        parts = [f"(?P<r{i}>{self._template_regex(t)})" for i, t in enumerate(templates)]
+        self._templates = templates
+        self._rules = {t: self._rule_for(t) for t in templates}
+        self._pattern = re.compile("|".join(parts))
+    
+    def _template_regex(self, template: str) -> str:
+        regex, last = "", 0
+        for m in self._PARAM_RE.finditer(template):
+            regex += re.escape(template[last:m.start()])
+            regex += ".*" if m.group(2) == ":path" else "[^/]+"
+            last = m.end()
+        return regex + re.escape(template[last:]) + "$"
     
-    def __init__(self, app, rate_limit: int = None):
-        super().__init__(app)
+    def _rule_for(self, template: str) -> Tuple[int, int]:
+        """精确匹配优先，其次取最长前缀匹配的配置"""
+        limits = AdvancedRateLimiter.ENDPOINT_LIMITS
+        if template in limits:
+            return limits[template]
+        prefixes = [p for p in limits if template.startswith(p.rstrip("/") + "/")]
+        if prefixes:
+            return limits[max(prefixes, key=len)]
+        return self.default_rule
+
+
+class RateLimiterMiddleware:
+    """
+    API 限流中间件（纯 ASGI 实现）
+    
+    不经过 BaseHTTPMiddleware 的任务与队列封装：只在 http.response.start
+    上追加限流响应头，响应体（包括 SSE 流）原样透传。
+    """
+    
+    def __init__(self, app: ASGIApp, rate_limit: int = None):
+        self.app = app
         self.rate_limit = rate_limit or settings.RATE_LIMIT_PER_MINUTE
+        self.resolver = RouteLimitResolver(
+            (self.rate_limit, settings.RATE_LIMIT_BURST or self.rate_limit)
+        )
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         """处理请求"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # 跳过特定路径的限流
-        if self._should_skip_rate_limit(request.url.path):
-            return await call_next(request)
+        # 按路由模板解析限流规则，跳过文档、健康检查等路由
+        template, (rate, burst) = self.resolver.resolve(scope.get("app"), scope["path"])
+        if template is None:
+            await self.app(scope, receive, send)
+            return
         
         # 获取客户端标识
-        client_id = await self._get_client_id(request)
+        client_id = self._get_client_id(scope)
         if not client_id:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
         
         # 端点级限流
-        limit = self._get_endpoint_limit(request.url.path)
-        from app.middleware.rate_limiter import AdvancedRateLimiter
-        is_allowed, remaining = await AdvancedRateLimiter.check_limit(client_id, request.url.path, default_limit=limit)
+        result = await AdvancedRateLimiter.check_limit(client_id, template, rate, burst)
+        rate_headers = self._rate_limit_headers(result)
         
-        if not is_allowed:
-            logger.warning(f"Rate limit exceeded for {client_id} on {request.url.path}")
-            raise HTTPException(
+        if not result.allowed:
+            logger.warning(f"Rate limit exceeded for {client_id} on {template}")
+            retry_after = max(1, math.ceil(result.retry_after))
+            # 与 api_exception_handler 相同的错误响应格式
+            response = JSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"请求过于频繁，请稍后再试。限制：{limit}次/分钟",
-                headers={"Retry-After": "60"}
+                content={
+                    "code": status.HTTP_429_TOO_MANY_REQUESTS,
+                    "message": f"请求过于频繁，请稍后再试。限制：{rate}次/分钟",
+                    "detail": {"retry_after": retry_after}
+                },
+                headers={**rate_headers, "Retry-After": str(retry_after)}
             )
+            await response(scope, receive, send)
+            return
         
-        # 处理请求
-        response = await call_next(request)
-        
-        # 添加限流信息到响应头
-        response.headers["X-RateLimit-Limit"] = str(limit)
-        response.headers["X-RateLimit-Remaining"] = str(remaining)
-        response.headers["X-RateLimit-Reset"] = str(int(time.time()) + 60)
-        
-        return response
-    
-    def _should_skip_rate_limit(self, path: str) -> bool:
-        """判断是否跳过限流"""
-        skip_paths = [
-            "/docs",
-            "/redoc",
-            "/openapi.json",
-            "/health",
-            "/",
-        ]
-        return any(path.startswith(skip_path) for skip_path in skip_paths)
-
-    def _get_endpoint_limit(self, path: str) -> int:
-        """获取端点对应的限流阈值"""
-        from app.middleware.rate_limiter import AdvancedRateLimiter
-        for pattern, pattern_limit in AdvancedRateLimiter.ENDPOINT_LIMITS.items():
-            if path.startswith(pattern):
-                return pattern_limit
-        return self.rate_limit
-    
-    async def _get_client_id(self, request: Request) -> Optional[str]:
+        async def send_with_rate_headers(message: Message):
+            # 添加限流信息到响应头
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in rate_headers.items():
+                    headers.append(name, value)
+            await send(message)
+        
+        await self.app(scope, receive, send_with_rate_headers)
+    
+    @staticmethod
+    def _rate_limit_headers(result: RateLimitResult) -> Dict[str, str]:
+        return {
+            "X-RateLimit-Limit": str(result.limit),
+            "X-RateLimit-Remaining": str(result.remaining),
+            "X-RateLimit-Reset": str(int(time.time() + math.ceil(result.reset_after))),
+        }
+    
+    def _get_client_id(self, scope: Scope) -> Optional[str]:
         """获取客户端标识"""
         # 优先使用用户ID（如果已认证）
-        auth_header = request.headers.get("Authorization")
+        auth_header = Headers(scope=scope).get("authorization")
         if auth_header and auth_header.startswith("Bearer "):
-            from app.core.security import decode_access_token
             token = auth_header.replace("Bearer ", "")
-            payload = decode_access_token(token)
+            payload = decode_request_token(scope, token)
             if payload:
                 return f"user:{payload.get('sub')}"
         
         # 使用 IP 地址
-        client_ip = request.client.host if request.client else "unknown"
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
         return f"ip:{client_ip}"
+
+
+class LocalTokenBucket:
+    """进程内令牌桶"""
+    
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+    
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+    
+    def consume(self, amount: float = 1) -> bool:
+        """尝试消费令牌"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+
+class LocalRateLimiter:
+    """
+    进程内限流器（Redis 熔断时的降级方案）
+    
+    每个 worker 独立计数，多 worker 部署时总体限额会放大为 worker 数倍，
+    仅用于 Redis 故障期间兜底。
+    """
+    
+    MAX_BUCKETS = 10000
+    _buckets: "OrderedDict[str, LocalTokenBucket]" = OrderedDict()
+    
+    @staticmethod
+    def check(key: str, rate: int, burst: int, period: int = 60) -> RateLimitResult:
+        """检查限流"""
+        buckets = LocalRateLimiter._buckets
+        bucket = buckets.get(key)
+        if bucket is None or bucket.capacity != burst:
+            bucket = LocalTokenBucket(burst, rate / period)
+            buckets[key] = bucket
+            if len(buckets) > LocalRateLimiter.MAX_BUCKETS:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        allowed = bucket.consume()
+        missing = bucket.capacity - bucket.tokens
+        retry_after = 0.0 if allowed else (1 - bucket.tokens) / bucket.rate
+        return RateLimitResult(allowed, rate, int(bucket.tokens), missing / bucket.rate, retry_after)
+
+
+class _Lease:
+    """本地持有的 Redis 配额租约"""
+    
+    __slots__ = ("permits", "expires_at", "denied_until", "reset_after")
+    
+    def __init__(self):
+        self.permits = 0
+        self.expires_at = 0.0
+        self.denied_until = 0.0
+        self.reset_after = 0.0
+
+
+class HybridRateLimiter:
+    """
+    混合限流器：本地令牌 + Redis 批量租约
+    
+    每个 worker 按客户端从 Redis 的 GCRA 桶中一次租用一批配额，在本地扣减，
+    租约到期时把未用完的配额在下一次租用时归还。热点客户端绝大多数请求
+    无需访问 Redis；被拒绝的客户端在 retry_after 内也直接在本地拒绝。
+    全局限额在各 worker 之间近似准确（误差不超过 worker 数 × 租约大小）。
+    """
+    
+    MAX_LEASES = 10000
+    _leases: "OrderedDict[str, _Lease]" = OrderedDict()
+    _inflight: Dict[str, asyncio.Future] = {}
+    
+    # KEYS[1]: 限流键
+    # ARGV[1]: 发放间隔（秒/次）  ARGV[2]: 突发容量  ARGV[3]: 申请数量  ARGV[4]: 归还数量
+    # 返回: {获得数量, 需等待秒数, 完全恢复秒数}
+    LEASE_SCRIPT = LuaScript("""
+local emission_interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local returned = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tolerance = emission_interval * burst
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat then
+    tat = now
+end
+tat = math.max(now, tat - returned * emission_interval)
+
+local available = math.floor((tolerance - (tat - now)) / emission_interval)
+local granted = math.min(requested, available)
+if granted <= 0 then
+    if tat > now then
+        redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000))
+    end
+    return {0, tostring(tat - tolerance + emission_interval - now), tostring(tat - now)}
+end
+
+local new_tat = tat + granted * emission_interval
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {granted, '0', tostring(new_tat - now)}
+""")
+    
+    @staticmethod
+    async def check(key: str, rate: int, burst: int) -> RateLimitResult:
+        """检查限流（优先消费本地租约）"""
+        while True:
+            lease = HybridRateLimiter._leases.get(key)
+            now = time.monotonic()
+            if lease is not None:
+                if lease.expires_at > now and lease.permits > 0:
+                    lease.permits -= 1
+                    return RateLimitResult(True, rate, lease.permits, lease.reset_after, 0.0)
+                if lease.denied_until > now:
+                    retry_after = lease.denied_until - now
+                    return RateLimitResult(False, rate, 0, lease.reset_after, retry_after)
+            
+            inflight = HybridRateLimiter._inflight.get(key)
+            if inflight is None:
+                break
+            # 同一个键只有一个协程去 Redis 续租，其余等待后重新尝试本地扣减
+            await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        HybridRateLimiter._inflight[key] = future
+        try:
+            return await HybridRateLimiter._renew(key, rate, burst)
+        finally:
+            HybridRateLimiter._inflight.pop(key, None)
+            future.set_result(None)
+    
+    @staticmethod
+    async def _renew(key: str, rate: int, burst: int) -> RateLimitResult:
+        leases = HybridRateLimiter._leases
+        lease = leases.get(key)
+        if lease is None:
+            lease = _Lease()
+            leases[key] = lease
+            if len(leases) > HybridRateLimiter.MAX_LEASES:
+                leases.popitem(last=False)
+        else:
+            leases.move_to_end(key)
+        
+        # 租约大小不超过突发容量的一半，给其他 worker 留出配额
+        lease_size = max(1, min(settings.RATE_LIMIT_LEASE_SIZE, burst // 2))
+        returned = lease.permits
+        lease.permits = 0
+        granted, retry_after, reset_after = await redis_client.run_script(
+            HybridRateLimiter.LEASE_SCRIPT,
+            keys=[key],
+            args=[60.0 / rate, burst, lease_size, returned]
+        )
+        granted, retry_after, reset_after = int(granted), float(retry_after), float(reset_after)
+        
+        now = time.monotonic()
+        lease.reset_after = reset_after
+        if granted <= 0:
+            lease.denied_until = now + retry_after
+            return RateLimitResult(False, rate, 0, reset_after, retry_after)
+        
+        lease.permits = granted - 1
+        lease.expires_at = now + settings.RATE_LIMIT_LEASE_TTL
+        lease.denied_until = 0.0
+        return RateLimitResult(True, rate, lease.permits, reset_after, 0.0)
+
+
+class AdvancedRateLimiter:
+    """高级限流器（GCRA，支持不同端点不同限制）"""
     
-    async def _check_rate_limit(self, client_id: str, endpoint: str) -> tuple[bool, int]:
+    # 端点限流配置（路由模板）：(每分钟次数, 突发容量)
+    # 未列出的模板使用最长前缀匹配的配置
+    ENDPOINT_LIMITS = {
+        "/api/v1/auth/register": (5, 5),
+        "/api/v1/auth/login": (10, 5),
+        "/api/v1/conversations": (30, 10),
+        "/api/v1/conversations/{conv_id}/messages": (20, 5),
+        "/api/v1/conversations/{conv_id}/messages/stream": (15, 5),
+        "/api/v1/messages": (20, 5),
+    }
+    
+    # GCRA（通用信元速率算法）：判定与更新在一次 EVALSHA 中原子完成
+    # KEYS[1]: 限流键，保存理论到达时间 TAT
+    # ARGV[1]: 发放间隔（秒/次）  ARGV[2]: 突发容量  ARGV[3]: 本次消耗
+    # 返回: {是否允许, 剩余次数, 需等待秒数, 完全恢复秒数}
+    GCRA_SCRIPT = LuaScript("""
+local emission_interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local quantity = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tolerance = emission_interval * burst
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+
+local new_tat = tat + emission_interval * quantity
+local diff = now - (new_tat - tolerance)
+if diff < 0 then
+    local remaining = math.floor((tolerance - (tat - now)) / emission_interval)
+    return {0, remaining, tostring(-diff), tostring(tat - now)}
+end
+
+local reset_after = new_tat - now
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(reset_after * 1000))
+return {1, math.floor(diff / emission_interval), '0', tostring(reset_after)}
+""")
+    
+    @staticmethod
+    async def check_limit(
+        client_id: str,
+        endpoint: str,
+        rate: int = 60,
+        burst: Optional[int] = None
+    ) -> RateLimitResult:
         """
-        检查限流
+        检查特定端点的限流
+        
+        Args:
+            client_id: 客户端标识
+            endpoint: API端点（路由模板）
+            rate: 每分钟允许的请求数
+            burst: 突发容量，默认等于 rate
         
         Returns:
-            (是否允许, 剩余次数)
+            限流检查结果
         """
-        # 使用滑动窗口算法
+        burst = burst or rate
         key = f"rate_limit:{client_id}:{endpoint}"
-        current_time = int(time.time())
-        window_start = current_time - 60  # 1分钟窗口
+        
+        # Redis 熔断时降级为进程内令牌桶
+        if redis_breaker.is_open:
+            return LocalRateLimiter.check(key, rate, burst)
         
         try:
-            # 获取当前计数
-            count_str = await redis_client.get(key)
-            count = int(count_str) if count_str else 0
-            
-            if count >= self.rate_limit:
-                return False, 0
-            
-            # 增加计数
-            new_count = await redis_client.incr(key)
-            
-            # 设置过期时间（首次）
-            if new_count == 1:
-                await redis_client.expire(key, 60)
-            
-            remaining = max(0, self.rate_limit - new_count)
-            return True, remaining
+            if settings.RATE_LIMIT_MODE == "hybrid":
+                return await HybridRateLimiter.check(key, rate, burst)
             
+            allowed, remaining, retry_after, reset_after = await redis_client.run_script(
+                AdvancedRateLimiter.GCRA_SCRIPT,
+                keys=[key],
+                args=[60.0 / rate, burst, 1]
+            )
+            return RateLimitResult(
+                bool(allowed), rate, int(remaining), float(reset_after), float(retry_after)
+            )
         except Exception as e:
-            logger.error(f"Rate limit check error: {e}")
-            # 限流检查失败时允许请求通过
-            return True, self.rate_limit
+            logger.error(f"Advanced rate limit check error: {e}")
+            return LocalRateLimiter.check(key, rate, burst)
 
 
-class AdvancedRateLimiter:
-    """高级限流器（支持不同端点不同限制）"""
+class TokenReservation(NamedTuple):
+    """Token 预算预留"""
+    budgets: List[Tuple[str, int]]  # (限流键, 每分钟 token 数)
+    tokens: int
+
+
+class TokenRateLimiter:
+    """
+    Token 限流器（按用户/应用的每分钟 token 数）
     
-    # 端点限流配置
-    ENDPOINT_LIMITS = {
-        "/api/v1/auth/register": 5,
-        "/api/v1/auth/login": 10,
-        "/api/v1/conversations": 30,
-        "/api/v1/messages": 20,
-        "/api/v1/messages/stream": 15,
-    }
+    调用模型前按提示词估算 + 预期输出预留 token，预算不足时在调用前拒绝；
+    响应返回后按实际用量（或流式输出的估算）结算差额。
+    复用 GCRA：每个 token 视为一次“请求”，突发容量为一分钟的预算。
+    """
+    
+    # 多个键（用户 + 应用）同时满足才扣减，force=1 时不做判定直接调整（结算/退还）
+    # KEYS[1..n]: 限流键
+    # ARGV[2i-1]: 第 i 个键的发放间隔（秒/token）  ARGV[2i]: 第 i 个键的突发容量
+    # ARGV[2n+1]: 本次 token 数（可为负）  ARGV[2n+2]: force
+    # 返回: {是否允许, 需等待秒数}
+    RESERVE_SCRIPT = LuaScript("""
+local n = #KEYS
+local quantity = tonumber(ARGV[2 * n + 1])
+local force = tonumber(ARGV[2 * n + 2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local tats = {}
+local wait = 0
+for i = 1, n do
+    local emission_interval = tonumber(ARGV[2 * i - 1])
+    local tolerance = emission_interval * tonumber(ARGV[2 * i])
+    local tat = tonumber(redis.call('GET', KEYS[i]))
+    if not tat or tat < now then
+        tat = now
+    end
+    local new_tat = math.max(now, tat + emission_interval * quantity)
+    local diff = now - (new_tat - tolerance)
+    if force == 0 and diff < 0 and -diff > wait then
+        wait = -diff
+    end
+    tats[i] = new_tat
+end
+
+if wait > 0 then
+    return {0, tostring(wait)}
+end
+
+for i = 1, n do
+    local ttl = math.ceil((tats[i] - now) * 1000)
+    if ttl > 0 then
+        redis.call('SET', KEYS[i], tostring(tats[i]), 'PX', ttl)
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+return {1, '0'}
+""")
+    
+    MAX_BUCKETS = 10000
+    _buckets: "OrderedDict[str, LocalTokenBucket]" = OrderedDict()
     
     @staticmethod
-    async def check_limit(client_id: str, endpoint: str, default_limit: int = 60) -> tuple[bool, int]:
+    def estimate_tokens(text: str) -> int:
+        """粗略估算 token 数：ASCII 约 4 字符/token，中文等约 1 字符/token"""
+        if not text:
+            return 0
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+    
+    @staticmethod
+    def estimate_messages(messages: List[Dict[str, str]]) -> int:
+        """估算消息列表的提示词 token 数（每条消息额外约 4 个格式 token）"""
+        return sum(
+            TokenRateLimiter.estimate_tokens(msg.get("content") or "") + 4
+            for msg in messages
+        )
+    
+    @staticmethod
+    def budgets_for(user_id: Any, application_id: Optional[Any] = None) -> List[Tuple[str, int]]:
+        """获取本次调用需要扣减的预算"""
+        budgets = [(f"token_limit:user:{user_id}", settings.TOKEN_RATE_LIMIT_PER_USER)]
+        if application_id:
+            budgets.append(
+                (f"token_limit:app:{application_id}", settings.TOKEN_RATE_LIMIT_PER_APPLICATION)
+            )
+        return [(key, limit) for key, limit in budgets if limit > 0]
+    
+    @staticmethod
+    async def reserve(
+        user_id: Any,
+        application_id: Optional[Any],
+        tokens: int
+    ) -> Optional[TokenReservation]:
         """
-        检查特定端点的限流
+        预留 token 预算
         
         Args:
-            client_id: 客户端标识
-            endpoint: API端点
-            default_limit: 默认限制
+            user_id: 用户ID
+            application_id: 应用ID（使用应用模板时）
+            tokens: 预估 token 数
         
         Returns:
-            (是否允许, 剩余次数)
+            预留记录，用于调用结束后结算；未启用时返回 None
+        
+        Raises:
+            RateLimitException: 预算不足且排队等待超时
         """
-        # 获取该端点的限流配置
-        limit = default_limit
-        for pattern, pattern_limit in AdvancedRateLimiter.ENDPOINT_LIMITS.items():
-            if endpoint.startswith(pattern):
-                limit = pattern_limit
+        if not settings.TOKEN_RATE_LIMIT_ENABLED:
+            return None
+        budgets = TokenRateLimiter.budgets_for(user_id, application_id)
+        if not budgets:
+            return None
+        
+        # 单次请求最多预留一分钟的预算，否则超大请求永远无法通过
+        tokens = max(1, min(tokens, min(limit for _, limit in budgets)))
+        deadline = time.monotonic() + settings.TOKEN_RATE_LIMIT_MAX_WAIT
+        while True:
+            allowed, retry_after = await TokenRateLimiter._apply(budgets, tokens, force=False)
+            if allowed:
+                return TokenReservation(budgets, tokens)
+            if time.monotonic() + retry_after > deadline:
                 break
+            await asyncio.sleep(retry_after)
         
-        key = f"rate_limit:{client_id}:{endpoint}"
+        logger.warning(f"Token budget exhausted for user {user_id}, application {application_id}")
+        raise RateLimitException(
+            "模型调用 token 用量超出限制，请稍后再试",
+            detail={"retry_after": math.ceil(retry_after)}
+        )
+    
+    @staticmethod
+    async def settle(reservation: Optional[TokenReservation], actual_tokens: int) -> None:
+        """按实际用量结算（多退少补，不会拒绝）"""
+        if reservation is None:
+            return
+        delta = actual_tokens - reservation.tokens
+        if delta == 0:
+            return
+        try:
+            await TokenRateLimiter._apply(reservation.budgets, delta, force=True)
+        except Exception as e:
+            logger.error(f"Token budget settle error: {e}")
+    
+    @staticmethod
+    async def release(reservation: Optional[TokenReservation]) -> None:
+        """调用失败时退还预留"""
+        await TokenRateLimiter.settle(reservation, 0)
+    
+    @staticmethod
+    async def _apply(
+        budgets: List[Tuple[str, int]],
+        tokens: int,
+        force: bool
+    ) -> Tuple[bool, float]:
+        # Redis 熔断时降级为进程内令牌桶
+        if redis_breaker.is_open:
+            return TokenRateLimiter._apply_local(budgets, tokens, force)
         
+        args: List[Any] = []
+        for _, limit in budgets:
+            args.extend([60.0 / limit, limit])
+        args.extend([tokens, 1 if force else 0])
         try:
-            count_str = await redis_client.get(key)
-            count = int(count_str) if count_str else 0
-            
-            if count >= limit:
-                return False, 0
-            
-            new_count = await redis_client.incr(key)
-            if new_count == 1:
-                await redis_client.expire(key, 60)
-            
-            remaining = max(0, limit - new_count)
-            return True, remaining
-            
+            allowed, retry_after = await redis_client.run_script(
+                TokenRateLimiter.RESERVE_SCRIPT,
+                keys=[key for key, _ in budgets],
+                args=args
+            )
+            return bool(allowed), float(retry_after)
         except Exception as e:
-            logger.error(f"Advanced rate limit check error: {e}")
-            return True, limit
+            logger.error(f"Token rate limit check error: {e}")
+            return TokenRateLimiter._apply_local(budgets, tokens, force)
+    
+    @staticmethod
+    def _apply_local(
+        budgets: List[Tuple[str, int]],
+        tokens: int,
+        force: bool
+    ) -> Tuple[bool, float]:
+        buckets = TokenRateLimiter._buckets
+        local = []
+        for key, limit in budgets:
+            bucket = buckets.get(key)
+            if bucket is None or bucket.capacity != limit:
+                bucket = LocalTokenBucket(limit, limit / 60)
+                buckets[key] = bucket
+                if len(buckets) > TokenRateLimiter.MAX_BUCKETS:
+                    buckets.popitem(last=False)
+            else:
+                buckets.move_to_end(key)
+            local.append(bucket)
+        
+        # 先补充令牌再判定，保证多个桶同时满足才扣减
+        for bucket in local:
+            bucket.consume(0)
+        if not force:
+            wait = max((tokens - b.tokens) / b.rate for b in local)
+            if wait > 0:
+                return False, wait
+        for bucket in local:
+            bucket.tokens = min(bucket.capacity, bucket.tokens - tokens)
+        return True, 0.0
@@ -0,0 +1,18 @@
+"""
+知识库相关 Schema
+"""
+from typing import Optional, Dict, Any, List
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class KnowledgeUpsertRequest(BaseModel):
+    """向量写入请求"""
+    collection: str = "default"
+    texts: List[str] = Field(default_factory=list)
+    metadatas: Optional[List[Dict[str, Any]]] = None
+    # async 是关键字，按别名接收
+    async_: bool = Field(False, alias="async")
+    # 新建集合时的索引类型；后端不支持的类型（如内存后端的 hnsw）由接口返回 400
+    index_type: Optional[str] = Field(None, pattern="^(flat|ivf_flat|hnsw)$")
+    
+    model_config = ConfigDict(populate_by_name=True)
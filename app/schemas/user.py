@@ -44,6 +44,15 @@ class UserResponse(UserInDB):
     pass
 
 
+class Principal(BaseModel):
+    """已认证主体（仅包含鉴权所需字段，可缓存）"""
+    id: UUID
+    is_active: bool
+    is_superuser: bool
+    
+    model_config = ConfigDict(from_attributes=True)
+
+
 class Token(BaseModel):
     """Token 模型"""
     access_token: str
@@ -92,9 +92,7 @@ class ApplicationService:
         
         await db.flush()
         await db.refresh(app)
-        
-        # 清除缓存
-        await ApplicationCache.clear_config(app_id)
+        await ApplicationService._commit_and_invalidate(db, app_id)
         
         return app
     
@@ -111,9 +109,20 @@ class ApplicationService:
         
         await db.delete(app)
         await db.flush()
+        await ApplicationService._commit_and_invalidate(db, app_id)
         
         return True
     
+    @staticmethod
+    async def _commit_and_invalidate(db: AsyncSession, app_id: UUID):
+        """
+        提交后再清除应用配置缓存
+        
+        若先清除再提交，提交前并发的缓存未命中会读到旧行并写入新一代缓存，在整个 TTL 内生效。
+        """
+        await db.commit()
+        await ApplicationCache.clear_config(app_id)
+    
     @staticmethod
     async def publish_application(
         db: AsyncSession, 
@@ -137,27 +146,17 @@ class ApplicationService:
         app_id: UUID
     ) -> Optional[dict]:
         """获取应用的模型配置（带缓存）"""
-        # 尝试从缓存获取
-        cached_config = await ApplicationCache.get_config(app_id)
-        if cached_config:
-            return cached_config
-        
-        # 从数据库查询
-        app = await ApplicationService.get_application_by_id(db, app_id)
-        if not app:
-            return None
-        
-        config = {
-            "model_provider": app.model_provider,
-            "model_name": app.model_name,
-            "model_config": app.model_parameters,
-            "system_prompt": app.system_prompt,
-            "max_conversation_length": app.max_conversation_length,
-            "enable_context": app.enable_context
-        }
-        
-        # 缓存配置
-        await ApplicationCache.set_config(app_id, config)
-        
-        return config
-
+        async def load_config() -> Optional[dict]:
+            app = await ApplicationService.get_application_by_id(db, app_id)
+            if not app:
+                return None
+            return {
+                "model_provider": app.model_provider,
+                "model_name": app.model_name,
+                "model_config": app.model_parameters,
+                "system_prompt": app.system_prompt,
+                "max_conversation_length": app.max_conversation_length,
+                "enable_context": app.enable_context
+            }
+        
+        return await ApplicationCache.get_or_load_config(app_id, load_config)
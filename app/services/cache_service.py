@@ -1,16 +1,105 @@
 """
 缓存服务
 """
+import asyncio
 import json
-from typing import Optional, Any, Dict
-from uuid import UUID
+import math
+import random
+import time
+from collections import OrderedDict
+from typing import Optional, Any, Awaitable, Callable, Dict, List, Tuple
+from uuid import UUID, uuid4
 
-from app.core.redis_client import redis_client
+from app.core.config import settings
+from app.core.redis_client import redis_client, redis_breaker, RedisUnavailableError
 from app.utils.logger import logger
 
 
+# 当前进程标识，用于忽略自己发出的失效广播
+WORKER_ID = uuid4().hex
+
+
+def _log_redis_error(message: str, error: Exception):
+    """熔断期间的失败属于预期降级，只记录调试日志"""
+    if isinstance(error, RedisUnavailableError):
+        logger.debug(f"{message}, Redis 熔断中")
+    else:
+        logger.error(f"{message}, 错误: {error}")
+
+
+class LocalCache:
+    """进程内 L1 缓存（按字节数限制的 LRU）"""
+    
+    # 每个条目的固定开销估算（字节）
+    ENTRY_OVERHEAD = 64
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, tuple[str, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[str]:
+        """获取缓存，过期或不存在返回 None"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key: str, value: str, ttl: float):
+        """设置缓存，超出容量时按 LRU 淘汰"""
+        size = len(key) + len(value) + self.ENTRY_OVERHEAD
+        if ttl <= 0 or size > self.max_bytes:
+            self._pop(key)
+            return
+        self._pop(key)
+        self._data[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._pop(oldest)
+    
+    def delete(self, key: str):
+        """删除缓存"""
+        self._pop(key)
+    
+    def delete_prefix(self, prefix: str):
+        """删除指定前缀的所有缓存（O(n)，仅用于降级场景）"""
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            self._pop(key)
+    
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+        self._bytes = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """缓存统计"""
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+    
+    def _pop(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+
 class CacheService:
-    """统一的缓存服务"""
+    """统一的缓存服务（进程内 L1 + Redis L2）"""
     
     # 缓存过期时间配置（秒）
     CACHE_TTL = {
@@ -18,120 +107,567 @@ class CacheService:
         "application_config": 3600,   # 1小时
         "conversation_context": 1800, # 30分钟
         "conversation_messages": 600,  # 10分钟
+        "user_principal": 60,  # 1分钟
     }
     
+    # L1 过期时间配置（秒），0 表示该命名空间不使用 L1
+    # 会话消息每轮都会写入，放在 L1 只会带来失效广播开销
+    L1_TTL = {
+        "user_default_model": 300,
+        "application_config": 300,
+        "conversation_context": 0,
+        "conversation_messages": 0,
+        "user_principal": 15,
+    }
+    
+    # 跨进程回源锁的过期时间（秒）及等待其他进程回源的轮询参数
+    FILL_LOCK_TTL = 5
+    FILL_WAIT_INTERVAL = 0.05
+    FILL_WAIT_ATTEMPTS = 20
+    
+    # 代数键的过期时间须远大于任何缓存 TTL：代数键过期归零时，
+    # 旧代数下的缓存早已过期，不会被重新读到
+    GENERATION_TTL = 7 * 24 * 3600
+    # 代数在 L1 中的过期时间（秒），其余依靠失效广播
+    GENERATION_L1_TTL = 5
+    
+    # get_or_load 写入的信封标记
+    ENVELOPE_MARK = "__xf"
+    
+    local = LocalCache(settings.CACHE_L1_MAX_BYTES)
+    # 最近一次从 Redis 读到的代数，Redis 不可用时使用
+    known_generations = LocalCache(4 * 1024 * 1024)
+    _pending_bumps: set = set()
+    _listener_task: Optional[asyncio.Task] = None
+    _inflight: Dict[str, asyncio.Future] = {}
+    
     @staticmethod
-    async def get(key: str) -> Optional[str]:
+    def _l1_ttl(namespace: Optional[str]) -> int:
+        if not settings.CACHE_L1_ENABLED or not namespace:
+            return 0
+        return CacheService.L1_TTL.get(namespace, 0)
+    
+    @staticmethod
+    async def get(key: str, namespace: Optional[str] = None) -> Optional[str]:
         """获取缓存"""
+        l1_ttl = CacheService._l1_ttl(namespace)
+        if l1_ttl:
+            value = CacheService.local.get(key)
+            if value is not None:
+                return value
         try:
-            return await redis_client.get(key)
+            value = await redis_client.get(key)
         except Exception as e:
-            logger.error(f"获取缓存失败: {key}, 错误: {e}")
+            _log_redis_error(f"获取缓存失败: {key}", e)
             return None
+        if l1_ttl and value is not None:
+            CacheService.local.set(key, value, l1_ttl)
+        return value
     
     @staticmethod
-    async def set(key: str, value: str, expire: Optional[int] = None):
+    async def set(
+        key: str,
+        value: str,
+        expire: Optional[int] = None,
+        namespace: Optional[str] = None
+    ):
         """设置缓存"""
+        l1_ttl = CacheService._l1_ttl(namespace)
         try:
             await redis_client.set(key, value, expire=expire)
         except Exception as e:
-            logger.error(f"设置缓存失败: {key}, 错误: {e}")
+            _log_redis_error(f"设置缓存失败: {key}", e)
+            if l1_ttl and isinstance(e, RedisUnavailableError):
+                # 熔断期间降级为仅 L1 缓存
+                CacheService.local.set(key, value, min(l1_ttl, expire or l1_ttl))
+            else:
+                CacheService.local.delete(key)
+            return
+        if l1_ttl:
+            CacheService.local.set(key, value, min(l1_ttl, expire or l1_ttl))
+            await CacheService.broadcast_invalidation([key])
     
     @staticmethod
     async def delete(key: str):
         """删除缓存"""
+        CacheService.local.delete(key)
         try:
             await redis_client.delete(key)
         except Exception as e:
-            logger.error(f"删除缓存失败: {key}, 错误: {e}")
+            _log_redis_error(f"删除缓存失败: {key}", e)
+        await CacheService.broadcast_invalidation([key])
     
     @staticmethod
-    async def get_json(key: str) -> Optional[Dict]:
-        """获取 JSON 缓存"""
-        try:
-            value = await redis_client.get(key)
-            if value:
-                return json.loads(value)
+    async def get_json(key: str, namespace: Optional[str] = None) -> Optional[Any]:
+        """获取 JSON 缓存（兼容 get_or_load 写入的信封格式）"""
+        value = await CacheService.get(key, namespace=namespace)
+        if not value:
             return None
+        try:
+            return CacheService._decode(value)[0]
         except Exception as e:
             logger.error(f"获取 JSON 缓存失败: {key}, 错误: {e}")
             return None
     
     @staticmethod
-    async def set_json(key: str, value: Any, expire: Optional[int] = None):
+    async def set_json(
+        key: str,
+        value: Any,
+        expire: Optional[int] = None,
+        namespace: Optional[str] = None
+    ):
         """设置 JSON 缓存"""
         try:
             json_str = json.dumps(value, default=str)
-            await redis_client.set(key, json_str, expire=expire)
         except Exception as e:
             logger.error(f"设置 JSON 缓存失败: {key}, 错误: {e}")
+            return
+        await CacheService.set(key, json_str, expire=expire, namespace=namespace)
+    
+    @staticmethod
+    async def get_or_load(
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        expire: int,
+        namespace: Optional[str] = None,
+        beta: float = 1.0
+    ) -> Any:
+        """
+        读取缓存，未命中时回源并写回
+        
+        - 进程内同一个键只有一个协程回源（single-flight）
+        - 跨进程通过短期 Redis 锁保证只有一个 worker 回源
+        - XFetch：临近过期时按概率提前刷新，避免集中过期
+        
+        Args:
+            key: 缓存键
+            loader: 回源函数，返回 None 时不写缓存
+            expire: 过期时间（秒）
+            namespace: 缓存命名空间（决定 L1 策略）
+            beta: XFetch 提前刷新系数，越大越早刷新，0 表示关闭
+        
+        Returns:
+            缓存值或回源结果
+        """
+        raw = await CacheService.get(key, namespace=namespace)
+        if raw:
+            try:
+                value, delta, expires_at = CacheService._decode(raw)
+            except Exception as e:
+                logger.error(f"解析缓存失败: {key}, 错误: {e}")
+            else:
+                if not CacheService._should_refresh_early(delta, expires_at, beta):
+                    return value
+                logger.debug(f"缓存提前刷新: {key}")
+                return await CacheService._single_flight(
+                    key, loader, expire, namespace, use_lock=False
+                )
+        return await CacheService._single_flight(key, loader, expire, namespace, use_lock=True)
+    
+    @staticmethod
+    def _decode(raw: str) -> Tuple[Any, float, Optional[float]]:
+        """解析缓存值，返回 (值, 回源耗时, 过期时间戳)"""
+        data = json.loads(raw)
+        if isinstance(data, dict) and data.get(CacheService.ENVELOPE_MARK):
+            return data.get("v"), float(data.get("d", 0)), data.get("e")
+        return data, 0.0, None
+    
+    @staticmethod
+    def _should_refresh_early(delta: float, expires_at: Optional[float], beta: float) -> bool:
+        """XFetch 判定：now - delta * beta * ln(rand) >= expiry"""
+        if not expires_at or delta <= 0 or beta <= 0:
+            return False
+        gap = -delta * beta * math.log(1.0 - random.random())
+        return time.time() + gap >= expires_at
+    
+    @staticmethod
+    async def _single_flight(
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        expire: int,
+        namespace: Optional[str],
+        use_lock: bool
+    ) -> Any:
+        """同一进程内合并对同一个键的并发回源"""
+        inflight = CacheService._inflight.get(key)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # 领头协程被取消时由当前协程自行回源
+                if not inflight.cancelled():
+                    raise
+        
+        future = asyncio.get_running_loop().create_future()
+        CacheService._inflight[key] = future
+        try:
+            if use_lock:
+                value = await CacheService._load_with_lock(key, loader, expire, namespace)
+            else:
+                value = await CacheService._load_and_store(key, loader, expire, namespace)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            CacheService._inflight.pop(key, None)
+    
+    @staticmethod
+    async def _load_with_lock(
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        expire: int,
+        namespace: Optional[str]
+    ) -> Any:
+        """跨进程回源：拿到锁的 worker 回源，其他 worker 等待其写回"""
+        lock_key = f"lock:cache:{key}"
+        try:
+            acquired = await redis_client.set(
+                lock_key, WORKER_ID, expire=CacheService.FILL_LOCK_TTL, nx=True
+            )
+        except Exception as e:
+            _log_redis_error(f"获取回源锁失败: {key}", e)
+            return await CacheService._load_and_store(key, loader, expire, namespace)
+        
+        if acquired:
+            try:
+                return await CacheService._load_and_store(key, loader, expire, namespace)
+            finally:
+                try:
+                    await redis_client.delete(lock_key)
+                except Exception as e:
+                    _log_redis_error(f"释放回源锁失败: {key}", e)
+        
+        # 其他 worker 正在回源，等待其写回
+        for _ in range(CacheService.FILL_WAIT_ATTEMPTS):
+            await asyncio.sleep(CacheService.FILL_WAIT_INTERVAL)
+            raw = await CacheService.get(key, namespace=namespace)
+            if raw:
+                try:
+                    return CacheService._decode(raw)[0]
+                except Exception:
+                    break
+        logger.warning(f"等待回源超时，直接回源: {key}")
+        return await CacheService._load_and_store(key, loader, expire, namespace)
+    
+    @staticmethod
+    async def _load_and_store(
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        expire: int,
+        namespace: Optional[str]
+    ) -> Any:
+        """执行回源并以信封格式写入缓存"""
+        started = time.monotonic()
+        value = await loader()
+        if value is None:
+            return None
+        envelope = {
+            CacheService.ENVELOPE_MARK: 1,
+            "v": value,
+            "d": round(time.monotonic() - started, 6),
+            "e": time.time() + expire,
+        }
+        await CacheService.set_json(key, envelope, expire=expire, namespace=namespace)
+        return value
+    
+    @staticmethod
+    async def versioned_key(scope: str, scope_id: Any, name: str) -> str:
+        """
+        生成带代数的缓存键：{scope}:{id}:g{generation}:{name}
+        
+        失效整个命名空间只需递增代数，旧键不再被读取并随 TTL 过期。
+        """
+        generation = await CacheService.get_generation(scope, scope_id)
+        return f"{scope}:{scope_id}:g{generation}:{name}"
+    
+    @staticmethod
+    async def get_generation(scope: str, scope_id: Any) -> int:
+        """获取命名空间当前代数（不存在时为 0）"""
+        key = f"{scope}:{scope_id}:gen"
+        l1_enabled = settings.CACHE_L1_ENABLED
+        if l1_enabled:
+            cached = CacheService.local.get(key)
+            if cached is not None:
+                return int(cached)
+        try:
+            value = await redis_client.get(key)
+        except Exception as e:
+            _log_redis_error(f"获取缓存代数失败: {key}", e)
+            # Redis 不可用时沿用最近一次已知的代数，避免回退到旧代数读到过期数据
+            known = CacheService.known_generations.get(key)
+            return int(known) if known is not None else 0
+        generation = int(value) if value else 0
+        CacheService.known_generations.set(key, str(generation), CacheService.GENERATION_TTL)
+        if l1_enabled:
+            CacheService.local.set(key, str(generation), CacheService.GENERATION_L1_TTL)
+        return generation
+    
+    @staticmethod
+    async def bump_generation(scope: str, scope_id: Any):
+        """递增命名空间代数，使该命名空间下所有缓存失效"""
+        key = f"{scope}:{scope_id}:gen"
+        CacheService.local.delete(key)
+        try:
+            # INCR、续期与失效广播在同一次往返内完成
+            async with redis_client.pipeline() as pipe:
+                pipe.incr(key)
+                pipe.expire(key, CacheService.GENERATION_TTL)
+                if settings.CACHE_L1_ENABLED:
+                    pipe.publish(
+                        settings.CACHE_INVALIDATION_CHANNEL,
+                        CacheService._invalidation_message([key])
+                    )
+        except Exception as e:
+            _log_redis_error(f"递增缓存代数失败: {key}", e)
+            # 记录待补偿的失效，Redis 恢复后重放；本进程 L1 中该命名空间的数据立即丢弃
+            CacheService._pending_bumps.add(key)
+            CacheService.local.delete_prefix(f"{scope}:{scope_id}:")
+    
+    @staticmethod
+    async def _on_redis_recovery():
+        """Redis 恢复后重放熔断期间的失效，并清空 L1"""
+        pending, CacheService._pending_bumps = CacheService._pending_bumps, set()
+        for key in pending:
+            try:
+                async with redis_client.pipeline() as pipe:
+                    pipe.incr(key)
+                    pipe.expire(key, CacheService.GENERATION_TTL)
+            except Exception as e:
+                _log_redis_error(f"重放缓存失效失败: {key}", e)
+                CacheService._pending_bumps.add(key)
+        await CacheService.broadcast_invalidation(list(pending))
+        CacheService.local.clear()
+    
+    @staticmethod
+    async def broadcast_invalidation(keys: List[str]):
+        """通过 Redis pub/sub 通知其他进程丢弃 L1 中的键"""
+        if not settings.CACHE_L1_ENABLED or not keys:
+            return
+        message = CacheService._invalidation_message(keys)
+        try:
+            await redis_client.publish(settings.CACHE_INVALIDATION_CHANNEL, message)
+        except Exception as e:
+            _log_redis_error(f"发布缓存失效消息失败: {keys}", e)
+    
+    @staticmethod
+    def _invalidation_message(keys: List[str]) -> str:
+        return json.dumps({"origin": WORKER_ID, "keys": keys})
+    
+    @staticmethod
+    async def start_invalidation_listener():
+        """启动 L1 失效监听（应用启动时调用）"""
+        if not settings.CACHE_L1_ENABLED or CacheService._listener_task:
+            return
+        CacheService._listener_task = asyncio.create_task(CacheService._listen_invalidations())
+    
+    @staticmethod
+    async def stop_invalidation_listener():
+        """停止 L1 失效监听（应用关闭时调用）"""
+        task = CacheService._listener_task
+        CacheService._listener_task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    
+    @staticmethod
+    async def _listen_invalidations():
+        """订阅失效频道，断线后重连"""
+        retry_delay = 1.0
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis_client.pubsub()
+                await pubsub.subscribe(settings.CACHE_INVALIDATION_CHANNEL)
+                # 订阅期间可能错过了失效消息，重新订阅后清空 L1
+                CacheService.local.clear()
+                retry_delay = 1.0
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    CacheService._apply_invalidation(message.get("data"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _log_redis_error(f"缓存失效监听中断, {retry_delay:.0f} 秒后重连", e)
+                if not isinstance(e, RedisUnavailableError):
+                    # 熔断期间保留 L1 作为降级缓存，恢复时统一清空
+                    CacheService.local.clear()
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 5.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
+    
+    @staticmethod
+    def _apply_invalidation(data: Optional[str]):
+        try:
+            payload = json.loads(data)
+        except Exception:
+            return
+        if payload.get("origin") == WORKER_ID:
+            return
+        for key in payload.get("keys", []):
+            CacheService.local.delete(key)
 
 
 class UserCache:
-    """用户相关缓存"""
+    """用户相关缓存（user:{id} 命名空间）"""
+    
+    @staticmethod
+    async def _key(user_id: UUID, name: str) -> str:
+        return await CacheService.versioned_key("user", user_id, name)
     
     @staticmethod
-    async def get_default_model_config(user_id: UUID) -> Optional[Dict]:
+    def _default_model_name(provider: Optional[str]) -> str:
+        # 每个提供商各有一个默认配置，分别缓存；"*" 表示不限提供商
+        return f"default_model:{provider or '*'}"
+    
+    @staticmethod
+    async def get_default_model_config(user_id: UUID, provider: Optional[str] = None) -> Optional[Dict]:
         """获取用户默认模型配置"""
-        key = f"user:{user_id}:default_model"
-        return await CacheService.get_json(key)
+        key = await UserCache._key(user_id, UserCache._default_model_name(provider))
+        return await CacheService.get_json(key, namespace="user_default_model")
     
     @staticmethod
-    async def set_default_model_config(user_id: UUID, config: Dict):
+    async def get_or_load_default_model_config(
+        user_id: UUID,
+        loader: Callable[[], Awaitable[Optional[Dict]]],
+        provider: Optional[str] = None
+    ) -> Optional[Dict]:
+        """获取用户默认模型配置，未命中时回源"""
+        key = await UserCache._key(user_id, UserCache._default_model_name(provider))
+        return await CacheService.get_or_load(
+            key,
+            loader,
+            expire=CacheService.CACHE_TTL["user_default_model"],
+            namespace="user_default_model"
+        )
+    
+    @staticmethod
+    async def set_default_model_config(user_id: UUID, config: Dict, provider: Optional[str] = None):
         """设置用户默认模型配置"""
-        key = f"user:{user_id}:default_model"
+        key = await UserCache._key(user_id, UserCache._default_model_name(provider))
         await CacheService.set_json(
             key, 
             config, 
-            expire=CacheService.CACHE_TTL["user_default_model"]
+            expire=CacheService.CACHE_TTL["user_default_model"],
+            namespace="user_default_model"
+        )
+    
+    @staticmethod
+    async def get_or_load_principal(
+        user_id: UUID,
+        loader: Callable[[], Awaitable[Optional[Dict]]]
+    ) -> Optional[Dict]:
+        """获取用户认证主体（id、是否激活、是否管理员），未命中时回源"""
+        key = await UserCache._key(user_id, "principal")
+        return await CacheService.get_or_load(
+            key,
+            loader,
+            expire=CacheService.CACHE_TTL["user_principal"],
+            namespace="user_principal"
         )
     
     @staticmethod
     async def clear_default_model_config(user_id: UUID):
         """清除用户默认模型配置缓存"""
-        key = f"user:{user_id}:default_model"
-        await CacheService.delete(key)
+        await UserCache.invalidate(user_id)
+    
+    @staticmethod
+    async def invalidate(user_id: UUID):
+        """失效该用户的全部缓存"""
+        await CacheService.bump_generation("user", user_id)
 
 
 class ApplicationCache:
-    """应用相关缓存"""
+    """应用相关缓存（application:{id} 命名空间）"""
+    
+    @staticmethod
+    async def _key(app_id: UUID, name: str) -> str:
+        return await CacheService.versioned_key("application", app_id, name)
     
     @staticmethod
     async def get_config(app_id: UUID) -> Optional[Dict]:
         """获取应用配置"""
-        key = f"application:{app_id}:config"
-        return await CacheService.get_json(key)
+        key = await ApplicationCache._key(app_id, "config")
+        return await CacheService.get_json(key, namespace="application_config")
+    
+    @staticmethod
+    async def get_or_load_config(
+        app_id: UUID,
+        loader: Callable[[], Awaitable[Optional[Dict]]]
+    ) -> Optional[Dict]:
+        """获取应用配置，未命中时回源"""
+        key = await ApplicationCache._key(app_id, "config")
+        return await CacheService.get_or_load(
+            key,
+            loader,
+            expire=CacheService.CACHE_TTL["application_config"],
+            namespace="application_config"
+        )
     
     @staticmethod
     async def set_config(app_id: UUID, config: Dict):
         """设置应用配置"""
-        key = f"application:{app_id}:config"
+        key = await ApplicationCache._key(app_id, "config")
         await CacheService.set_json(
             key, 
             config, 
-            expire=CacheService.CACHE_TTL["application_config"]
+            expire=CacheService.CACHE_TTL["application_config"],
+            namespace="application_config"
         )
     
     @staticmethod
     async def clear_config(app_id: UUID):
         """清除应用配置缓存"""
-        key = f"application:{app_id}:config"
-        await CacheService.delete(key)
+        await CacheService.bump_generation("application", app_id)
 
 
 class ConversationCache:
-    """会话相关缓存"""
+    """会话相关缓存（conversation:{id} 命名空间）"""
+    
+    @staticmethod
+    async def _key(conv_id: UUID, name: str) -> str:
+        return await CacheService.versioned_key("conversation", conv_id, name)
     
     @staticmethod
     async def get_messages(conv_id: UUID) -> Optional[list]:
         """获取会话消息缓存"""
-        key = f"conversation:{conv_id}:messages"
+        key = await ConversationCache._key(conv_id, "messages")
         return await CacheService.get_json(key)
     
+    @staticmethod
+    async def get_or_load_messages(
+        conv_id: UUID,
+        loader: Callable[[], Awaitable[Optional[list]]]
+    ) -> Optional[list]:
+        """获取会话消息缓存，未命中时回源"""
+        key = await ConversationCache._key(conv_id, "messages")
+        return await CacheService.get_or_load(
+            key,
+            loader,
+            expire=CacheService.CACHE_TTL["conversation_messages"],
+            namespace="conversation_messages"
+        )
+    
     @staticmethod
     async def set_messages(conv_id: UUID, messages: list, max_count: int = 20):
         """设置会话消息缓存"""
-        key = f"conversation:{conv_id}:messages"
+        key = await ConversationCache._key(conv_id, "messages")
         # 只缓存最近的消息
         recent_messages = messages[-max_count:] if len(messages) > max_count else messages
         await CacheService.set_json(
@@ -143,8 +679,10 @@ class ConversationCache:
     @staticmethod
     async def append_message(conv_id: UUID, message: Dict):
         """追加消息到缓存"""
-        key = f"conversation:{conv_id}:messages"
-        messages = await ConversationCache.get_messages(conv_id) or []
+        messages = await ConversationCache.get_messages(conv_id)
+        if messages is None:
+            # 缓存不存在时不追加，避免缓存中只有部分历史；下次读取时会整体回源
+            return
         messages.append(message)
         
         # 保持最多20条
@@ -156,13 +694,13 @@ class ConversationCache:
     @staticmethod
     async def get_context(conv_id: UUID) -> Optional[str]:
         """获取会话上下文"""
-        key = f"conversation:{conv_id}:context"
+        key = await ConversationCache._key(conv_id, "context")
         return await CacheService.get(key)
     
     @staticmethod
     async def set_context(conv_id: UUID, context: str):
         """设置会话上下文"""
-        key = f"conversation:{conv_id}:context"
+        key = await ConversationCache._key(conv_id, "context")
         await CacheService.set(
             key, 
             context, 
@@ -172,21 +710,24 @@ class ConversationCache:
     @staticmethod
     async def get_model_info(conv_id: UUID) -> Optional[Dict]:
         """获取会话最近使用的模型信息"""
-        key = f"conversation:{conv_id}:model"
+        key = await ConversationCache._key(conv_id, "model")
         return await redis_client.hgetall(key)
     
     @staticmethod
     async def set_model_info(conv_id: UUID, model_info: Dict):
         """设置会话最近使用的模型信息"""
-        key = f"conversation:{conv_id}:model"
-        for field, value in model_info.items():
-            await redis_client.hset(key, field, str(value))
-        await redis_client.expire(key, 3600)  # 1小时
+        key = await ConversationCache._key(conv_id, "model")
+        if not model_info:
+            return
+        async with redis_client.pipeline() as pipe:
+            pipe.hset(key, mapping={field: str(value) for field, value in model_info.items()})
+            pipe.expire(key, 3600)  # 1小时
     
     @staticmethod
     async def clear_conversation_cache(conv_id: UUID):
-        """清除会话所有缓存"""
-        await CacheService.delete(f"conversation:{conv_id}:messages")
-        await CacheService.delete(f"conversation:{conv_id}:context")
-        await CacheService.delete(f"conversation:{conv_id}:model")
+        """清除会话所有缓存（递增代数，旧键随 TTL 过期）"""
+        await CacheService.bump_generation("conversation", conv_id)
+
 
+# Redis 熔断恢复后补偿失效
+redis_breaker.on_recovery(CacheService._on_redis_recovery)
@@ -0,0 +1,186 @@
+"""
+Embedding 缓存
+"""
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.redis_client import redis_client, RedisUnavailableError
+from app.utils.logger import logger
+
+
+def normalize_text(text: str) -> str:
+    """缓存键使用的规范化文本：Unicode NFC、合并连续空白、去掉首尾空白"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCache:
+    """
+    Embedding 缓存（进程内 LRU + Redis）
+    
+    键为 (模型名, 规范化文本的 SHA-256)，内容相同的文本只计算一次，
+    重新入库未变更的文档基本不产生推理开销。
+    
+    - L1: 进程内 LRU，按条目数限制，保存 float64 原值（与计算结果完全一致）
+    - L2: Redis，向量按 dtype（float32 / float16）打包成字节存储，而不是 JSON 列表；
+      384 维 float32 每条 1.5KB
+    
+    模型不可用时生成的伪向量不写入任何一级缓存，模型恢复后不会继续返回伪向量。
+    """
+    
+    def __init__(
+        self,
+        model_name: str,
+        max_entries: int = 10000,
+        dtype: str = "float32",
+        ttl: int = 30 * 24 * 3600,
+        redis_enabled: bool = True
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.ttl = ttl
+        self.redis_enabled = redis_enabled
+        # 模型或存储格式变化时键随之变化
+        model_tag = hashlib.sha256(f"{model_name}:{self.dtype.name}".encode()).hexdigest()[:12]
+        self.prefix = f"emb:{model_tag}:"
+        self._local: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+    
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode()).hexdigest()
+        return self.prefix + digest
+    
+    def _local_get(self, key: str) -> Optional[np.ndarray]:
+        vec = self._local.get(key)
+        if vec is not None:
+            self._local.move_to_end(key)
+        return vec
+    
+    def _local_set(self, key: str, vec: np.ndarray):
+        self._local[key] = vec
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+    
+    async def _redis_get(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not self.redis_enabled or not keys:
+            return [None] * len(keys)
+        try:
+            return await redis_client.mget_bytes(keys)
+        except RedisUnavailableError:
+            return [None] * len(keys)
+        except Exception as e:
+            logger.error(f"读取 Embedding 缓存失败: {e}")
+            return [None] * len(keys)
+    
+    async def _redis_set(self, mapping: Dict[str, np.ndarray]):
+        if not self.redis_enabled or not mapping:
+            return
+        packed = {k: v.astype(self.dtype).tobytes() for k, v in mapping.items()}
+        try:
+            await redis_client.set_many_bytes(packed, expire=self.ttl)
+        except RedisUnavailableError:
+            pass
+        except Exception as e:
+            logger.error(f"写入 Embedding 缓存失败: {e}")
+    
+    async def embed(
+        self,
+        texts: List[str],
+        compute: Callable[[List[str]], Awaitable[Tuple[List[List[float]], bool]]]
+    ) -> List[List[float]]:
+        """
+        带缓存的 embedding
+        
+        Args:
+            texts: 文本列表
+            compute: 未命中时的计算函数（只会收到去重后的未命中文本），
+                返回 (向量, 是否由模型计算)
+        
+        Returns:
+            与 texts 一一对应的向量
+        """
+        keys = [self.key(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        # 未命中的键 -> 首次出现的原文（按出现顺序去重）
+        pending: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in pending:
+                continue
+            vec = self._local_get(key)
+            if vec is not None:
+                found[key] = vec
+            else:
+                pending[key] = text
+        self.l1_hits += len(found)
+        
+        if pending:
+            pending_keys = list(pending)
+            for key, raw in zip(pending_keys, await self._redis_get(pending_keys)):
+                if raw:
+                    vec = np.frombuffer(raw, dtype=self.dtype).astype(np.float64)
+                    found[key] = vec
+                    self._local_set(key, vec)
+                    self.l2_hits += 1
+        
+        missing = [k for k in pending if k not in found]
+        if missing:
+            self.misses += len(missing)
+            computed, from_model = await compute([pending[k] for k in missing])
+            fresh = {}
+            for key, values in zip(missing, computed):
+                vec = np.asarray(values, dtype=np.float64)
+                found[key] = vec
+                if from_model:
+                    fresh[key] = vec
+                    self._local_set(key, vec)
+            await self._redis_set(fresh)
+        
+        return [found[k].tolist() for k in keys]
+    
+    def clear(self):
+        """清空进程内缓存"""
+        self._local.clear()
+    
+    def stats(self) -> Dict[str, float]:
+        """命中统计"""
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "entries": len(self._local),
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "hit_rate": (self.l1_hits + self.l2_hits) / lookups if lookups else 0.0,
+        }
+    
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式的指标"""
+        lines = [
+            "# HELP embedding_cache_requests_total Embedding cache lookups by result.",
+            "# TYPE embedding_cache_requests_total counter",
+            f'embedding_cache_requests_total{{result="l1_hit"}} {self.l1_hits}',
+            f'embedding_cache_requests_total{{result="l2_hit"}} {self.l2_hits}',
+            f'embedding_cache_requests_total{{result="miss"}} {self.misses}',
+            "# HELP embedding_cache_entries Entries in the in-process embedding cache.",
+            "# TYPE embedding_cache_entries gauge",
+            f"embedding_cache_entries {len(self._local)}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+# 全局缓存实例
+embedding_cache = EmbeddingCache(
+    settings.EMBEDDING_MODEL,
+    max_entries=settings.EMBEDDING_CACHE_L1_SIZE,
+    dtype=settings.EMBEDDING_CACHE_DTYPE,
+    ttl=settings.EMBEDDING_CACHE_TTL,
+    redis_enabled=settings.EMBEDDING_CACHE_REDIS
+)
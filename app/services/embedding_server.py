@@ -0,0 +1,252 @@
+"""
+跨 worker 共享的 Embedding 模型服务
+
+多个 uvicorn worker 各自加载模型会成倍占用内存、重复预热。模型服务是一个
+独立的本地进程，持有唯一一份模型，通过 Unix socket 接收所有 worker 的请求
+（服务端内部仍由 EmbeddingEngine 合并成批推理）。
+
+协议：每条消息为 4 字节大端长度 + JSON。
+    请求: {"texts": [...]}
+    响应: {"shm": 共享内存名, "rows": n, "dim": d, "model": 是否由模型计算} 或 {"error": "..."}
+向量结果以 float64 写入该连接专属的共享内存缓冲区，不经过 socket 序列化；
+同一连接上的请求串行，客户端读取完成前服务端不会覆盖缓冲区。
+"""
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.utils.logger import logger
+
+
+_HEADER = struct.Struct(">I")
+# 单条消息上限，防止异常长度导致分配过大内存
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class EmbeddingServerUnavailable(Exception):
+    """模型服务不可用（未启动、连接失败或返回错误）"""
+    pass
+
+
+async def _read_message(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError(f"消息过大: {size}")
+    return json.loads(await reader.readexactly(size))
+
+
+def _write_message(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    body = json.dumps(message, ensure_ascii=False).encode()
+    writer.write(_HEADER.pack(len(body)) + body)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    以非所有者身份映射共享内存
+    
+    Python 3.13 以前，映射已有共享内存也会登记到 resource_tracker，进程退出时
+    会把服务端仍在使用的缓冲区删掉，这里取消登记。
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class _ResultBuffer:
+    """服务端每个连接一个的结果缓冲区，容量不足时按 2 倍扩容"""
+    
+    def __init__(self):
+        self.shm: Optional[shared_memory.SharedMemory] = None
+    
+    def write(self, vectors: np.ndarray) -> str:
+        nbytes = max(vectors.nbytes, 1)
+        if self.shm is None or self.shm.size < nbytes:
+            self.close()
+            size = 1 << (nbytes - 1).bit_length()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 64 * 1024))
+        out = np.ndarray(vectors.shape, dtype=np.float64, buffer=self.shm.buf)
+        out[...] = vectors
+        return self.shm.name
+    
+    def close(self):
+        shm, self.shm = self.shm, None
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+class EmbeddingServer:
+    """模型服务端，engine 为 EmbeddingEngine 实例"""
+    
+    def __init__(self, path: str, engine: Any):
+        self.path = path
+        self.engine = engine
+    
+    async def serve(self):
+        """预热模型并在 Unix socket 上提供服务，直到被取消"""
+        await self.engine.warmup()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o660)
+        logger.info(f"Embedding 模型服务已启动: {self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.engine.stop()
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        buffer = _ResultBuffer()
+        try:
+            while True:
+                try:
+                    request = await _read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    texts = [str(t) for t in request.get("texts", [])]
+                    result, from_model = await self.engine.encode(texts)
+                    vectors = np.asarray(result, dtype=np.float64)
+                    if vectors.ndim != 2:
+                        vectors = vectors.reshape(len(texts), -1)
+                    name = buffer.write(vectors)
+                    response = {
+                        "shm": name,
+                        "rows": vectors.shape[0],
+                        "dim": vectors.shape[1],
+                        "model": from_model,
+                    }
+                except Exception as e:
+                    logger.error(f"Embedding 模型服务处理请求失败: {e}")
+                    response = {"error": str(e)}
+                _write_message(writer, response)
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Embedding 模型服务连接异常: {e}")
+        finally:
+            buffer.close()
+            writer.close()
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, sock: socket.socket):
+        self.reader = reader
+        self.writer = writer
+        self.sock = sock
+        self.shm: Optional[shared_memory.SharedMemory] = None
+    
+    def attach(self, name: str) -> shared_memory.SharedMemory:
+        if self.shm is None or self.shm.name != name:
+            self.detach()
+            self.shm = _attach(name)
+        return self.shm
+    
+    def detach(self):
+        shm, self.shm = self.shm, None
+        if shm is not None:
+            shm.close()
+    
+    def close(self):
+        self.detach()
+        try:
+            self.writer.close()
+        except RuntimeError:
+            # 所属事件循环已关闭，transport 无法再调度关闭，直接关闭 socket
+            self.sock.close()
+
+
+class EmbeddingClient:
+    """
+    模型服务客户端（每个 worker 一个）
+    
+    维护最多 max_connections 条长连接，每条连接同时只承载一个请求。
+    连接失败后 retry_interval 秒内直接判定不可用，调用方回退到进程内推理。
+    """
+    
+    def __init__(self, path: str, max_connections: int = 8, retry_interval: float = 5.0):
+        self.path = path
+        self.max_connections = max_connections
+        self.retry_interval = retry_interval
+        self._idle: List[_Connection] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._down_until = 0.0
+    
+    def _bind_loop(self):
+        # 连接与信号量绑定事件循环（Celery 任务每次 asyncio.run 都是新循环）
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            idle, self._idle = self._idle, []
+            for conn in idle:
+                conn.close()
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+    
+    async def _acquire(self) -> _Connection:
+        if self._idle:
+            return self._idle.pop()
+        # 自行持有 socket，事件循环关闭后仍能关闭连接
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            await asyncio.get_running_loop().sock_connect(sock, self.path)
+            reader, writer = await asyncio.open_unix_connection(sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+        return _Connection(reader, writer, sock)
+    
+    async def _request(self, conn: _Connection, texts: List[str]) -> Tuple[List[List[float]], bool]:
+        _write_message(conn.writer, {"texts": texts})
+        await conn.writer.drain()
+        response = await _read_message(conn.reader)
+        if "error" in response:
+            raise EmbeddingServerUnavailable(response["error"])
+        rows, dim = response["rows"], response["dim"]
+        shm = conn.attach(response["shm"])
+        # tolist 会拷贝数据，返回后缓冲区可被下一个请求复用
+        vectors = np.ndarray((rows, dim), dtype=np.float64, buffer=shm.buf).tolist()
+        return vectors, bool(response.get("model"))
+    
+    async def encode(self, texts: List[str]) -> Tuple[List[List[float]], bool]:
+        """请求模型服务，返回 (向量, 是否由模型计算)；不可用时抛出 EmbeddingServerUnavailable"""
+        if time.monotonic() < self._down_until:
+            raise EmbeddingServerUnavailable("模型服务暂不可用")
+        self._bind_loop()
+        async with self._semaphore:
+            conn = None
+            try:
+                conn = await self._acquire()
+                vectors = await self._request(conn, texts)
+            except EmbeddingServerUnavailable:
+                self._idle.append(conn)
+                raise
+            except (OSError, ValueError, KeyError, asyncio.IncompleteReadError) as e:
+                if conn is not None:
+                    conn.close()
+                if self._down_until == 0.0:
+                    logger.warning(f"Embedding 模型服务不可用，回退到进程内推理: {e}")
+                self._down_until = time.monotonic() + self.retry_interval
+                raise EmbeddingServerUnavailable(str(e)) from e
+            except BaseException:
+                # 取消等中途中断：连接上可能残留未读的响应，不能放回连接池
+                if conn is not None:
+                    conn.close()
+                raise
+            self._down_until = 0.0
+            self._idle.append(conn)
+            return vectors
@@ -1,24 +1,210 @@
-from typing import List
+from concurrent.futures import Future
+from typing import Any, List, Optional, Tuple
+import asyncio
 import hashlib
+import queue
+import threading
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_server import EmbeddingClient, EmbeddingServerUnavailable
+from app.utils.logger import logger
+
+
+# 伪向量 LCG 参数：x' = (A * x + C) mod 2^31
+_LCG_A = 1103515245
+_LCG_C = 12345
+_LCG_MASK = 0x7FFFFFFF
+FALLBACK_DIM = 384
+
+
+def _lcg_jump_table(dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    第 n 步的跳跃系数：x_n = (A_n * x_0 + C_n) mod 2^31
+    
+    A_n = a^n，C_n = c * (a^(n-1) + ... + 1)，均取模 2^31，
+    这样所有维度可以由种子一次向量化算出，而不必逐步迭代。
+    """
+    a_n = np.empty(dim, dtype=np.uint64)
+    c_n = np.empty(dim, dtype=np.uint64)
+    a, c = 1, 0
+    for i in range(dim):
+        a, c = (_LCG_A * a) & _LCG_MASK, (_LCG_A * c + _LCG_C) & _LCG_MASK
+        a_n[i], c_n[i] = a, c
+    return a_n, c_n
+
+
+_LCG_A_N, _LCG_C_N = _lcg_jump_table(FALLBACK_DIM)
+
+
+def _fallback_embed(texts: List[str]) -> np.ndarray:
+    """
+    未安装 sentence-transformers 时的确定性伪向量
+    
+    种子取文本 SHA-256 的前 4 字节，按 LCG 生成各维取值。结果与原逐维迭代的
+    实现逐位一致（已入库的伪向量无需重建）：第一步的 & MASK 等价于对 2^31 取模，
+    所以种子可先取模；A_n、C_n 小于 2^31，乘积不超过 2^62，uint64 不会溢出；
+    x / 0x7FFFFFFF 在 float64 下与 Python 的除法同样是正确舍入。
+    """
+    if not texts:
+        return np.empty((0, FALLBACK_DIM), dtype=np.float64)
+    digests = b"".join(hashlib.sha256(t.encode()).digest()[:4] for t in texts)
+    seeds = np.frombuffer(digests, dtype=">u4").astype(np.uint64) & _LCG_MASK
+    x = (seeds[:, None] * _LCG_A_N + _LCG_C_N) & np.uint64(_LCG_MASK)
+    return x.astype(np.float64) / float(_LCG_MASK) * 2 - 1
+
+
+class EmbeddingEngine:
+    """
+    进程内 embedding 引擎
+    
+    模型只加载一次，由专用工作线程持有并执行推理，不阻塞事件循环。
+    并发的 embed() 请求进入队列，工作线程取到第一个请求后最多再等待
+    max_wait 秒收集后续请求，合并成一次 encode（批量推理的单条成本远低于逐条）。
+    """
+    
+    def __init__(self, model_name: str, batch_size: int = 64, max_wait: float = 0.005):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.model: Any = None
+        # None: 尚未加载；False: 加载失败，使用伪向量
+        self.available: Optional[bool] = None
+        self._queue: "queue.Queue[Optional[Tuple[List[str], Future]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+    
+    def start(self):
+        """启动工作线程（模型在工作线程中加载）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._worker, name="embedding-engine", daemon=True)
+            self._thread.start()
+    
+    async def warmup(self):
+        """启动并等待模型加载完成，再跑一次推理完成预热"""
+        self.start()
+        await asyncio.to_thread(self._ready.wait)
+        if self.available:
+            await self.embed(["warmup"])
+            logger.info(f"Embedding 模型已加载: {self.model_name}")
+        else:
+            logger.warning(f"Embedding 模型不可用，使用伪向量: {self.model_name}")
+    
+    def stop(self):
+        """停止工作线程（应用关闭时调用）"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=5)
+    
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return (await self.encode(texts))[0]
+    
+    async def encode(self, texts: List[str]) -> Tuple[List[List[float]], bool]:
+        """返回 (向量, 是否由模型计算)；模型不可用或推理失败时为伪向量"""
+        if not texts:
+            return [], self.available is not False
+        self.start()
+        future: Future = Future()
+        self._queue.put((texts, future))
+        return await asyncio.wrap_future(future)
+    
+    def _load(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(self.model_name)
+            self.available = True
+        except Exception as e:
+            logger.warning(f"加载 Embedding 模型失败: {e}")
+            self.available = False
+        finally:
+            self._ready.set()
+    
+    def _collect(self, first: Tuple[List[str], Future]) -> Tuple[List[Tuple[List[str], Future]], bool]:
+        """在 max_wait 窗口内合并后续请求；返回 (批次, 是否收到停止信号)"""
+        batch = [first]
+        count = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            count += len(item[0])
+        return batch, False
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if not self.available:
+            return _fallback_embed(texts)
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+    
+    def _worker(self):
+        self._load()
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+            texts = [t for item_texts, _ in batch for t in item_texts]
+            from_model = bool(self.available)
+            try:
+                vectors = self._encode(texts)
+            except Exception as e:
+                logger.error(f"Embedding 推理失败: {e}")
+                vectors = _fallback_embed(texts)
+                from_model = False
+            start = 0
+            for item_texts, future in batch:
+                end = start + len(item_texts)
+                if future.set_running_or_notify_cancel():
+                    future.set_result((vectors[start:end].tolist(), from_model))
+                start = end
+
+
+# 全局引擎实例
+embedding_engine = EmbeddingEngine(
+    settings.EMBEDDING_MODEL,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    max_wait=settings.EMBEDDING_BATCH_MAX_WAIT
+)
+
+
+# 配置了模型服务时各 worker 共用服务进程中的模型
+embedding_client = (
+    EmbeddingClient(
+        settings.EMBEDDING_SERVER_SOCKET,
+        max_connections=settings.EMBEDDING_SERVER_MAX_CONNECTIONS,
+        retry_interval=settings.EMBEDDING_SERVER_RETRY_INTERVAL
+    )
+    if settings.EMBEDDING_SERVER_SOCKET else None
+)
+
 
 class EmbeddingService:
     @staticmethod
     async def embed(texts: List[str]) -> List[List[float]]:
-        try:
-            from sentence_transformers import SentenceTransformer
-            model = SentenceTransformer("BAAI/bge-small-zh-v1.5")
-            vectors = model.encode(texts, normalize_embeddings=True)
-            return [list(map(float, v)) for v in vectors]
-        except Exception:
-            dim = 384
-            out = []
-            for t in texts:
-                h = hashlib.sha256(t.encode()).digest()
-                seed = int.from_bytes(h[:4], "big")
-                vec = []
-                x = seed
-                for _ in range(dim):
-                    x = (1103515245 * x + 12345) & 0x7FFFFFFF
-                    vec.append((x / 0x7FFFFFFF) * 2 - 1)
-                out.append(vec)
-            return out
+        if settings.EMBEDDING_CACHE_ENABLED and texts:
+            return await embedding_cache.embed(texts, EmbeddingService._compute)
+        return (await EmbeddingService._compute(texts))[0]
+    
+    @staticmethod
+    async def _compute(texts: List[str]) -> Tuple[List[List[float]], bool]:
+        """返回 (向量, 是否由模型计算)"""
+        if embedding_client is not None and texts:
+            try:
+                return await embedding_client.encode(texts)
+            except EmbeddingServerUnavailable:
+                pass
+        return await embedding_engine.encode(texts)
@@ -0,0 +1,386 @@
+"""
+知识库文档入库流水线
+"""
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from multipart.multipart import MultipartParser, parse_options_header
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis_client import redis_client, RedisUnavailableError
+from app.services.embedding_service import EmbeddingService
+from app.services.knowledge_store import KnowledgeStoreService
+from app.services.vector_service import vector_service
+from app.utils import document_parser
+from app.utils.logger import logger
+from app.utils.text_chunker import Chunk, TokenChunker
+
+
+class UploadTooLargeError(ValueError):
+    """上传超过 KB_MAX_UPLOAD_SIZE"""
+
+
+class IngestionService:
+    """
+    文档入库：上传落盘 → 进程池分段解析 → 按 token 切块 → 批量 embedding → 批量写入向量库与 KBItem
+    
+    各阶段流式衔接：解析任务按页段提交，同时在途的任务数有上限，按顺序消费；
+    切块器只缓存未输出的 token；凑满一批即 embedding 并写入。
+    千页文档也不会整份载入内存。进度写入 Redis，由 /knowledge/tasks/{id} 查询。
+    """
+    
+    TASK_KEY_PREFIX = "kb:ingest:"
+    # Redis 不可用时进程内保留的任务进度条数
+    LOCAL_PROGRESS_LIMIT = 1000
+    # multipart 边界与文件以外的表单字段可占用的字节数
+    FORM_OVERHEAD = 64 * 1024
+    
+    _pool: Optional[ProcessPoolExecutor] = None
+    _semaphore: Optional[asyncio.Semaphore] = None
+    _tasks: Set[asyncio.Task] = set()
+    _local_progress: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    
+    @staticmethod
+    def _get_pool() -> ProcessPoolExecutor:
+        if IngestionService._pool is None:
+            # spawn：不继承父进程的线程与连接，子进程只导入解析模块
+            IngestionService._pool = ProcessPoolExecutor(
+                max_workers=settings.KB_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return IngestionService._pool
+    
+    @staticmethod
+    def shutdown():
+        """关闭解析进程池（应用关闭时调用）"""
+        for task in list(IngestionService._tasks):
+            task.cancel()
+        pool = IngestionService._pool
+        IngestionService._pool = None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    # ==================== 上传 ====================
+    
+    @staticmethod
+    async def save_multipart(content_type: str, stream: AsyncIterator[bytes]) -> Tuple[str, str, Dict[str, str]]:
+        """
+        流式解析 multipart 请求体，file 字段边读边写入临时文件
+        
+        请求体不经过表单缓冲，读取时累计字节数，超过 KB_MAX_UPLOAD_SIZE 立即中止。
+        
+        Returns:
+            (临时文件路径, 文件名, 其余表单字段)
+        
+        Raises:
+            UploadTooLargeError: 超过大小限制
+            ValueError: 请求格式错误、缺少文件或文件类型不支持
+        """
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("缺少 multipart boundary")
+        
+        limit = settings.KB_MAX_UPLOAD_SIZE
+        fields: Dict[str, str] = {}
+        headers: Dict[bytes, bytes] = {}
+        part: Dict[str, Any] = {}
+        upload: Dict[str, Any] = {"file": None, "path": None, "filename": "", "size": 0}
+        
+        def on_part_begin():
+            headers.clear()
+            part.update(field=b"", value=b"", name="", data=bytearray(), is_file=False)
+        
+        def on_header_field(data: bytes, start: int, end: int):
+            part["field"] += data[start:end]
+        
+        def on_header_value(data: bytes, start: int, end: int):
+            part["value"] += data[start:end]
+        
+        def on_header_end():
+            headers[part["field"].lower()] = part["value"]
+            part.update(field=b"", value=b"")
+        
+        def on_headers_finished():
+            _, options = parse_options_header(headers.get(b"content-disposition", b""))
+            part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+            filename = options.get(b"filename")
+            if part["name"] != "file" or filename is None:
+                return
+            if upload["path"] is not None:
+                raise ValueError("只能上传一个文件")
+            filename = filename.decode("utf-8", "replace")
+            if not document_parser.detect_type(filename):
+                raise ValueError(f"不支持的文件类型: {filename}")
+            suffix = os.path.splitext(filename)[1].lower()
+            fd, upload["path"] = tempfile.mkstemp(suffix=suffix, prefix="kb-", dir=settings.KB_UPLOAD_DIR)
+            upload["file"] = os.fdopen(fd, "wb")
+            upload["filename"] = filename
+            part["is_file"] = True
+        
+        def on_part_data(data: bytes, start: int, end: int):
+            if not part["is_file"]:
+                part["data"] += data[start:end]
+                return
+            upload["size"] += end - start
+            if upload["size"] > limit:
+                raise UploadTooLargeError(f"文件超过大小限制 {limit} 字节")
+            upload["file"].write(data[start:end])
+        
+        def on_part_end():
+            if part["is_file"]:
+                upload["file"].close()
+            elif part["name"]:
+                fields[part["name"]] = part["data"].decode("utf-8", "replace")
+        
+        parser = MultipartParser(boundary, {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        })
+        received = 0
+        try:
+            async for chunk in stream:
+                received += len(chunk)
+                if received > limit + IngestionService.FORM_OVERHEAD:
+                    raise UploadTooLargeError(f"文件超过大小限制 {limit} 字节")
+                parser.write(chunk)
+            parser.finalize()
+            if upload["path"] is None:
+                raise ValueError("缺少文件")
+            if not upload["file"].closed:
+                raise ValueError("请求体不完整")
+        except BaseException:
+            if upload["file"] is not None:
+                upload["file"].close()
+            if upload["path"] is not None:
+                os.unlink(upload["path"])
+            raise
+        return upload["path"], upload["filename"], fields
+    
+    @staticmethod
+    async def read_body(stream: AsyncIterator[bytes]) -> bytes:
+        """
+        读取整个请求体（JSON 提交），累计超过 KB_MAX_UPLOAD_SIZE 立即中止
+        
+        Raises:
+            UploadTooLargeError: 超过大小限制
+        """
+        limit = settings.KB_MAX_UPLOAD_SIZE
+        body = bytearray()
+        async for chunk in stream:
+            body += chunk
+            if len(body) > limit:
+                raise UploadTooLargeError(f"请求体超过大小限制 {limit} 字节")
+        return bytes(body)
+    
+    @staticmethod
+    def save_text(text: str) -> str:
+        """把直接提交的文本写入临时文件，走同一条流水线"""
+        fd, path = tempfile.mkstemp(suffix=".txt", prefix="kb-", dir=settings.KB_UPLOAD_DIR)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+    
+    # ==================== 任务 ====================
+    
+    @staticmethod
+    async def start(path: str, filename: str, kind: str, collection: str, doc_id: str) -> str:
+        """启动后台入库任务，返回任务 ID"""
+        task_id = uuid4().hex
+        await IngestionService._set_progress(task_id, {
+            "state": "PENDING",
+            "stage": "queued",
+            "doc_id": doc_id,
+            "collection": collection,
+            "filename": filename,
+        })
+        task = asyncio.create_task(
+            IngestionService._run(task_id, path, filename, kind, collection, doc_id)
+        )
+        IngestionService._tasks.add(task)
+        task.add_done_callback(IngestionService._tasks.discard)
+        return task_id
+    
+    @staticmethod
+    async def _run(task_id: str, path: str, filename: str, kind: str, collection: str, doc_id: str):
+        if IngestionService._semaphore is None:
+            IngestionService._semaphore = asyncio.Semaphore(settings.KB_INGEST_CONCURRENCY)
+        started = time.monotonic()
+        try:
+            async with IngestionService._semaphore:
+                chunks = await IngestionService._ingest(task_id, path, filename, kind, collection, doc_id)
+            await IngestionService._set_progress(task_id, {
+                "state": "SUCCESS",
+                "stage": "done",
+                "chunks_done": chunks,
+                "elapsed": round(time.monotonic() - started, 3),
+            })
+            logger.info(f"文档入库完成: {filename} ({chunks} 块, {time.monotonic() - started:.1f}s)")
+        except asyncio.CancelledError:
+            await IngestionService._set_progress(task_id, {"state": "REVOKED"})
+            raise
+        except Exception as e:
+            logger.error(f"文档入库失败: {filename}, 错误: {e}")
+            await IngestionService._set_progress(task_id, {"state": "FAILURE", "error": str(e)})
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    
+    @staticmethod
+    async def _ingest(task_id: str, path: str, filename: str, kind: str, collection: str, doc_id: str) -> int:
+        loop = asyncio.get_running_loop()
+        pool = IngestionService._get_pool()
+        
+        source, planned = await loop.run_in_executor(pool, document_parser.plan, path, kind)
+        try:
+            return await IngestionService._consume(task_id, source, kind, planned, collection, doc_id, filename)
+        finally:
+            if source != path:
+                try:
+                    os.unlink(source)
+                except OSError:
+                    pass
+    
+    @staticmethod
+    async def _consume(
+        task_id: str,
+        source: str,
+        kind: str,
+        planned: List[Tuple[int, int, int]],
+        collection: str,
+        doc_id: str,
+        filename: str
+    ) -> int:
+        """按分段计划提交解析任务，顺序消费结果并切块入库"""
+        loop = asyncio.get_running_loop()
+        pool = IngestionService._get_pool()
+        total = planned[-1][1] if planned else 0
+        await IngestionService._set_progress(task_id, {
+            "state": "STARTED",
+            "stage": "parsing",
+            "units_total": total,
+            "units_done": 0,
+            "chunks_done": 0,
+        })
+        
+        ranges = deque(planned)
+        window = max(1, settings.KB_PARSE_WORKERS * 2)
+        in_flight: deque = deque()
+        chunker = TokenChunker(settings.KB_CHUNK_TOKENS, settings.KB_CHUNK_OVERLAP)
+        batch: List[Chunk] = []
+        state = {"chunks": 0, "dim": 0}
+        
+        def submit():
+            while ranges and len(in_flight) < window:
+                start, end, offset = ranges.popleft()
+                future = loop.run_in_executor(pool, document_parser.parse_range, source, kind, start, end, offset)
+                in_flight.append((end, future))
+        
+        submit()
+        while in_flight:
+            # 按提交顺序消费，保证块的顺序与页码一致
+            end, future = in_flight.popleft()
+            pages = await future
+            submit()
+            for page, text in pages:
+                batch.extend(chunker.feed(page, text))
+            while len(batch) >= settings.KB_EMBED_BATCH_SIZE:
+                head = batch[:settings.KB_EMBED_BATCH_SIZE]
+                batch = batch[settings.KB_EMBED_BATCH_SIZE:]
+                await IngestionService._store(head, collection, doc_id, filename, state)
+            await IngestionService._set_progress(task_id, {
+                "stage": "parsing" if in_flight else "embedding",
+                "units_done": end,
+                "chunks_done": state["chunks"],
+            })
+        
+        batch.extend(chunker.flush())
+        for start in range(0, len(batch), settings.KB_EMBED_BATCH_SIZE):
+            await IngestionService._store(
+                batch[start:start + settings.KB_EMBED_BATCH_SIZE], collection, doc_id, filename, state
+            )
+        return state["chunks"]
+    
+    @staticmethod
+    async def _store(chunks: List[Chunk], collection: str, doc_id: str, filename: str, state: Dict[str, int]):
+        """embedding 一批块并写入向量库与 KBItem"""
+        if not chunks:
+            return
+        texts = [c.text for c in chunks]
+        vectors = await EmbeddingService.embed(texts)
+        if not state["dim"]:
+            state["dim"] = len(vectors[0])
+            await vector_service.create_collection(collection, state["dim"])
+        
+        metas_in = [
+            {
+                "doc_id": doc_id,
+                "source": filename,
+                "chunk": state["chunks"] + i,
+                "page_start": c.page_start,
+                "page_end": c.page_end,
+            }
+            for i, c in enumerate(chunks)
+        ]
+        metas = [{**m, "text": t} for t, m in zip(texts, metas_in)]
+        if hasattr(vector_service, "upsert_with_ids"):
+            ids = await vector_service.upsert_with_ids(collection, vectors, metas)
+        else:
+            await vector_service.upsert(collection, vectors, metas)
+            ids = []
+        if ids:
+            pairs = [{"backend_pk": pk, "text": t, "metadata": m} for pk, t, m in zip(ids, texts, metas_in)]
+            async with AsyncSessionLocal() as db:
+                await KnowledgeStoreService.store_items(db, collection, pairs)
+                await db.commit()
+        state["chunks"] += len(chunks)
+    
+    # ==================== 进度 ====================
+    
+    @staticmethod
+    async def _set_progress(task_id: str, fields: Dict[str, Any]):
+        local = IngestionService._local_progress
+        progress = local.setdefault(task_id, {})
+        progress.update(fields)
+        local.move_to_end(task_id)
+        while len(local) > IngestionService.LOCAL_PROGRESS_LIMIT:
+            local.popitem(last=False)
+        
+        key = IngestionService.TASK_KEY_PREFIX + task_id
+        try:
+            async with redis_client.pipeline() as pipe:
+                pipe.hset(key, mapping={k: str(v) for k, v in fields.items()})
+                pipe.expire(key, settings.KB_TASK_TTL)
+        except RedisUnavailableError:
+            pass
+        except Exception as e:
+            logger.error(f"写入入库进度失败: {e}")
+    
+    @staticmethod
+    async def get_progress(task_id: str) -> Optional[Dict[str, Any]]:
+        """任务进度；不是入库任务时返回 None"""
+        try:
+            progress = await redis_client.hgetall(IngestionService.TASK_KEY_PREFIX + task_id)
+            if progress:
+                return progress
+        except RedisUnavailableError:
+            pass
+        except Exception as e:
+            logger.error(f"读取入库进度失败: {e}")
+        progress = IngestionService._local_progress.get(task_id)
+        return {k: str(v) for k, v in progress.items()} if progress else None
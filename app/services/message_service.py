@@ -15,10 +15,12 @@ from app.services.ai_service import AIModelService
 from app.services.model_config_service import ModelConfigService
 from app.services.app_service import ApplicationService
 from app.services.conversation_service import ConversationService
+from app.core.config import settings
 from app.utils.exceptions import NotFoundException, BadRequestException
 from app.utils.logger import logger
 from app.utils.distributed_lock import ConversationLock
 from app.services.cache_service import ConversationCache
+from app.middleware.rate_limiter import TokenRateLimiter, TokenReservation
 
 
 class MessageService:
@@ -139,44 +141,70 @@ class MessageService:
             非流式: (user_message, assistant_message)
             流式: AsyncIterator
         """
-        # 使用分布式锁防止并发
-        async with ConversationLock.with_conversation_lock(str(conv_id), timeout=60):
-            logger.info(f"获取会话锁: {conv_id}")
-            
-            # 1. 保存用户消息
-            user_message = await MessageService.create_message(
-                db, conv_id, user_id, message_data
-            )
+        # 1. 获取模型配置
+        model_config = await MessageService._get_model_config(
+            db, user_id, message_data
+        )
         
-            # 2. 获取模型配置
-            model_config = await MessageService._get_model_config(
-                db, user_id, message_data
-            )
-            
-            if not model_config:
-                raise BadRequestException("未找到可用的模型配置，请先配置模型")
-            
-            # 3. 构建消息历史
-            messages = await MessageService._build_message_history(
-                db, conv_id, message_data.content, model_config
-            )
-            
-            # 4. 调用 AI 模型
-            try:
-                if stream:
-                    # 流式响应
-                    return MessageService._stream_ai_response(
-                        db, conv_id, messages, model_config
-                    )
-                else:
-                    # 同步响应
-                    return await MessageService._sync_ai_response(
-                        db, conv_id, messages, model_config, user_message
+        if not model_config:
+            raise BadRequestException("未找到可用的模型配置，请先配置模型")
+        
+        # 2. 预留 token 预算：在加锁与保存消息之前，排队等待不占用会话锁，
+        #    超限被拒绝时也不会留下用户消息
+        history = await MessageService._build_message_history(
+            db, conv_id, message_data.content, model_config
+        )
+        prompt_tokens = TokenRateLimiter.estimate_messages(
+            history + [{"role": "user", "content": message_data.content}]
+        )
+        completion_tokens = (
+            model_config.get("config", {}).get("max_tokens")
+            or settings.TOKEN_RATE_LIMIT_COMPLETION_ESTIMATE
+        )
+        reservation = await TokenRateLimiter.reserve(
+            user_id, model_config.get("application_id"), prompt_tokens + completion_tokens
+        )
+        
+        # 交给模型调用之后由其负责结算，之前的任何失败都要退还预留
+        handed_off = False
+        try:
+            # 使用分布式锁防止并发
+            async with ConversationLock.with_conversation_lock(str(conv_id), timeout=60):
+                logger.info(f"获取会话锁: {conv_id}")
+                
+                # 3. 保存用户消息
+                user_message = await MessageService.create_message(
+                    db, conv_id, user_id, message_data
+                )
+                
+                try:
+                    # 4. 构建消息历史（包含刚保存的消息）
+                    messages = await MessageService._build_message_history(
+                        db, conv_id, message_data.content, model_config
                     )
-            
-            except Exception as e:
-                logger.error(f"AI 调用失败: {e}")
-                raise
+                    
+                    # 5. 调用 AI 模型
+                    handed_off = True
+                    if stream:
+                        # 流式响应
+                        return MessageService._stream_ai_response(
+                            db, conv_id, messages, model_config, reservation, prompt_tokens
+                        )
+                    else:
+                        # 同步响应
+                        return await MessageService._sync_ai_response(
+                            db, conv_id, messages, model_config, user_message, reservation
+                        )
+                except BaseException as e:
+                    if isinstance(e, Exception):
+                        logger.error(f"AI 调用失败: {e}")
+                    # 用户消息随事务回滚，缓存中追加的那条也要丢弃
+                    await ConversationCache.clear_conversation_cache(conv_id)
+                    raise
+        except BaseException:
+            if not handed_off:
+                await TokenRateLimiter.release(reservation)
+            raise
     
     @staticmethod
     async def _get_model_config(
@@ -221,7 +249,8 @@ class MessageService:
                             "api_key": api_key,
                             "api_base": config.api_base,
                             "config": app_config["model_config"],
-                            "system_prompt": app_config.get("system_prompt")
+                            "system_prompt": app_config.get("system_prompt"),
+                            "application_id": message_data.use_application_config
                         }
         
         # 3. 用户默认配置（最低优先级）
@@ -253,40 +282,27 @@ class MessageService:
         if model_config.get("system_prompt"):
             messages.append({"role": "system", "content": model_config["system_prompt"]})
 
-        # 优先使用缓存
-        cached = None
-        try:
-            cached = await ConversationCache.get_messages(conv_id)
-        except Exception:
-            cached = None
-
-        if cached:
-            for msg in cached[-max_history:]:
-                if msg.get("role") in ["user", "assistant"] and msg.get("content") is not None:
-                    messages.append({"role": msg["role"], "content": msg["content"]})
-            return messages
-
-        # 缓存不可用时查询数据库
-        result = await db.execute(
-            select(Message)
-            .where(Message.conversation_id == conv_id)
-            .order_by(Message.created_at.desc())
-            .limit(max_history)
-        )
-        history = list(result.scalars().all())
-        history.reverse()
+        async def load_history() -> List[Dict[str, str]]:
+            result = await db.execute(
+                select(Message)
+                .where(Message.conversation_id == conv_id)
+                .order_by(Message.created_at.desc())
+                .limit(max_history)
+            )
+            history = list(result.scalars().all())
+            history.reverse()
+            return [
+                {"role": msg.role, "content": msg.content}
+                for msg in history
+                if msg.role in ["user", "assistant"]
+            ]
 
-        plain_history: List[Dict[str, str]] = []
-        for msg in history:
-            if msg.role in ["user", "assistant"]:
-                messages.append({"role": msg.role, "content": msg.content})
-                plain_history.append({"role": msg.role, "content": msg.content})
+        # 优先使用缓存，未命中时查询数据库并写入缓存（仅最近消息）
+        history = await ConversationCache.get_or_load_messages(conv_id, load_history)
 
-        # 写入缓存（仅最近消息）
-        try:
-            await ConversationCache.set_messages(conv_id, plain_history, max_count=max_history)
-        except Exception:
-            pass
+        for msg in (history or [])[-max_history:]:
+            if msg.get("role") in ["user", "assistant"] and msg.get("content") is not None:
+                messages.append({"role": msg["role"], "content": msg["content"]})
 
         return messages
     
@@ -296,19 +312,27 @@ class MessageService:
         conv_id: UUID,
         messages: List[Dict[str, str]],
         model_config: Dict[str, Any],
-        user_message: Message
+        user_message: Message,
+        reservation: Optional[TokenReservation] = None
     ) -> tuple[Message, Message]:
         """同步 AI 响应"""
         # 调用 AI 模型
-        response = await AIModelService.chat(
-            provider=model_config["provider"],
-            api_key=model_config["api_key"],
-            model=model_config["model_name"],
-            messages=messages,
-            stream=False,
-            api_base=model_config.get("api_base"),
-            **model_config.get("config", {})
-        )
+        try:
+            response = await AIModelService.chat(
+                provider=model_config["provider"],
+                api_key=model_config["api_key"],
+                model=model_config["model_name"],
+                messages=messages,
+                stream=False,
+                api_base=model_config.get("api_base"),
+                **model_config.get("config", {})
+            )
+        except Exception:
+            await TokenRateLimiter.release(reservation)
+            raise
+        
+        # 按实际用量结算 token 预算
+        await TokenRateLimiter.settle(reservation, response["usage"]["total_tokens"])
         
         # 保存 AI 响应消息
         assistant_message = Message(
@@ -340,53 +364,60 @@ class MessageService:
         db: AsyncSession,
         conv_id: UUID,
         messages: List[Dict[str, str]],
-        model_config: Dict[str, Any]
+        model_config: Dict[str, Any],
+        reservation: Optional[TokenReservation] = None,
+        prompt_tokens: int = 0
     ) -> AsyncIterator[Dict[str, Any]]:
         """流式 AI 响应"""
-        # 调用 AI 模型流式接口
-        stream = await AIModelService.chat(
-            provider=model_config["provider"],
-            api_key=model_config["api_key"],
-            model=model_config["model_name"],
-            messages=messages,
-            stream=True,
-            api_base=model_config.get("api_base"),
-            **model_config.get("config", {})
-        )
-        
         full_content = ""
-        
-        async for chunk in stream:
-            if not chunk.get("done"):
-                content = chunk.get("content", "")
-                full_content += content
-                yield chunk
-            else:
-                # 流式响应结束，保存消息
-                assistant_message = Message(
-                    conversation_id=conv_id,
-                    role="assistant",
-                    content=full_content,
-                    model_provider=model_config["provider"],
-                    model_name=model_config["model_name"],
-                    model_config=model_config.get("config", {})
-                )
-                db.add(assistant_message)
-                await db.flush()
-                await db.refresh(assistant_message)
-                
-                # 更新会话
-                await ConversationService.update_message_count(db, conv_id)
-                try:
-                    await ConversationCache.append_message(conv_id, {"role": "assistant", "content": full_content})
-                except Exception:
-                    pass
-                
-                # 返回最后一个块，包含完整信息
-                yield {
-                    "content": "",
-                    "done": True,
-                    "message_id": str(assistant_message.id),
-                    "model_provider": assistant_message.model_provider,
-                    "model_name": assistant_message.model_name
-                }
+        try:
+            # 调用 AI 模型流式接口
+            stream = await AIModelService.chat(
+                provider=model_config["provider"],
+                api_key=model_config["api_key"],
+                model=model_config["model_name"],
+                messages=messages,
+                stream=True,
+                api_base=model_config.get("api_base"),
+                **model_config.get("config", {})
+            )
+            
+            async for chunk in stream:
+                if not chunk.get("done"):
+                    content = chunk.get("content", "")
+                    full_content += content
+                    yield chunk
+                else:
+                    # 流式响应结束，保存消息
+                    assistant_message = Message(
+                        conversation_id=conv_id,
+                        role="assistant",
+                        content=full_content,
+                        model_provider=model_config["provider"],
+                        model_name=model_config["model_name"],
+                        model_config=model_config.get("config", {})
+                    )
+                    db.add(assistant_message)
+                    await db.flush()
+                    await db.refresh(assistant_message)
+                    
+                    # 更新会话
+                    await ConversationService.update_message_count(db, conv_id)
+                    try:
+                        await ConversationCache.append_message(conv_id, {"role": "assistant", "content": full_content})
+                    except Exception:
+                        pass
+                    
+                    # 返回最后一个块，包含完整信息
+                    yield {
+                        "content": "",
+                        "done": True,
+                        "message_id": str(assistant_message.id),
+                        "model_provider": assistant_message.model_provider,
+                        "model_name": assistant_message.model_name
+                    }
+        finally:
+            # 流式接口不返回用量，按提示词与已输出内容估算结算（包括中途断开的情况）
+            await TokenRateLimiter.settle(
+                reservation, prompt_tokens + TokenRateLimiter.estimate_tokens(full_content)
+            )
@@ -57,6 +57,12 @@ class ModelConfigService:
         await db.flush()
         await db.refresh(db_config)
         
+        # 新的默认配置可能替换了缓存中的配置
+        if config_data.is_default:
+            await ModelConfigService._commit_and_invalidate(db, user_id)
+        else:
+            await db.commit()
+        
         return db_config
     
     @staticmethod
@@ -98,32 +104,27 @@ class ModelConfigService:
         user_id: UUID,
         provider: Optional[str] = None
     ) -> Optional[ModelConfig]:
-        """获取用户的默认模型配置（带缓存）"""
-        # 尝试从缓存获取
-        cached_config = await UserCache.get_default_model_config(user_id)
-        if cached_config and (not provider or cached_config.get("provider") == provider):
-            # 从缓存构造对象（简化版）
-            config = ModelConfig(**cached_config)
-            return config
-        
-        # 从数据库查询
-        query = select(ModelConfig).where(
-            and_(
-                ModelConfig.user_id == user_id,
-                ModelConfig.is_default == True,
-                ModelConfig.is_active == True
-            )
-        )
+        """
+        获取用户的默认模型配置（带缓存，按提供商分别缓存）
         
-        if provider:
-            query = query.where(ModelConfig.provider == provider)
-        
-        result = await db.execute(query)
-        config = result.scalar_one_or_none()
-        
-        # 缓存结果
-        if config:
-            config_dict = {
+        每个提供商可以各有一个默认配置；未指定提供商时取最近创建的默认配置。
+        """
+        async def load_default() -> Optional[dict]:
+            query = select(ModelConfig).where(
+                and_(
+                    ModelConfig.user_id == user_id,
+                    ModelConfig.is_default == True,
+                    ModelConfig.is_active == True
+                )
+            )
+            if provider:
+                query = query.where(ModelConfig.provider == provider)
+            query = query.order_by(ModelConfig.created_at.desc()).limit(1)
+            result = await db.execute(query)
+            config = result.scalars().first()
+            if not config:
+                return None
+            return {
                 "id": str(config.id),
                 "user_id": str(config.user_id),
                 "provider": config.provider,
@@ -134,9 +135,12 @@ class ModelConfigService:
                 "is_active": config.is_active,
                 "config": config.config
             }
-            await UserCache.set_default_model_config(user_id, config_dict)
         
-        return config
+        cached_config = await UserCache.get_or_load_default_model_config(user_id, load_default, provider)
+        if cached_config:
+            # 从缓存构造对象（简化版）
+            return ModelConfig(**cached_config)
+        return None
     
     @staticmethod
     async def update_model_config(
@@ -165,9 +169,7 @@ class ModelConfigService:
         
         await db.flush()
         await db.refresh(config)
-        
-        # 清除缓存
-        await UserCache.clear_default_model_config(user_id)
+        await ModelConfigService._commit_and_invalidate(db, user_id)
         
         return config
     
@@ -184,9 +186,20 @@ class ModelConfigService:
         
         await db.delete(config)
         await db.flush()
+        await ModelConfigService._commit_and_invalidate(db, user_id)
         
         return True
     
+    @staticmethod
+    async def _commit_and_invalidate(db: AsyncSession, user_id: UUID):
+        """
+        提交后再清除默认模型配置缓存
+        
+        若先清除再提交，提交前并发的缓存未命中会读到旧的默认配置并写入新一代缓存，在整个 TTL 内生效。
+        """
+        await db.commit()
+        await UserCache.clear_default_model_config(user_id)
+    
     @staticmethod
     async def get_decrypted_api_key(config: ModelConfig) -> str:
         """获取解密后的 API Key"""
@@ -1,17 +1,40 @@
 """
 Token 管理服务
 """
-from typing import Optional
+from typing import Optional, Dict, Any
 from datetime import timedelta
 from uuid import UUID
+import asyncio
+import time
 
-from app.core.redis_client import redis_client
+from app.core.config import settings
+from app.core.redis_client import redis_client, RedisUnavailableError
 from app.core.security import decode_access_token
+from app.utils.bloom_filter import BloomFilter
+from app.utils.logger import logger
 
 
 class TokenService:
     """Token 管理服务"""
     
+    # 黑名单索引：有序集合，成员为 jti，分数为过期时间戳，用于启动时重建布隆过滤器
+    BLACKLIST_INDEX_KEY = "token_blacklist:index"
+    
+    # 本进程的黑名单布隆过滤器；仅在与 Redis 同步后才信任其“不存在”的判定
+    bloom = BloomFilter(
+        settings.TOKEN_BLACKLIST_BLOOM_CAPACITY,
+        settings.TOKEN_BLACKLIST_BLOOM_ERROR_RATE
+    )
+    _bloom_ready = False
+    _listener_task: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def _get_jti(token: str, payload: Optional[Dict[str, Any]]) -> str:
+        # 使用 jti 或 token 前32位
+        if payload:
+            return payload.get("jti", token[:32])
+        return token[:32]
+    
     @staticmethod
     async def add_token_to_blacklist(token: str, user_id: UUID, expire_seconds: int = 900):
         """
@@ -23,34 +46,125 @@ class TokenService:
             expire_seconds: 过期时间（秒）
         """
         # 解码 token 获取 jti（如果有的话）
-        payload = decode_access_token(token)
-        if payload:
-            jti = payload.get("jti", token[:32])  # 使用 jti 或 token 前32位
-        else:
-            jti = token[:32]
+        jti = TokenService._get_jti(token, decode_access_token(token))
         
         key = f"token_blacklist:{jti}"
-        await redis_client.set(key, str(user_id), expire=expire_seconds)
+        now = time.time()
+        # 写入黑名单、更新索引并广播给其他 worker，一次往返完成
+        async with redis_client.pipeline() as pipe:
+            pipe.set(key, str(user_id), ex=expire_seconds)
+            pipe.zadd(TokenService.BLACKLIST_INDEX_KEY, {jti: now + expire_seconds})
+            pipe.zremrangebyscore(TokenService.BLACKLIST_INDEX_KEY, "-inf", now)
+            pipe.publish(settings.TOKEN_BLACKLIST_CHANNEL, jti)
+        TokenService.bloom.add(jti)
     
     @staticmethod
-    async def is_token_blacklisted(token: str) -> bool:
+    async def is_token_blacklisted(token: str, payload: Optional[Dict[str, Any]] = None) -> bool:
         """
         检查 token 是否在黑名单中
         
+        布隆过滤器判定不存在时直接返回，只有命中时才查询 Redis 确认。
+        
         Args:
             token: JWT token
+            payload: 已解码的声明（调用方已解码时传入，避免重复验签）
         
         Returns:
             是否在黑名单中
+        
+        Raises:
+            RedisUnavailableError: Redis 熔断且本地过滤器未就绪、无法确认时；
+                由调用方决定失败策略（认证依赖返回 503）
         """
-        payload = decode_access_token(token)
-        if payload:
-            jti = payload.get("jti", token[:32])
-        else:
-            jti = token[:32]
+        if payload is None:
+            payload = decode_access_token(token)
+        jti = TokenService._get_jti(token, payload)
+        
+        maybe_blacklisted = jti in TokenService.bloom
+        if TokenService._bloom_ready and not maybe_blacklisted:
+            return False
         
         key = f"token_blacklist:{jti}"
-        return await redis_client.exists(key)
+        try:
+            return await redis_client.exists(key)
+        except RedisUnavailableError:
+            # Redis 熔断期间以本地过滤器为准，命中时按已失效处理
+            if maybe_blacklisted:
+                return True
+            raise
+    
+    @staticmethod
+    async def start_blacklist_listener():
+        """启动黑名单同步（应用启动时调用）"""
+        if not settings.TOKEN_BLACKLIST_BLOOM_ENABLED or TokenService._listener_task:
+            return
+        TokenService._listener_task = asyncio.create_task(TokenService._listen_blacklist())
+    
+    @staticmethod
+    async def stop_blacklist_listener():
+        """停止黑名单同步（应用关闭时调用）"""
+        task = TokenService._listener_task
+        TokenService._listener_task = None
+        TokenService._bloom_ready = False
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    
+    @staticmethod
+    async def _rebuild_bloom():
+        """从 Redis 索引重建布隆过滤器"""
+        jtis = await redis_client.zrangebyscore(
+            TokenService.BLACKLIST_INDEX_KEY, time.time(), "+inf"
+        )
+        bloom = BloomFilter(
+            max(settings.TOKEN_BLACKLIST_BLOOM_CAPACITY, len(jtis) * 2),
+            settings.TOKEN_BLACKLIST_BLOOM_ERROR_RATE
+        )
+        for jti in jtis:
+            bloom.add(jti)
+        TokenService.bloom = bloom
+        logger.info(f"Token 黑名单布隆过滤器已重建: {len(jtis)} 条")
+    
+    @staticmethod
+    async def _listen_blacklist():
+        """订阅黑名单广播，断线后重连并重建过滤器"""
+        retry_delay = 1.0
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis_client.pubsub()
+                # 先订阅再重建，重建期间新增的 jti 会通过广播补上
+                await pubsub.subscribe(settings.TOKEN_BLACKLIST_CHANNEL)
+                await TokenService._rebuild_bloom()
+                TokenService._bloom_ready = True
+                retry_delay = 1.0
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    TokenService.bloom.add(message["data"])
+                    if TokenService.bloom.is_saturated:
+                        # 过期的 jti 只会累积，超出容量后按索引重建
+                        await TokenService._rebuild_bloom()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 断线期间可能错过广播，不再信任过滤器的否定判定
+                TokenService._bloom_ready = False
+                if isinstance(e, RedisUnavailableError):
+                    logger.debug("Token 黑名单同步中断, Redis 熔断中")
+                else:
+                    logger.error(f"Token 黑名单同步中断, {retry_delay:.0f} 秒后重连, 错误: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 5.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
     
     @staticmethod
     async def save_refresh_token(user_id: UUID, refresh_token: str, expire_days: int = 7):
@@ -7,8 +7,9 @@ from sqlalchemy import select, func
 from uuid import UUID
 
 from app.models.user import User
-from app.schemas.user import UserCreate, UserUpdate
-from app.core.security import get_password_hash, verify_password
+from app.schemas.user import UserCreate, UserUpdate, Principal
+from app.core.security import get_password_hash_async, verify_password_async
+from app.services.cache_service import UserCache
 from app.utils.exceptions import NotFoundException, ConflictException, UnauthorizedException
 
 
@@ -33,7 +34,7 @@ class UserService:
             email=user_data.email,
             username=user_data.username,
             full_name=user_data.full_name,
-            hashed_password=get_password_hash(user_data.password)
+            hashed_password=await get_password_hash_async(user_data.password)
         )
         db.add(db_user)
         await db.flush()
@@ -47,6 +48,30 @@ class UserService:
         result = await db.execute(select(User).where(User.id == user_id))
         return result.scalar_one_or_none()
     
+    @staticmethod
+    async def get_principal(db: AsyncSession, user_id: UUID) -> Optional[Principal]:
+        """
+        获取用户认证主体（优先读缓存）
+        
+        Args:
+            user_id: 用户ID
+            db: 数据库会话（仅在缓存未命中时使用）
+        
+        Returns:
+            认证主体，用户不存在返回 None
+        """
+        async def load_principal() -> Optional[dict]:
+            result = await db.execute(
+                select(User.id, User.is_active, User.is_superuser).where(User.id == user_id)
+            )
+            row = result.one_or_none()
+            if row is None:
+                return None
+            return {"id": str(row.id), "is_active": row.is_active, "is_superuser": row.is_superuser}
+        
+        data = await UserCache.get_or_load_principal(user_id, load_principal)
+        return Principal(**data) if data else None
+    
     @staticmethod
     async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
         """通过邮箱获取用户"""
@@ -69,7 +94,7 @@ class UserService:
         if not user:
             return None
         
-        if not verify_password(password, user.hashed_password):
+        if not await verify_password_async(password, user.hashed_password):
             return None
         
         if not user.is_active:
@@ -88,7 +113,7 @@ class UserService:
         
         # 如果更新密码，需要哈希
         if "password" in update_data:
-            update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
+            update_data["hashed_password"] = await get_password_hash_async(update_data.pop("password"))
         
         # 检查邮箱冲突
         if "email" in update_data and update_data["email"] != user.email:
@@ -107,9 +132,21 @@ class UserService:
         
         await db.flush()
         await db.refresh(user)
+        await UserService._commit_and_invalidate(db, user)
         
         return user
     
+    @staticmethod
+    async def _commit_and_invalidate(db: AsyncSession, user: User):
+        """
+        提交后再失效用户缓存
+        
+        若先失效再提交，提交前并发的缓存未命中会读到旧行（如已禁用用户仍为激活）
+        并重新写入缓存，在整个 TTL 内生效。
+        """
+        await db.commit()
+        await UserCache.invalidate(user.id)
+    
     @staticmethod
     async def get_users(
         db: AsyncSession,
@@ -138,6 +175,7 @@ class UserService:
         user.is_active = False
         await db.flush()
         await db.refresh(user)
+        await UserService._commit_and_invalidate(db, user)
         
         return user
     
@@ -151,6 +189,7 @@ class UserService:
         user.is_active = True
         await db.flush()
         await db.refresh(user)
+        await UserService._commit_and_invalidate(db, user)
         
         return user
 
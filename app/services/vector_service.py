@@ -1,129 +1,794 @@
-from typing import List, Dict, Any, Tuple
-import math
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import json
+import os
+import re
+import shutil
+import threading
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台：仅单进程使用
+    fcntl = None
 from app.core.config import settings
+from app.utils.logger import logger
+
+
+# 不进倒排索引的元数据键（块原文），按这些键过滤时顺序扫描
+_UNINDEXED_KEYS = frozenset({"text"})
+# 超过该长度的字符串值不进倒排索引
+_MAX_INDEXED_STR = 256
+
+
+def _filter_key(value: Any) -> Optional[str]:
+    """
+    元数据值在倒排索引中的键；不可索引的值（dict、长字符串等）返回 None
+
+    数值与布尔按 Python 的相等语义归一：1、1.0、True 是同一个键
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, str) and len(value) > _MAX_INDEXED_STR:
+        return None
+    if value is None or isinstance(value, (str, int, float)):
+        return json.dumps(value, ensure_ascii=False)
+    return None
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回得分最高的 k 个下标（降序）"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+class _IVFIndex:
+    """IVF-flat 索引：球面 k-means 聚类，查询时只扫描最近的 nprobe 个聚类"""
+
+    # 训练 k-means 时每个聚类最多采样的行数
+    SAMPLE_PER_LIST = 64
+    KMEANS_ITERATIONS = 10
+    # 分块计算最近聚类，控制临时矩阵大小
+    ASSIGN_CHUNK = 16384
+
+    def __init__(self, centroids: np.ndarray, ids: np.ndarray, offsets: np.ndarray, size: int):
+        self.centroids = centroids
+        self.ids = ids
+        self.offsets = offsets
+        # 建索引时覆盖的行数，之后追加的行在查询时暴力扫描
+        self.size = size
+
+    @staticmethod
+    def build(matrix: np.ndarray, nlist: int, seed: int = 0) -> "_IVFIndex":
+        n = len(matrix)
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * _IVFIndex.SAMPLE_PER_LIST)
+        sample = matrix[rng.choice(n, sample_size, replace=False)] if sample_size < n else matrix
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(_IVFIndex.KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空聚类重新随机取点
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, _IVFIndex.ASSIGN_CHUNK):
+            chunk = matrix[start:start + _IVFIndex.ASSIGN_CHUNK]
+            assign[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        ids = np.argsort(assign, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        return _IVFIndex(centroids, ids, offsets, n)
+
+    def candidates(self, q: np.ndarray, nprobe: int, total: int) -> np.ndarray:
+        lists = _top_k(self.centroids @ q, nprobe)
+        parts = [self.ids[self.offsets[j]:self.offsets[j + 1]] for j in lists]
+        if total > self.size:
+            parts.append(np.arange(self.size, total))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+class _CollectionStorage:
+    """
+    集合的磁盘文件：
+    - vectors.f32: 归一化后的 float32 行，按容量预分配，多进程 mmap 共享页缓存
+    - meta.json: 维度、索引类型等配置
+    - metadata.log: 追加写日志，每行一次 upsert（起始行号 + 元数据），行写完才算提交
+    - .lock: 写入时的 fcntl 排他锁
+    """
+
+    _SAFE_NAME = re.compile(r"[A-Za-z0-9_\-]+")
+
+    def __init__(self, root: str, name: str):
+        self.name = name
+        dirname = name if self._SAFE_NAME.fullmatch(name) else "x-" + name.encode().hex()
+        self.path = os.path.join(root, dirname)
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.meta_path = os.path.join(self.path, "meta.json")
+        self.log_path = os.path.join(self.path, "metadata.log")
+        self.log_offset = 0
+
+    @staticmethod
+    def list_names(root: str) -> List[str]:
+        names = []
+        if not os.path.isdir(root):
+            return names
+        for entry in os.listdir(root):
+            try:
+                with open(os.path.join(root, entry, "meta.json")) as f:
+                    names.append(json.load(f)["name"])
+            except (OSError, ValueError, KeyError):
+                continue
+        return names
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    def read_meta(self) -> Dict[str, Any]:
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def write_meta(self, dim: int, index_type: str, nlist: Optional[int]):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"name": self.name, "dim": dim, "index_type": index_type, "nlist": nlist}, f)
+        os.replace(tmp, self.meta_path)
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def capacity(self, dim: int) -> int:
+        if not dim:
+            return 0
+        try:
+            return os.path.getsize(self.vectors_path) // (dim * 4)
+        except OSError:
+            return 0
+
+    def map(self, dim: int, capacity: Optional[int] = None) -> np.ndarray:
+        """映射向量文件，capacity 大于当前文件时先扩容"""
+        current = self.capacity(dim)
+        if capacity is not None and capacity > current:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(capacity * dim * 4)
+            current = capacity
+        if current == 0:
+            return np.empty((0, dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(current, dim))
+
+    def log_changed(self) -> bool:
+        try:
+            return os.path.getsize(self.log_path) != self.log_offset
+        except OSError:
+            return False
+
+    def read_log(self) -> List[Tuple[int, List[Dict[str, Any]]]]:
+        """读取上次之后提交的 upsert 记录（忽略未写完的末行）"""
+        entries = []
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self.log_offset)
+                data = f.read()
+        except OSError:
+            return entries
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line:
+                record = json.loads(line)
+                entries.append((record["start"], record["metadatas"]))
+        self.log_offset += end
+        return entries
+
+    def append_log(self, start: int, metadatas: List[Dict[str, Any]]):
+        line = json.dumps({"start": start, "metadatas": metadatas}, ensure_ascii=False) + "\n"
+        with open(self.log_path, "ab") as f:
+            f.write(line.encode())
+        self.log_offset += len(line.encode())
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class _MemoryCollection:
+    """单个集合：连续的 float32 矩阵，行已归一化，容量按倍数增长"""
+
+    INITIAL_CAPACITY = 1024
+    # 行数达到该值后才建 IVF 索引，更小的集合暴力检索更快
+    IVF_MIN_SIZE = 4096
+    # 索引后追加的行数超过已索引行数的该比例时后台重建
+    IVF_REBUILD_RATIO = 0.2
+
+    def __init__(
+        self,
+        dim: int = 0,
+        index_type: str = "flat",
+        nlist: Optional[int] = None,
+        storage: Optional[_CollectionStorage] = None
+    ):
+        if index_type not in ("flat", "ivf_flat"):
+            raise ValueError(f"不支持的索引类型: {index_type}")
+        self.dim = dim
+        self.size = 0
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self.metadatas: List[Dict[str, Any]] = []
+        # 元数据倒排索引：键 -> 值 -> 行号列表（升序）
+        self.inverted: Dict[str, Dict[str, List[int]]] = {}
+        self.index_type = index_type
+        self.nlist = nlist
+        self.index: Optional[_IVFIndex] = None
+        self.storage = storage
+        # 持久化集合的写入在线程池中执行，与同步日志互斥
+        self._mutex = threading.RLock()
+        if storage is not None:
+            if storage.exists():
+                meta = storage.read_meta()
+                self.dim, self.index_type, self.nlist = meta["dim"], meta["index_type"], meta["nlist"]
+                self.matrix = storage.map(self.dim)
+                self.sync()
+            else:
+                storage.write_meta(dim, index_type, nlist)
+
+    def sync(self):
+        """加载其他进程提交的写入（只有日志变化时才读取）"""
+        storage = self.storage
+        if storage is None or not storage.log_changed():
+            return
+        # 本进程的写入正在进行时跳过，写入前会先追上其他进程的提交
+        if not self._mutex.acquire(blocking=False):
+            return
+        try:
+            size = self.size
+            for start, metadatas in storage.read_log():
+                self.metadatas[start:start + len(metadatas)] = metadatas
+                self._index_metadata(start, metadatas)
+                size = max(size, start + len(metadatas))
+            if size > self.matrix.shape[0]:
+                self.matrix = storage.map(self.dim)
+            self.size = size
+        finally:
+            self._mutex.release()
+
+    def needs_rebuild(self) -> bool:
+        if self.index_type != "ivf_flat" or self.size < self.IVF_MIN_SIZE:
+            return False
+        if self.index is None:
+            return True
+        return self.size - self.index.size > self.index.size * self.IVF_REBUILD_RATIO
+
+    def build_index(self) -> _IVFIndex:
+        n = self.size
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        return _IVFIndex.build(self.matrix[:n], nlist)
+
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        capacity = self.matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, self.INITIAL_CAPACITY)
+        if self.storage is not None:
+            self.matrix = self.storage.map(self.dim, new_capacity)
+            return
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self.size] = self.matrix[:self.size]
+        self.matrix = matrix
+
+    def append(self, vectors: List[List[float]], metadatas: List[Dict[str, Any]]) -> range:
+        rows = np.asarray(vectors, dtype=np.float32)
+        if rows.ndim != 2:
+            rows = rows.reshape(len(vectors), -1)
+        if not self.dim:
+            self.dim = rows.shape[1]
+            self.matrix = np.empty((0, self.dim), dtype=np.float32)
+            if self.storage is not None:
+                self.storage.write_meta(self.dim, self.index_type, self.nlist)
+        if rows.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 期望 {self.dim}, 实际 {rows.shape[1]}")
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        rows = rows / norms
+        if self.storage is None:
+            return self._write(rows, metadatas)
+        # 跨进程串行写入：先追上其他进程的提交，再写向量、刷盘，最后追加日志作为提交点
+        with self._mutex, self.storage.lock():
+            self.sync()
+            written = self._write(rows, metadatas)
+            if isinstance(self.matrix, np.memmap):
+                self.matrix.flush()
+            self.storage.append_log(written.start, metadatas)
+        return written
+
+    def _write(self, rows: np.ndarray, metadatas: List[Dict[str, Any]]) -> range:
+        self._reserve(len(rows))
+        start = self.size
+        self.matrix[start:start + len(rows)] = rows
+        self.metadatas.extend(metadatas)
+        self._index_metadata(start, metadatas)
+        self.size += len(rows)
+        return range(start, self.size)
+
+    def _index_metadata(self, start: int, metadatas: List[Dict[str, Any]]):
+        inverted = self.inverted
+        for row, meta in enumerate(metadatas, start):
+            for key, value in meta.items():
+                if key in _UNINDEXED_KEYS:
+                    continue
+                value_key = _filter_key(value)
+                if value_key is not None:
+                    inverted.setdefault(key, {}).setdefault(value_key, []).append(row)
+
+    def filter_rows(self, filters: Dict[str, Any]) -> np.ndarray:
+        """
+        按元数据过滤得到候选行号（升序）
+
+        每个键要求值相等；值为列表时表示“属于其中之一”。多个键之间为且。
+        不在倒排索引中的键或值（原文、长字符串等）顺序扫描元数据。
+        """
+        result: Optional[np.ndarray] = None
+        for key, expected in filters.items():
+            values = list(expected) if isinstance(expected, (list, tuple, set)) else [expected]
+            value_keys = [_filter_key(v) for v in values]
+            if key in _UNINDEXED_KEYS or None in value_keys:
+                rows = self._scan(key, values)
+            else:
+                postings = self.inverted.get(key, {})
+                parts = [np.asarray(postings[k], dtype=np.int64) for k in value_keys if k in postings]
+                if not parts:
+                    return np.empty(0, dtype=np.int64)
+                rows = parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if len(result) == 0:
+                break
+        if result is None:
+            return np.arange(self.size)
+        # 其他进程的日志行可能先于本进程的 size 更新
+        return result[result < self.size]
+
+    def _scan(self, key: str, values: List[Any]) -> np.ndarray:
+        missing = object()
+        rows = [
+            row for row, meta in enumerate(self.metadatas[:self.size])
+            if meta.get(key, missing) in values
+        ]
+        return np.asarray(rows, dtype=np.int64)
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[tuple]:
+        self.sync()
+        n = self.size
+        if n == 0 or top_k <= 0:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            q = np.zeros_like(q)
+        else:
+            q = q / norm
+        if filters:
+            # 先用倒排索引得到满足条件的行，只对这些行精确计算，保证返回足量结果
+            cand = self.filter_rows(filters)
+            scores = self.matrix[cand] @ q
+            return [(int(cand[i]), float(scores[i])) for i in _top_k(scores, top_k)]
+        index = self.index
+        if index is None:
+            scores = self.matrix[:n] @ q
+            return [(int(i), float(scores[i])) for i in _top_k(scores, top_k)]
+        cand = index.candidates(q, nprobe or settings.VECTOR_IVF_NPROBE, n)
+        scores = self.matrix[cand] @ q
+        return [(int(cand[i]), float(scores[i])) for i in _top_k(scores, top_k)]
 
 
 class MemoryVectorService:
-    def __init__(self):
-        self.store: Dict[str, List[Tuple[List[float], Dict[str, Any]]]] = {}
+    # 超过该元素数（行数 × 维度）的检索放到线程池，避免阻塞事件循环
+    OFFLOAD_THRESHOLD = 1 << 21
+
+    def __init__(self, store_dir: Optional[str] = None):
+        # store_dir 为空时仅保存在进程内存中
+        self.store_dir = store_dir
+        self.store: Dict[str, _MemoryCollection] = {}
+        self._rebuild_tasks: Dict[str, asyncio.Task] = {}
+
+    def _get(self, name: str, create: bool = False, **options) -> Optional[_MemoryCollection]:
+        col = self.store.get(name)
+        if col is not None:
+            if col.storage is None or col.storage.exists():
+                return col
+            # 已被其他进程删除
+            self.store.pop(name, None)
+        storage = _CollectionStorage(self.store_dir, name) if self.store_dir else None
+        if not create and (storage is None or not storage.exists()):
+            return None
+        # 已持久化的集合直接映射，不拷贝向量数据
+        col = _MemoryCollection(storage=storage, **options)
+        self.store[name] = col
+        self._schedule_rebuild(name, col)
+        return col
 
-    async def create_collection(self, name: str, dim: int) -> bool:
-        self.store.setdefault(name, [])
+    async def create_collection(self, name: str, dim: int, index_type: Optional[str] = None, nlist: Optional[int] = None) -> bool:
+        """index_type: flat（默认，暴力检索）| ivf_flat（IVF 近似检索，nlist 默认 sqrt(行数)）"""
+        self._get(name, create=True, dim=dim, index_type=index_type or "flat", nlist=nlist)
         return True
 
     async def list_collections(self) -> List[str]:
-        return list(self.store.keys())
+        names = list(self.store.keys())
+        if self.store_dir:
+            names += [n for n in _CollectionStorage.list_names(self.store_dir) if n not in self.store]
+        return names
 
     async def delete_collection(self, name: str) -> bool:
-        if name in self.store:
-            del self.store[name]
-            return True
-        return False
+        task = self._rebuild_tasks.pop(name, None)
+        if task:
+            task.cancel()
+        col = self._get(name)
+        if col is None:
+            return False
+        del self.store[name]
+        if col.storage is not None:
+            await asyncio.to_thread(self._remove, col.storage)
+        return True
+
+    @staticmethod
+    def _remove(storage: _CollectionStorage):
+        with storage.lock():
+            storage.remove()
 
     async def upsert(self, name: str, vectors: List[List[float]], metadatas: List[Dict[str, Any]]) -> int:
-        items = self.store.setdefault(name, [])
-        for v, m in zip(vectors, metadatas):
-            items.append((v, m))
-        return len(vectors)
+        return len(await self.upsert_with_ids(name, vectors, metadatas))
 
     async def upsert_with_ids(self, name: str, vectors: List[List[float]], metadatas: List[Dict[str, Any]]) -> List[str]:
-        items = self.store.setdefault(name, [])
-        ids: List[str] = []
-        for v, m in zip(vectors, metadatas):
-            idx = len(items)
-            items.append((v, m))
-            ids.append(str(idx))
-        return ids
+        # 与 zip 语义一致：按较短的一方截断
+        count = min(len(vectors), len(metadatas))
+        if count == 0:
+            return []
+        col = self._get(name, create=True)
+        if col.storage is not None:
+            # 文件锁、刷盘与追加日志都会阻塞，放到线程池
+            rows = await asyncio.to_thread(col.append, vectors[:count], list(metadatas[:count]))
+        else:
+            rows = col.append(vectors[:count], list(metadatas[:count]))
+        self._schedule_rebuild(name, col)
+        return [str(i) for i in rows]
+
+    def _schedule_rebuild(self, name: str, col: _MemoryCollection):
+        if name in self._rebuild_tasks or not col.needs_rebuild():
+            return
+        self._rebuild_tasks[name] = asyncio.create_task(self._rebuild(name, col))
 
-    async def query(self, name: str, query_vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
-        items = self.store.get(name, [])
-        def cosine(a: List[float], b: List[float]) -> float:
-            dot = sum(x * y for x, y in zip(a, b))
-            na = math.sqrt(sum(x * x for x in a))
-            nb = math.sqrt(sum(y * y for y in b))
-            if na == 0 or nb == 0:
-                return 0.0
-            return dot / (na * nb)
-        scored = [(cosine(query_vector, v), m, str(i)) for i, (v, m) in enumerate(items)]
-        scored.sort(key=lambda x: x[0], reverse=True)
+    async def _rebuild(self, name: str, col: _MemoryCollection):
+        # 在线程池中训练，完成后整体替换；期间查询继续使用旧索引（新增行暴力扫描）
+        try:
+            col.index = await asyncio.to_thread(col.build_index)
+            logger.info(f"向量索引已重建: {name}, {col.index.size} 行, {len(col.index.centroids)} 个聚类")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"向量索引重建失败: {name}, 错误: {e}")
+        finally:
+            self._rebuild_tasks.pop(name, None)
+        # 重建期间又有大量写入时继续重建
+        if self.store.get(name) is col:
+            self._schedule_rebuild(name, col)
+
+    async def query(
+        self,
+        name: str,
+        query_vector: List[float],
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        nprobe: IVF 索引探测的聚类数，越大召回越高、越慢；flat 集合忽略
+        filters: 元数据过滤（键值相等，值为列表时表示属于其中之一），在检索前应用
+        offset: 跳过前 offset 条结果，用于分页
+        """
+        col = self._get(name)
+        if col is None:
+            return []
+        limit = offset + top_k
+        if col.size * col.dim > self.OFFLOAD_THRESHOLD:
+            hits = await asyncio.to_thread(col.search, query_vector, limit, nprobe, filters)
+        else:
+            hits = col.search(query_vector, limit, nprobe, filters)
         out = []
-        for score, meta, pk in scored[:top_k]:
-            r = dict(meta)
-            r["score"] = float(score)
-            r["pk"] = pk
+        for i, score in hits[offset:]:
+            r = dict(col.metadatas[i])
+            r["score"] = score
+            r["pk"] = str(i)
             out.append(r)
         return out
 
 
+class _MilvusHandle:
+    """
+    已加载集合的句柄：集合对象 + 创建时确定的索引类型与标量字段
+
+    has_metadata 为 False 表示旧版 schema（只有 pk 与 embedding 等字段，没有 JSON 字段 metadata），
+    元数据只写入已有的标量字段，也只能按这些字段过滤
+    """
+
+    def __init__(self, collection: Any, index_type: str, scalar_fields: Dict[str, str], has_metadata: bool = True):
+        self.collection = collection
+        self.index_type = index_type
+        self.scalar_fields = scalar_fields
+        self.has_metadata = has_metadata
+
+
 class MilvusVectorService:
-    def __init__(self):
-        # Lazy import; fallback if not available
+    """
+    Milvus 后端
+
+    - 创建集合时按 MILVUS_INDEX_TYPE（HNSW | IVF_FLAT | FLAT）建索引；
+      MILVUS_SCALAR_FIELDS 中的元数据键提升为独立标量字段，其余放在 JSON 字段 metadata
+    - 集合句柄首次使用时 load() 并缓存，不再每次调用都构造 Collection
+    - 插入按 MILVUS_INSERT_BATCH_SIZE 分批
+    - pymilvus 是同步客户端，所有调用都在专用线程池中执行，不阻塞事件循环
+
+    client 为 pymilvus 模块或具有相同接口（connections、utility、Collection、
+    CollectionSchema、FieldSchema、DataType）的替身，便于对接本地测试实现。
+    """
+
+    # 标量字段类型 -> 缺省值（Milvus 要求每行都有值）
+    SCALAR_DEFAULTS = {"VARCHAR": "", "INT64": 0, "DOUBLE": 0.0, "BOOL": False}
+    VARCHAR_MAX_LENGTH = 1024
+    INDEX_TYPES = {"flat": "FLAT", "ivf_flat": "IVF_FLAT", "hnsw": "HNSW"}
+
+    def __init__(self, client: Any = None):
         self._available = False
-        try:
-            from pymilvus import connections
-            self._connections = connections
-            self._available = True
-        except Exception:
-            self._connections = None
+        self._client = client
+        if client is None:
+            try:
+                import pymilvus
+                self._client = pymilvus
+            except Exception:
+                self._client = None
+        self._available = self._client is not None
+        self._handles: Dict[str, _MilvusHandle] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
 
-    async def create_collection(self, name: str, dim: int) -> bool:
-        if not self._available:
-            return False
-        from pymilvus import utility, CollectionSchema, FieldSchema, DataType, Collection
-        if utility.has_collection(name):
-            return True
+    def connect(self):
+        self._client.connections.connect(
+            host=settings.MILVUS_HOST,
+            port=str(settings.MILVUS_PORT),
+            user=settings.MILVUS_USER,
+            password=settings.MILVUS_PASSWORD
+        )
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=settings.MILVUS_WORKERS, thread_name_prefix="milvus")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        """关闭线程池（应用关闭时调用）"""
+        executor, self._executor = self._executor, None
+        self._handles.clear()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _index_params(self, index_type: str, nlist: Optional[int]) -> Dict[str, Any]:
+        if index_type == "HNSW":
+            params = {"M": settings.MILVUS_HNSW_M, "efConstruction": settings.MILVUS_HNSW_EF_CONSTRUCTION}
+        elif index_type == "IVF_FLAT":
+            params = {"nlist": nlist or settings.MILVUS_IVF_NLIST}
+        else:
+            params = {}
+        return {"index_type": index_type, "metric_type": "COSINE", "params": params}
+
+    def _search_params(self, index_type: str, limit: int, nprobe: Optional[int]) -> Dict[str, Any]:
+        if index_type == "HNSW":
+            # ef 不能小于返回条数
+            params = {"ef": max(settings.MILVUS_HNSW_EF, limit)}
+        elif index_type == "IVF_FLAT":
+            params = {"nprobe": nprobe or settings.VECTOR_IVF_NPROBE}
+        else:
+            params = {}
+        return {"metric_type": "COSINE", "params": params}
+
+    def _create_sync(self, name: str, dim: int, index_type: str, nlist: Optional[int]):
+        m = self._client
+        if m.utility.has_collection(name):
+            return
         fields = [
-            FieldSchema(name="pk", dtype=DataType.INT64, is_primary=True, auto_id=True),
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+            m.FieldSchema(name="pk", dtype=m.DataType.INT64, is_primary=True, auto_id=True),
+            m.FieldSchema(name="embedding", dtype=m.DataType.FLOAT_VECTOR, dim=dim),
+            m.FieldSchema(name="metadata", dtype=m.DataType.JSON),
         ]
-        schema = CollectionSchema(fields)
-        Collection(name, schema)
+        for field, type_name in settings.MILVUS_SCALAR_FIELDS.items():
+            extra = {"max_length": self.VARCHAR_MAX_LENGTH} if type_name == "VARCHAR" else {}
+            fields.append(m.FieldSchema(name=field, dtype=getattr(m.DataType, type_name), **extra))
+        col = m.Collection(name, m.CollectionSchema(fields))
+        col.create_index("embedding", self._index_params(index_type, nlist))
+
+    def _load_sync(self, name: str) -> Optional[_MilvusHandle]:
+        handle = self._handles.get(name)
+        if handle is not None:
+            return handle
+        m = self._client
+        if not m.utility.has_collection(name):
+            return None
+        col = m.Collection(name)
+        # 以集合实际的 schema / 索引为准（配置可能在集合创建后变更）
+        names = [f.name for f in col.schema.fields]
+        if "embedding" not in names:
+            raise ValueError(f"集合 {name} 没有 embedding 向量字段，无法使用")
+        has_metadata = "metadata" in names
+        if not has_metadata:
+            logger.warning(f"Milvus 集合 {name} 没有 metadata 字段（旧版 schema），元数据只保存在标量字段中")
+        scalar_fields = {}
+        for f in col.schema.fields:
+            if f.name not in ("pk", "embedding", "metadata"):
+                scalar_fields[f.name] = getattr(f.dtype, "name", str(f.dtype))
+        index_type = None
+        for index in col.indexes:
+            if index.field_name == "embedding":
+                index_type = index.params.get("index_type", "FLAT")
+        if index_type is None:
+            # 旧版集合创建时没有建索引，load() 前补建
+            index_type = self.INDEX_TYPES[settings.MILVUS_INDEX_TYPE.lower()]
+            col.create_index("embedding", self._index_params(index_type, None))
+        col.load()
+        handle = _MilvusHandle(col, index_type, scalar_fields, has_metadata)
+        self._handles[name] = handle
+        return handle
+
+    async def create_collection(self, name: str, dim: int, index_type: Optional[str] = None, nlist: Optional[int] = None) -> bool:
+        """index_type: flat | ivf_flat | hnsw，默认 MILVUS_INDEX_TYPE"""
+        if not self._available or dim <= 0:
+            return False
+        index_type = (index_type or settings.MILVUS_INDEX_TYPE).lower()
+        if index_type not in self.INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}")
+        await self._run(self._create_sync, name, dim, self.INDEX_TYPES[index_type], nlist)
         return True
 
     async def list_collections(self) -> List[str]:
         if not self._available:
             return []
-        from pymilvus import utility
-        return utility.list_collections()
+        return await self._run(self._client.utility.list_collections)
 
-    async def delete_collection(self, name: str) -> bool:
-        if not self._available:
-            return False
-        from pymilvus import utility
+    def _drop_sync(self, name: str) -> bool:
+        self._handles.pop(name, None)
+        utility = self._client.utility
         if utility.has_collection(name):
             utility.drop_collection(name)
             return True
         return False
 
+    async def delete_collection(self, name: str) -> bool:
+        if not self._available:
+            return False
+        return await self._run(self._drop_sync, name)
+
+    def _insert_sync(self, name: str, vectors: List[List[float]], metadatas: List[Dict[str, Any]]) -> List[str]:
+        handle = self._load_sync(name)
+        if handle is None:
+            raise ValueError(f"集合不存在: {name}")
+        scalars = handle.scalar_fields
+        batch = settings.MILVUS_INSERT_BATCH_SIZE
+        n = min(len(vectors), len(metadatas))
+        ids: List[str] = []
+        for start in range(0, n, batch):
+            vecs = vectors[start:start + batch]
+            metas = metadatas[start:start + batch]
+            if isinstance(vecs, np.ndarray):
+                vecs = vecs.tolist()
+            columns = [vecs]
+            if handle.has_metadata:
+                columns.append([{k: v for k, v in m.items() if k not in scalars} for m in metas])
+            for field, type_name in scalars.items():
+                default = self.SCALAR_DEFAULTS.get(type_name)
+                columns.append([m.get(field, default) for m in metas])
+            mr = handle.collection.insert(columns)
+            ids.extend(str(pk) for pk in getattr(mr, "primary_keys", []))
+        return ids
+
     async def upsert(self, name: str, vectors: List[List[float]], metadatas: List[Dict[str, Any]]) -> int:
         if not self._available:
             return 0
-        from pymilvus import Collection
-        col = Collection(name)
-        data = [vectors]
-        col.insert([data[0]])
-        return len(vectors)
+        return len(await self._run(self._insert_sync, name, vectors, metadatas))
 
     async def upsert_with_ids(self, name: str, vectors: List[List[float]], metadatas: List[Dict[str, Any]]) -> List[str]:
         if not self._available:
             return []
-        from pymilvus import Collection
-        col = Collection(name)
-        mr = col.insert([vectors])
-        return [str(pk) for pk in getattr(mr, "primary_keys", [])]
+        return await self._run(self._insert_sync, name, vectors, metadatas)
 
-    async def query(self, name: str, query_vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
-        if not self._available:
+    @staticmethod
+    def _filter_expr(
+        filters: Optional[Dict[str, Any]],
+        scalar_fields: Optional[Dict[str, str]] = None,
+        has_metadata: bool = True
+    ) -> Optional[str]:
+        """把元数据过滤条件转成 Milvus 布尔表达式，交给服务端在检索时应用"""
+        if not filters:
+            return None
+        clauses = []
+        for key, value in filters.items():
+            # 提升为标量字段的键直接按字段过滤（可走标量索引）
+            if scalar_fields and key in scalar_fields:
+                field = key
+            elif has_metadata:
+                field = f"metadata[{json.dumps(str(key))}]"
+            else:
+                raise ValueError(f"集合没有 metadata 字段（旧版 schema），不能按 {key} 过滤")
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f"{field} in {json.dumps(list(value), ensure_ascii=False)}")
+            else:
+                clauses.append(f"{field} == {json.dumps(value, ensure_ascii=False)}")
+        return " and ".join(clauses)
+
+    def _search_sync(self, name, query_vector, top_k, nprobe, filters, offset) -> List[Dict[str, Any]]:
+        handle = self._load_sync(name)
+        if handle is None:
             return []
-        from pymilvus import Collection
-        col = Collection(name)
-        res = col.search([query_vector], "embedding", params={"metric_type": "COSINE"}, limit=top_k, output_fields=["pk"])
+        params = self._search_params(handle.index_type, offset + top_k, nprobe)
+        if offset:
+            params["offset"] = offset
+        if isinstance(query_vector, np.ndarray):
+            query_vector = query_vector.tolist()
+        res = handle.collection.search(
+            [query_vector], "embedding", params, limit=top_k,
+            expr=self._filter_expr(filters, handle.scalar_fields, handle.has_metadata),
+            output_fields=["metadata", *handle.scalar_fields] if handle.has_metadata else list(handle.scalar_fields)
+        )
         out: List[Dict[str, Any]] = []
         for hits in res:
             for h in hits:
-                out.append({"pk": int(h.id), "score": float(h.distance)})
+                r = dict(h.entity.get("metadata") or {}) if handle.has_metadata else {}
+                for field in handle.scalar_fields:
+                    r[field] = h.entity.get(field)
+                r["score"] = float(h.distance)
+                r["pk"] = str(h.id)
+                out.append(r)
         return out
 
+    async def query(
+        self,
+        name: str,
+        query_vector: List[float],
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        if not self._available:
+            return []
+        return await self._run(self._search_sync, name, query_vector, top_k, nprobe, filters, offset)
+
 
 # Default to memory implementation for local/tests
 def get_vector_service():
@@ -131,11 +796,10 @@ def get_vector_service():
         svc = MilvusVectorService()
         if svc._available:
             try:
-                from pymilvus import connections
-                connections.connect(host=settings.MILVUS_HOST, port=str(settings.MILVUS_PORT), user=settings.MILVUS_USER, password=settings.MILVUS_PASSWORD)
+                svc.connect()
                 return svc
             except Exception:
                 pass
-    return MemoryVectorService()
+    return MemoryVectorService(settings.VECTOR_STORE_DIR)
 
 vector_service = get_vector_service()
@@ -0,0 +1,56 @@
+"""
+布隆过滤器
+"""
+import hashlib
+import math
+from typing import Iterable
+
+
+class BloomFilter:
+    """
+    布隆过滤器（进程内）
+    
+    判定不存在时一定不存在，判定存在时有 error_rate 概率误报。
+    使用双重哈希从一次 blake2b 摘要派生 k 个位置。
+    """
+    
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        初始化布隆过滤器
+        
+        Args:
+            capacity: 预期元素数量
+            error_rate: 达到预期容量时的误报率
+        """
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+    
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+    
+    def add(self, item: str):
+        """添加元素"""
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+    
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+    
+    @property
+    def is_saturated(self) -> bool:
+        """元素数量超过预期容量，误报率已高于设定值"""
+        return self.count > self.capacity
+    
+    def clear(self):
+        """清空过滤器"""
+        self._bits = bytearray(len(self._bits))
+        self.count = 0
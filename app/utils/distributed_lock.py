@@ -3,15 +3,19 @@ Redis 分布式锁
 """
 import asyncio
 import time
+import weakref
 from typing import Optional
 from uuid import uuid4
 
-from app.core.redis_client import redis_client
+from app.core.redis_client import redis_client, redis_breaker, RedisUnavailableError
 from app.utils.logger import logger
 
 
 class DistributedLock:
-    """Redis 分布式锁"""
+    """Redis 分布式锁（Redis 不可用时降级为进程内锁）"""
+    
+    # 降级时使用的进程内锁，无人持有时自动回收
+    _local_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
     
     def __init__(
         self, 
@@ -35,6 +39,7 @@ class DistributedLock:
         self.retry_delay = retry_delay
         self.identifier = str(uuid4())  # 唯一标识，用于安全释放锁
         self._locked = False
+        self._local_lock: Optional[asyncio.Lock] = None
     
     async def acquire(self) -> bool:
         """
@@ -43,14 +48,17 @@ class DistributedLock:
         Returns:
             是否成功获取锁
         """
+        if redis_breaker.is_open:
+            return await self._acquire_local()
+        
         for attempt in range(self.retry_times):
             try:
                 # 使用 SET NX EX 原子操作
-                result = await redis_client.redis.set(
+                result = await redis_client.set(
                     self.key,
                     self.identifier,
-                    nx=True,  # 只有键不存在时才设置
-                    ex=self.timeout  # 设置过期时间
+                    expire=self.timeout,  # 设置过期时间
+                    nx=True  # 只有键不存在时才设置
                 )
                 
                 if result:
@@ -62,6 +70,8 @@ class DistributedLock:
                 if attempt < self.retry_times - 1:
                     await asyncio.sleep(self.retry_delay)
                     
+            except RedisUnavailableError:
+                return await self._acquire_local()
             except Exception as e:
                 logger.error(f"获取锁失败: {self.key}, 错误: {e}")
                 return False
@@ -69,6 +79,22 @@ class DistributedLock:
         logger.warning(f"无法获取锁: {self.key}, 已重试 {self.retry_times} 次")
         return False
     
+    async def _acquire_local(self) -> bool:
+        """Redis 熔断时降级为进程内锁（仅保证本 worker 内互斥）"""
+        logger.warning(f"Redis 不可用，降级为进程内锁: {self.key}")
+        lock = DistributedLock._local_locks.get(self.key)
+        if lock is None:
+            lock = asyncio.Lock()
+            DistributedLock._local_locks[self.key] = lock
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout=self.retry_times * self.retry_delay)
+        except asyncio.TimeoutError:
+            logger.warning(f"无法获取进程内锁: {self.key}")
+            return False
+        self._local_lock = lock
+        self._locked = True
+        return True
+    
     async def release(self) -> bool:
         """
         释放锁（安全释放，只释放自己持有的锁）
@@ -79,6 +105,12 @@ class DistributedLock:
         if not self._locked:
             return False
         
+        if self._local_lock is not None:
+            self._local_lock.release()
+            self._local_lock = None
+            self._locked = False
+            return True
+        
         try:
             # 使用 Lua 脚本确保只释放自己的锁
             lua_script = """
@@ -89,7 +121,7 @@ class DistributedLock:
             end
             """
             
-            result = await redis_client.redis.eval(
+            result = await redis_client.eval(
                 lua_script,
                 1,
                 self.key,
@@ -121,6 +153,9 @@ class DistributedLock:
         if not self._locked:
             return False
         
+        if self._local_lock is not None:
+            return True
+        
         try:
             # 使用 Lua 脚本安全地延长锁时间
             lua_script = """
@@ -131,7 +166,7 @@ class DistributedLock:
             end
             """
             
-            result = await redis_client.redis.eval(
+            result = await redis_client.eval(
                 lua_script,
                 1,
                 self.key,
@@ -0,0 +1,172 @@
+"""
+文档解析
+
+函数在进程池中执行（见 IngestionService），只依赖标准库，解析库在函数内导入，
+子进程启动时不会加载应用的其他模块。大文档按页（PDF）/ 幻灯片（PPTX）/
+段落（DOCX）/ 行（Markdown、纯文本）分段解析，每个任务只返回一段的文本，
+主进程不需要一次持有整份文档。
+
+先由 plan() 扫描一遍文档，记下每段的起始位置，分段任务直接定位读取：
+纯文本按行定位；DOCX / PPTX 只解析一次，各单元的文本写入旁路文件，
+分段任务读旁路文件，不再为每段重新载入整份文档。
+"""
+import html
+import json
+import os
+import re
+import zipfile
+from typing import Iterator, List, Tuple
+from xml.etree import ElementTree
+
+
+# 扩展名 -> 文档类型
+DOCUMENT_TYPES = {
+    ".pdf": "pdf",
+    ".docx": "docx",
+    ".pptx": "pptx",
+    ".md": "md",
+    ".markdown": "md",
+    ".txt": "txt",
+}
+
+# 每个解析任务处理的单元数
+UNITS_PER_TASK = {
+    "pdf": 20,
+    "pptx": 20,
+    "docx": 500,
+    "md": 2000,
+    "txt": 2000,
+}
+
+# DOCX / PPTX 单元文本的旁路文件后缀（每行一个 JSON 字符串）
+UNITS_SUFFIX = ".units"
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _open_text(path: str):
+    # 分段计划与解析必须用同一种方式读行（文本模式、通用换行），定位才对得上
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def detect_type(filename: str) -> str:
+    """按扩展名判断文档类型，不支持时返回空字符串"""
+    return DOCUMENT_TYPES.get(os.path.splitext(filename or "")[1].lower(), "")
+
+
+def _docx_paragraphs(path: str) -> Iterator[str]:
+    """流式读取 word/document.xml，按顺序产出正文段落（与 python-docx 的 paragraphs 一致，不含表格）"""
+    with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+        depth = 0
+        body = None
+        for event, elem in ElementTree.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 2 and elem.tag == _W + "body":
+                    body = elem
+                continue
+            depth -= 1
+            if depth != 2 or body is None:
+                continue
+            if elem.tag == _W + "p":
+                parts = []
+                for node in elem.iter():
+                    if node.tag == _W + "t":
+                        parts.append(node.text or "")
+                    elif node.tag == _W + "tab":
+                        parts.append("\t")
+                    elif node.tag in (_W + "br", _W + "cr"):
+                        parts.append("\n")
+                yield "".join(parts)
+            # 已处理的正文元素随即释放，内存与文档大小无关
+            body.clear()
+
+
+def _pptx_slides(path: str) -> Iterator[str]:
+    from pptx import Presentation
+    for slide in Presentation(path).slides:
+        texts = [
+            shape.text_frame.text
+            for shape in slide.shapes
+            if shape.has_text_frame and shape.text_frame.text
+        ]
+        yield "\n".join(texts)
+
+
+def plan(path: str, kind: str) -> Tuple[str, List[Tuple[int, int, int]]]:
+    """
+    分段计划
+    
+    Returns:
+        (分段任务读取的文件, [(起始单元, 结束单元, 起始位置)])；
+        txt / md 的位置是原文件中的读取位置，docx / pptx 是旁路文件 path + UNITS_SUFFIX 中的字节偏移，
+        pdf 不需要位置（PdfReader 按页延迟解析）
+    """
+    step = UNITS_PER_TASK[kind]
+    offsets: List[int] = []
+    if kind == "pdf":
+        from pypdf import PdfReader
+        total = len(PdfReader(path).pages)
+        offsets = [0] * ((total + step - 1) // step)
+        source = path
+    elif kind in ("docx", "pptx"):
+        units = _docx_paragraphs(path) if kind == "docx" else _pptx_slides(path)
+        source = path + UNITS_SUFFIX
+        total = 0
+        with open(source, "wb") as f:
+            for text in units:
+                if total % step == 0:
+                    offsets.append(f.tell())
+                f.write(json.dumps(text, ensure_ascii=False).encode() + b"\n")
+                total += 1
+    else:
+        source = path
+        total = 0
+        with _open_text(path) as f:
+            # readline 之间才能 tell()；每段只记一次位置
+            while True:
+                position = f.tell() if total % step == 0 else None
+                if not f.readline():
+                    break
+                if position is not None:
+                    offsets.append(position)
+                total += 1
+    ranges = [(i * step, min((i + 1) * step, total), offset) for i, offset in enumerate(offsets)]
+    return source, ranges
+
+
+def _markdown_to_text(source: str) -> str:
+    import markdown
+    rendered = markdown.markdown(source)
+    # 块级元素结束处换行，其余标签去掉
+    rendered = re.sub(r"</(p|h[1-6]|li|pre|blockquote|tr)>", "\n", rendered)
+    return html.unescape(re.sub(r"<[^>]+>", "", rendered))
+
+
+def parse_range(path: str, kind: str, start: int, end: int, offset: int = 0) -> List[Tuple[int, str]]:
+    """
+    解析 [start, end) 范围内的单元
+    
+    path、offset 取自 plan() 的结果
+    
+    Returns:
+        [(页码, 文本)]，页码从 1 开始；DOCX / Markdown / 纯文本没有页的概念，
+        整段作为一项，页码取起始单元序号
+    """
+    if kind == "pdf":
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        return [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, end)]
+    if kind in ("docx", "pptx"):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            units = [json.loads(f.readline()) for _ in range(end - start)]
+        if kind == "pptx":
+            return [(start + i + 1, text) for i, text in enumerate(units)]
+        return [(start + 1, "\n".join(text for text in units if text))]
+    with _open_text(path) as f:
+        f.seek(offset)
+        text = "".join(f.readline() for _ in range(end - start))
+    if kind == "md":
+        text = _markdown_to_text(text)
+    return [(start + 1, text)]
@@ -50,8 +50,14 @@ class ConflictException(BaseAPIException):
 
 class RateLimitException(BaseAPIException):
     """限流异常"""
-    def __init__(self, message: str = "请求过于频繁"):
-        super().__init__(message=message, status_code=429)
+    def __init__(self, message: str = "请求过于频繁", detail: Optional[Any] = None):
+        super().__init__(message=message, status_code=429, detail=detail)
+
+
+class ServiceUnavailableException(BaseAPIException):
+    """服务繁忙异常"""
+    def __init__(self, message: str = "服务繁忙，请稍后再试"):
+        super().__init__(message=message, status_code=503)
 
 
 class AIServiceException(BaseAPIException):
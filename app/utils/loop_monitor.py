@@ -0,0 +1,171 @@
+"""
+事件循环延迟监控
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.logger import logger
+
+
+class LoopMonitor:
+    """
+    事件循环延迟监控
+    
+    一个协程按固定间隔休眠，实际唤醒时间与预期之差即为循环延迟（有其他回调
+    阻塞事件循环时延迟增大）。每次采样只有一次 sleep 和几次加法，可以常开。
+    
+    开启栈采集时另起一个守护线程：若事件循环超过阈值没有心跳，
+    抓取事件循环线程当前的调用栈并记录日志，用于定位阻塞调用。
+    """
+    
+    # 延迟直方图分桶上界（秒）
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.1, capture_stacks: bool = False):
+        """
+        初始化监控器
+        
+        Args:
+            interval: 采样间隔（秒）
+            block_threshold: 判定为阻塞的延迟阈值（秒）
+            capture_stacks: 是否采集阻塞时的调用栈
+        """
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.capture_stacks = capture_stacks
+        
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.lag_sum = 0.0
+        self.samples = 0
+        self.blocked = 0
+        self.bucket_counts: List[int] = [0] * len(self.BUCKETS)
+        
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.monotonic()
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+    
+    def start(self):
+        """启动监控（需在事件循环中调用）"""
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+        if self.capture_stacks:
+            self._stop_event.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-monitor-watchdog", daemon=True
+            )
+            self._watchdog.start()
+    
+    async def stop(self):
+        """停止监控"""
+        task, self._task = self._task, None
+        self._stop_event.set()
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+    
+    async def _run(self):
+        interval = self.interval
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self._record(max(0.0, now - start - interval))
+    
+    def _record(self, lag: float):
+        self.last_lag = lag
+        self.lag_sum += lag
+        self.samples += 1
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if lag >= self.block_threshold:
+            self.blocked += 1
+        for i, bound in enumerate(self.BUCKETS):
+            if lag <= bound:
+                self.bucket_counts[i] += 1
+                break
+    
+    def _watch(self):
+        """守护线程：心跳超时时抓取事件循环线程的调用栈"""
+        reported_heartbeat = None
+        check_interval = max(self.block_threshold / 2, 0.01)
+        while not self._stop_event.wait(check_interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.block_threshold or heartbeat == reported_heartbeat:
+                continue
+            # 每次阻塞只报告一次
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(f"事件循环已阻塞 {stalled * 1000:.0f}ms，当前调用栈:\n{stack}")
+    
+    def snapshot(self) -> Dict[str, float]:
+        """当前指标"""
+        return {
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "mean_lag_seconds": self.lag_sum / self.samples if self.samples else 0.0,
+            "samples": self.samples,
+            "blocked": self.blocked,
+        }
+    
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式的指标"""
+        lines = [
+            "# HELP event_loop_lag_seconds Event loop scheduling lag.",
+            "# TYPE event_loop_lag_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS, self.bucket_counts):
+            cumulative += count
+            lines.append(f'event_loop_lag_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'event_loop_lag_seconds_bucket{{le="+Inf"}} {self.samples}')
+        lines.append(f"event_loop_lag_seconds_sum {self.lag_sum}")
+        lines.append(f"event_loop_lag_seconds_count {self.samples}")
+        lines += [
+            "# HELP event_loop_lag_last_seconds Most recent event loop lag sample.",
+            "# TYPE event_loop_lag_last_seconds gauge",
+            f"event_loop_lag_last_seconds {self.last_lag}",
+            "# HELP event_loop_lag_max_seconds Maximum event loop lag since start.",
+            "# TYPE event_loop_lag_max_seconds gauge",
+            f"event_loop_lag_max_seconds {self.max_lag}",
+            "# HELP event_loop_blocked_total Samples with lag above the block threshold.",
+            "# TYPE event_loop_blocked_total counter",
+            f"event_loop_blocked_total {self.blocked}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+# 全局监控实例
+loop_monitor = LoopMonitor(
+    interval=settings.LOOP_MONITOR_INTERVAL,
+    block_threshold=settings.LOOP_MONITOR_BLOCK_THRESHOLD,
+    capture_stacks=(
+        settings.DEBUG if settings.LOOP_MONITOR_CAPTURE_STACKS is None
+        else settings.LOOP_MONITOR_CAPTURE_STACKS
+    )
+)
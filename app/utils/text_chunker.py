@@ -0,0 +1,90 @@
+"""
+按 token 切分文本
+"""
+import re
+from typing import List, NamedTuple, Tuple
+
+
+# 近似 BERT 类分词器的切分：CJK 每字一个 token，连续字母数字一个 token，其余符号各一个；
+# 每个 token 带上其后的空白，拼接后可还原原文
+_TOKEN_PATTERN = re.compile(
+    r"(?:[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_])\s*"
+)
+# 句末符号，用于尽量在句子边界处切分
+_SENTENCE_END = re.compile(r"[。！？；.!?;\n]\s*$")
+
+
+def count_tokens(text: str) -> int:
+    """近似 token 数"""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+class Chunk(NamedTuple):
+    text: str
+    page_start: int
+    page_end: int
+    tokens: int
+
+
+class TokenChunker:
+    """
+    流式切分器
+    
+    逐页 feed 文本，累计满 chunk_tokens 个 token 即输出一块，相邻块重叠 overlap 个 token。
+    块尾优先落在句末（在块的后 1/4 范围内查找），避免把句子截断。
+    只缓存尚未输出的 token，内存占用与文档大小无关。
+    """
+    
+    def __init__(self, chunk_tokens: int = 512, overlap: int = 64):
+        if overlap >= chunk_tokens:
+            raise ValueError("overlap 必须小于 chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.overlap = overlap
+        # (token 文本, 页码)
+        self._tokens: List[Tuple[str, int]] = []
+        self._emitted = False
+    
+    def feed(self, page: int, text: str) -> List[Chunk]:
+        """加入一页文本，返回已凑满的块"""
+        tokens = _TOKEN_PATTERN.findall(text)
+        if not tokens:
+            return []
+        # 页与页之间至少隔一个换行
+        if not tokens[-1].endswith("\n"):
+            tokens[-1] = tokens[-1].rstrip() + "\n"
+        self._tokens.extend((t, page) for t in tokens)
+        chunks = []
+        while len(self._tokens) >= self.chunk_tokens:
+            chunks.append(self._emit(self._split_point()))
+        return chunks
+    
+    def flush(self) -> List[Chunk]:
+        """输出剩余内容"""
+        if len(self._tokens) <= self.overlap and self._emitted:
+            # 剩余部分已全部包含在上一块的重叠区
+            self._tokens = []
+            return []
+        if not self._tokens:
+            return []
+        chunk = self._make(self._tokens)
+        self._tokens = []
+        return [chunk]
+    
+    def _split_point(self) -> int:
+        end = self.chunk_tokens
+        lower = max(self.overlap + 1, end - end // 4)
+        for i in range(end, lower - 1, -1):
+            if _SENTENCE_END.search(self._tokens[i - 1][0]):
+                return i
+        return end
+    
+    def _emit(self, end: int) -> Chunk:
+        chunk = self._make(self._tokens[:end])
+        self._tokens = self._tokens[end - self.overlap:]
+        self._emitted = True
+        return chunk
+    
+    @staticmethod
+    def _make(tokens: List[Tuple[str, int]]) -> Chunk:
+        text = "".join(t for t, _ in tokens).strip()
+        return Chunk(text, tokens[0][1], tokens[-1][1], len(tokens))
@@ -0,0 +1,35 @@
+"""
+启动 Embedding 模型服务
+
+所有 uvicorn worker 通过 EMBEDDING_SERVER_SOCKET 共用这一个进程中的模型。
+
+用法:
+    EMBEDDING_SERVER_SOCKET=/tmp/embedding.sock python scripts/embedding_server.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.config import settings
+from app.services.embedding_server import EmbeddingServer
+from app.services.embedding_service import embedding_engine
+from app.utils.logger import logger
+
+
+def main():
+    if not settings.EMBEDDING_SERVER_SOCKET:
+        logger.error("未配置 EMBEDDING_SERVER_SOCKET")
+        sys.exit(1)
+    
+    server = EmbeddingServer(settings.EMBEDDING_SERVER_SOCKET, embedding_engine)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        logger.info("Embedding 模型服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import os
 import pytest
 import pytest_asyncio
 import asyncio
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
@@ -27,6 +28,20 @@ from app.core import redis_client as redis_module
 from app.models.knowledge import KBItem
 
 
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.command_stack = []
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self.command_stack.append((name, args, kwargs))
+            return self
+        return queue
+    async def execute(self):
+        stack, self.command_stack = self.command_stack, []
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in stack]
+
+
 class FakeRedis:
     def __init__(self):
         self.store = {}
@@ -37,8 +52,11 @@ class FakeRedis:
         return None
     async def get(self, key: str):
         return self.store.get(key)
-    async def set(self, key: str, value: str, expire: int | None = None):
+    async def set(self, key: str, value: str, expire: int | None = None, nx: bool = False, ex: int | None = None) -> bool:
+        if nx and key in self.store:
+            return False
         self.store[key] = value
+        return True
     async def delete(self, key: str):
         self.store.pop(key, None)
     async def exists(self, key: str) -> bool:
@@ -61,13 +79,48 @@ class FakeRedis:
     async def ltrim(self, key: str, start: int, end: int):
         lst = self.store.get(key, [])
         self.store[key] = lst[start:end+1]
-    async def hset(self, name: str, key: str, value: str):
+    async def hset(self, name: str, key: str | None = None, value: str | None = None, mapping: dict | None = None):
         h = self.hash.setdefault(name, {})
-        h[key] = value
+        if key is not None:
+            h[key] = value
+        h.update(mapping or {})
     async def hget(self, name: str, key: str):
         return self.hash.get(name, {}).get(key)
     async def hgetall(self, name: str) -> dict:
         return dict(self.hash.get(name, {}))
+    async def zadd(self, name: str, mapping: dict) -> int:
+        z = self.hash.setdefault(name, {})
+        added = len(set(mapping) - set(z))
+        z.update(mapping)
+        return added
+    async def zrangebyscore(self, name: str, min, max) -> list:
+        z = self.hash.get(name, {})
+        return [m for m, score in sorted(z.items(), key=lambda i: i[1]) if float(min) <= score <= float(max)]
+    async def zremrangebyscore(self, name: str, min, max) -> int:
+        z = self.hash.get(name, {})
+        removed = [m for m, score in z.items() if float(min) <= score <= float(max)]
+        for m in removed:
+            del z[m]
+        return len(removed)
+    async def mget_bytes(self, keys: list) -> list:
+        return [self.store.get(k) for k in keys]
+    async def set_many_bytes(self, mapping: dict, expire: int | None = None):
+        self.store.update(mapping)
+    async def publish(self, channel: str, message: str) -> int:
+        return 0
+    async def eval(self, script: str, numkeys: int, *keys_and_args):
+        key, identifier = keys_and_args[0], keys_and_args[1]
+        if self.store.get(key) != identifier:
+            return 0
+        if "del" in script:
+            self.store.pop(key, None)
+        return 1
+    @asynccontextmanager
+    async def pipeline(self, transaction: bool = False):
+        pipe = FakePipeline(self)
+        yield pipe
+        if pipe.command_stack:
+            await pipe.execute()
 
 
 # 测试数据库 URL（指向 Postgres 的测试库）
@@ -115,6 +168,8 @@ async def client(db_session: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
     rl.redis_client = fake
     from app.services import cache_service as cs
     cs.redis_client = fake
+    from app.services import embedding_cache as ec
+    ec.redis_client = fake
     
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
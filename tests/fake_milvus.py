@@ -0,0 +1,158 @@
+"""
+pymilvus 的进程内替身
+
+只实现 MilvusVectorService 用到的接口：connections、utility、Collection、
+CollectionSchema、FieldSchema、DataType。检索按余弦相似度暴力计算，
+expr 支持服务生成的子集（字段或 metadata["键"] 的 == / in，以 and 连接）。
+"""
+import enum
+import json
+import re
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class DataType(enum.Enum):
+    INT64 = 5
+    DOUBLE = 11
+    BOOL = 1
+    VARCHAR = 21
+    JSON = 23
+    FLOAT_VECTOR = 101
+
+
+class FieldSchema:
+    def __init__(self, name: str, dtype: DataType, is_primary: bool = False, auto_id: bool = False, **params):
+        self.name = name
+        self.dtype = dtype
+        self.is_primary = is_primary
+        self.auto_id = auto_id
+        self.params = params
+
+
+class CollectionSchema:
+    def __init__(self, fields: List[FieldSchema]):
+        self.fields = fields
+
+
+class Index:
+    def __init__(self, field_name: str, params: Dict[str, Any]):
+        self.field_name = field_name
+        self.params = params
+
+
+class Hit:
+    def __init__(self, pk: int, distance: float, entity: Dict[str, Any]):
+        self.id = pk
+        self.distance = distance
+        self.entity = entity
+
+
+_CLAUSE = re.compile(r'^(?:metadata\[("(?:[^"\\]|\\.)*")\]|(\w+)) (==|in) (.+)$')
+
+
+def _matches(row: Dict[str, Any], expr: Optional[str]) -> bool:
+    if not expr:
+        return True
+    for clause in expr.split(" and "):
+        m = _CLAUSE.match(clause)
+        if m is None:
+            raise ValueError(f"无法解析的表达式: {clause}")
+        json_key, field, op, literal = m.groups()
+        actual = (row.get("metadata") or {}).get(json.loads(json_key)) if json_key else row.get(field)
+        expected = json.loads(literal)
+        if op == "==" and actual != expected:
+            return False
+        if op == "in" and actual not in expected:
+            return False
+    return True
+
+
+class Collection:
+    """集合数据保存在类属性 _store 中，按名称共享（与服务端行为一致）"""
+    
+    _store: Dict[str, Dict[str, Any]] = {}
+    
+    def __init__(self, name: str, schema: Optional[CollectionSchema] = None):
+        if schema is not None:
+            Collection._store[name] = {"schema": schema, "rows": [], "indexes": [], "loaded": False}
+        elif name not in Collection._store:
+            raise ValueError(f"collection not found: {name}")
+        self.name = name
+        self._data = Collection._store[name]
+        self.last_search: Dict[str, Any] = {}
+    
+    @property
+    def schema(self) -> CollectionSchema:
+        return self._data["schema"]
+    
+    @property
+    def indexes(self) -> List[Index]:
+        return self._data["indexes"]
+    
+    def create_index(self, field_name: str, params: Dict[str, Any]):
+        self._data["indexes"].append(Index(field_name, params))
+    
+    def load(self):
+        if not any(i.field_name == "embedding" for i in self.indexes):
+            raise RuntimeError("index not found")
+        self._data["loaded"] = True
+    
+    def insert(self, columns: List[List[Any]]):
+        # 列顺序与 schema 中除自增主键外的字段一致
+        names = [f.name for f in self.schema.fields if not f.auto_id]
+        if len(columns) != len(names):
+            raise ValueError(f"列数不匹配: 期望 {len(names)}, 实际 {len(columns)}")
+        rows = self._data["rows"]
+        keys = []
+        for values in zip(*columns):
+            pk = len(rows) + 1
+            rows.append({"pk": pk, **dict(zip(names, values))})
+            keys.append(pk)
+        return SimpleNamespace(primary_keys=keys, insert_count=len(keys))
+    
+    def search(self, data, anns_field, param, limit, expr=None, output_fields=None):
+        if not self._data["loaded"]:
+            raise RuntimeError("collection not loaded")
+        self.last_search = {"param": param, "expr": expr, "output_fields": output_fields}
+        results = []
+        for query in data:
+            q = np.asarray(query, dtype=np.float64)
+            q = q / (np.linalg.norm(q) or 1.0)
+            scored = []
+            for row in self._data["rows"]:
+                if not _matches(row, expr):
+                    continue
+                v = np.asarray(row[anns_field], dtype=np.float64)
+                scored.append((float(q @ (v / (np.linalg.norm(v) or 1.0))), row))
+            scored.sort(key=lambda item: -item[0])
+            offset = param.get("offset", 0)
+            results.append([
+                Hit(row["pk"], score, {f: row.get(f) for f in output_fields or []})
+                for score, row in scored[offset:offset + limit]
+            ])
+        return results
+
+
+class utility:
+    @staticmethod
+    def has_collection(name: str) -> bool:
+        return name in Collection._store
+    
+    @staticmethod
+    def list_collections() -> List[str]:
+        return list(Collection._store)
+    
+    @staticmethod
+    def drop_collection(name: str):
+        Collection._store.pop(name, None)
+
+
+connections = SimpleNamespace(connect=lambda **kwargs: None)
+
+
+def reset():
+    """清空所有集合"""
+    Collection._store.clear()
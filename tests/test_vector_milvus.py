@@ -0,0 +1,100 @@
+"""
+MilvusVectorService 对接进程内替身的测试
+"""
+import pytest
+
+from app.core.config import settings
+from app.services.vector_service import MilvusVectorService
+from tests import fake_milvus
+
+
+@pytest.fixture
+def milvus(monkeypatch):
+    fake_milvus.reset()
+    monkeypatch.setattr(settings, "MILVUS_SCALAR_FIELDS", {"doc_id": "VARCHAR"})
+    monkeypatch.setattr(settings, "MILVUS_INDEX_TYPE", "hnsw")
+    svc = MilvusVectorService(fake_milvus)
+    yield svc
+    svc.close()
+    fake_milvus.reset()
+
+
+VECTORS = [[1.0, 0.0], [0.9, 0.1], [0.7, 0.3], [0.0, 1.0]]
+METADATAS = [
+    {"doc_id": "a", "lang": "zh", "chunk": 0},
+    {"doc_id": "a", "lang": "en", "chunk": 1},
+    {"doc_id": "b", "lang": "zh", "chunk": 0},
+    {"lang": "zh", "chunk": 2},
+]
+
+
+@pytest.mark.asyncio
+async def test_create_upsert_query(milvus):
+    assert await milvus.create_collection("kb", 2)
+    schema = fake_milvus.Collection("kb").schema
+    assert [f.name for f in schema.fields] == ["pk", "embedding", "metadata", "doc_id"]
+    index = fake_milvus.Collection("kb").indexes[0]
+    assert index.params["index_type"] == "HNSW"
+    
+    ids = await milvus.upsert_with_ids("kb", VECTORS, METADATAS)
+    assert ids == ["1", "2", "3", "4"]
+    rows = fake_milvus.Collection._store["kb"]["rows"]
+    # 标量字段单独成列，其余键进入 JSON 字段；缺失的标量取缺省值
+    assert rows[0]["doc_id"] == "a" and rows[0]["metadata"] == {"lang": "zh", "chunk": 0}
+    assert rows[3]["doc_id"] == ""
+    
+    hits = await milvus.query("kb", [1.0, 0.0], top_k=2)
+    assert [h["pk"] for h in hits] == ["1", "2"]
+    assert hits[0]["doc_id"] == "a" and hits[0]["lang"] == "zh"
+    assert hits[0]["score"] == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_query_filters_and_offset(milvus):
+    await milvus.create_collection("kb", 2)
+    await milvus.upsert_with_ids("kb", VECTORS, METADATAS)
+    
+    # 标量字段 + JSON 字段组合过滤
+    hits = await milvus.query("kb", [1.0, 0.0], top_k=5, filters={"doc_id": "a", "lang": "zh"})
+    assert [h["pk"] for h in hits] == ["1"]
+    
+    # 列表表示属于其中之一
+    hits = await milvus.query("kb", [1.0, 0.0], top_k=5, filters={"doc_id": ["a", "b"]})
+    assert [h["pk"] for h in hits] == ["1", "2", "3"]
+    
+    # offset 下推到服务端
+    hits = await milvus.query("kb", [1.0, 0.0], top_k=2, filters={"lang": "zh"}, offset=1)
+    assert [h["pk"] for h in hits] == ["3", "4"]
+    last = milvus._handles["kb"].collection.last_search
+    assert last["param"]["offset"] == 1
+    assert last["param"]["params"]["ef"] >= 3
+
+
+def test_filter_expr():
+    expr = MilvusVectorService._filter_expr(
+        {"doc_id": "a", "lang": ["zh", "en"], "chunk": 1}, {"doc_id": "VARCHAR"}
+    )
+    assert expr == 'doc_id == "a" and metadata["lang"] in ["zh", "en"] and metadata["chunk"] == 1'
+    assert MilvusVectorService._filter_expr(None) is None
+    with pytest.raises(ValueError):
+        MilvusVectorService._filter_expr({"lang": "zh"}, {}, has_metadata=False)
+
+
+@pytest.mark.asyncio
+async def test_legacy_collection_without_metadata(milvus):
+    m = fake_milvus
+    m.Collection("old", m.CollectionSchema([
+        m.FieldSchema(name="pk", dtype=m.DataType.INT64, is_primary=True, auto_id=True),
+        m.FieldSchema(name="embedding", dtype=m.DataType.FLOAT_VECTOR, dim=2),
+        m.FieldSchema(name="doc_id", dtype=m.DataType.VARCHAR, max_length=64),
+    ]))
+    
+    ids = await milvus.upsert_with_ids("old", VECTORS[:2], METADATAS[:2])
+    assert ids == ["1", "2"]
+    # 旧集合没有索引，加载前补建
+    assert m.Collection("old").indexes[0].field_name == "embedding"
+    
+    hits = await milvus.query("old", [1.0, 0.0], top_k=5, filters={"doc_id": "a"})
+    assert [(h["pk"], h["doc_id"]) for h in hits] == [("1", "a"), ("2", "a")]
+    with pytest.raises(ValueError):
+        await milvus.query("old", [1.0, 0.0], filters={"lang": "zh"})